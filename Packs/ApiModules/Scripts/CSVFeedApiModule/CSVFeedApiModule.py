@@ -4,20 +4,30 @@ from CommonServerUserPython import *
 
 ''' IMPORTS '''
 import csv
-import gzip
+import codecs
+import itertools
+import zlib
 import urllib3
+from urllib.parse import urlparse
 from dateutil.parser import parse
 from typing import Optional, Pattern, Dict, Any, Tuple, Union
 
 # disable insecure warnings
 urllib3.disable_warnings()
 
+INDICATORS_BATCH_SIZE = 2000
+CHUNK_SIZE = 64 * 1024
+# zlib window bits for decompressing a gzip stream (with its header and trailer)
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
 
 class Client(BaseClient):
     def __init__(self, url: str, feed_url_to_config: Optional[Dict[str, dict]] = None, fieldnames: str = '',
                  insecure: bool = False, credentials: dict = None, ignore_regex: str = None, encoding: str = 'latin-1',
                  delimiter: str = ',', doublequote: bool = True, escapechar: str = '',
                  quotechar: str = '"', skipinitialspace: bool = False, polling_timeout: int = 20, proxy: bool = False,
+                 max_concurrent_downloads: int = DEFAULT_MAX_WORKERS, max_downloads_per_host: int = 2,
+                 conditional_fetch: bool = False, delta_fetch: bool = False, delta_report_removed: bool = False,
                  **kwargs):
         """
         :param url: URL of the feed.
@@ -59,6 +69,14 @@ class Client(BaseClient):
             <https://docs.python.org/2/library/csv.html#dialects-and-formatting-parameters>`. Default False
         :param polling_timeout: timeout of the polling request in seconds. Default: 20
         :param proxy: Sets whether use proxy when sending requests
+        :param max_concurrent_downloads: The maximal number of feed URLs to download concurrently.
+        :param max_downloads_per_host: The maximal number of feed URLs to download concurrently from the same host.
+        :param conditional_fetch: boolean, if *true* fetch sends conditional requests (ETag / Last-Modified) and skips
+            the feed URLs whose content did not change since the last fetch. Default: *false*
+        :param delta_fetch: boolean, if *true* fetch submits only the indicators that were added or changed since the
+            last fetch. Default: *false*
+        :param delta_report_removed: boolean, if *true* the indicators that were removed from the feed since the last
+            fetch are reported in the integration log. Requires *delta_fetch*. Default: *false*
         """
         if not credentials:
             credentials = {}
@@ -96,6 +114,12 @@ class Client(BaseClient):
             'quotechar': quotechar,
             'skipinitialspace': skipinitialspace
         }
+        self.max_concurrent_downloads = int(max_concurrent_downloads)
+        self.max_downloads_per_host = int(max_downloads_per_host)
+        self.download_session = create_pooled_session(pool_maxsize=self.max_concurrent_downloads)
+        self.conditional_fetch = argToBoolean(conditional_fetch)
+        self.delta_fetch = argToBoolean(delta_fetch)
+        self.delta_report_removed = argToBoolean(delta_report_removed)
 
     def _build_request(self, url):
         r = requests.Request(
@@ -106,43 +130,71 @@ class Client(BaseClient):
 
         return r.prepare()
 
-    def build_iterator(self, **kwargs):
+    def _download(self, url, fetch_cache: Optional[FeedFetchCache] = None, **kwargs):
+        prepreq = self._build_request(url)
+        if fetch_cache is not None:
+            prepreq.headers.update(fetch_cache.get_request_headers(url))
+
+        # this is to honour the proxy environment variables
+        kwargs.update(self.download_session.merge_environment_settings(
+            prepreq.url,
+            {}, None, None, None  # defaults
+        ))
+        kwargs['stream'] = True
+        kwargs['verify'] = self._verify
+        kwargs['timeout'] = self.polling_timeout
+
+        if self.headers:
+            if 'headers' in kwargs:
+                kwargs['headers'] = dict(kwargs['headers'], **self.headers)
+            else:
+                kwargs['headers'] = self.headers
+
+        try:
+            r = self.download_session.send(prepreq, **kwargs)
+        except requests.ConnectionError:
+            raise requests.ConnectionError('Failed to establish a new connection.'
+                                           ' Please make sure your URL is valid.')
+        try:
+            r.raise_for_status()
+        except Exception:
+            return_error('Exception in request: {} {}'.format(r.status_code, r.content))
+            raise
+
+        if fetch_cache is not None and fetch_cache.is_unchanged(url, response=r):
+            return None
+        # the content is read here, so the feeds are downloaded concurrently and the connection is released to the
+        # pool before the feeds are parsed
+        spool, content_hash = FeedFetchCache.spool_response(r, chunk_size=CHUNK_SIZE)
+        if fetch_cache is not None:
+            if fetch_cache.is_unchanged(url, content_hash=content_hash):
+                spool.close()
+                return None
+            fetch_cache.update(url, r, content_hash)
+        return self.divide_chunks_to_lines(url, iterate_spooled_chunks(spool))
+
+    def build_iterator(self, fetch_cache: Optional[FeedFetchCache] = None, **kwargs):
+        """
+        For each URL, download the feed and return a CSV reader of its content.
+        :param fetch_cache: If given, conditional requests are sent and URLs whose content did not change since the
+            last fetch are skipped.
+        :param kwargs: Arguments to send to the HTTP API endpoint
+        :return: List of dictionaries mapping each URL to its CSV reader
+        """
         results = []
         urls = self._base_url
         if not isinstance(urls, list):
             urls = [urls]
-        for url in urls:
-            _session = requests.Session()
-
-            prepreq = self._build_request(url)
-
-            # this is to honour the proxy environment variables
-            kwargs.update(_session.merge_environment_settings(
-                prepreq.url,
-                {}, None, None, None  # defaults
-            ))
-            kwargs['stream'] = True
-            kwargs['verify'] = self._verify
-            kwargs['timeout'] = self.polling_timeout
-
-            if self.headers:
-                if 'headers' in kwargs:
-                    kwargs['headers'].update(self.headers)
-                else:
-                    kwargs['headers'] = self.headers
-
-            try:
-                r = _session.send(prepreq, **kwargs)
-            except requests.ConnectionError:
-                raise requests.ConnectionError('Failed to establish a new connection.'
-                                               ' Please make sure your URL is valid.')
-            try:
-                r.raise_for_status()
-            except Exception:
-                return_error('Exception in request: {} {}'.format(r.status_code, r.content))
-                raise
-
-            response = self.get_feed_content_divided_to_lines(url, r)
+
+        # the feeds are downloaded concurrently, and parsed in the order of the URLs
+        responses = execute_concurrently(lambda url: self._download(url, fetch_cache, **kwargs), urls,
+                                         max_workers=self.max_concurrent_downloads,
+                                         key_func=lambda url: urlparse(url).netloc,
+                                         max_workers_per_key=self.max_downloads_per_host)
+        for url, response in zip(urls, responses):
+            if response is None:
+                demisto.debug(f'{url} did not change since the last fetch, skipping it')
+                continue
             if self.feed_url_to_config:
                 fieldnames = self.feed_url_to_config.get(url, {}).get('fieldnames', [])
             else:
@@ -164,21 +216,71 @@ class Client(BaseClient):
         return results
 
     def get_feed_content_divided_to_lines(self, url, raw_response):
-        """Fetch feed data and divides its content to lines
+        """Streams the feed data and divides its content to lines
 
         Args:
             url: Current feed's url.
             raw_response: The raw response from the feed's url.
 
         Returns:
-            List. List of lines from the feed content.
+            Iterator. The lines of the feed content.
         """
-        if self.feed_url_to_config and self.feed_url_to_config.get(url).get('is_zipped_file'):  # type: ignore
-            response_content = gzip.decompress(raw_response.content)
-        else:
-            response_content = raw_response.content
+        return self.divide_chunks_to_lines(url, raw_response.iter_content(chunk_size=CHUNK_SIZE))
 
-        return response_content.decode(self.encoding).split('\n')
+    def divide_chunks_to_lines(self, url, chunks):
+        """Divides the content of a feed to lines, decompressing and decoding it incrementally, so only a single
+        chunk of the content is held in memory at a time.
+
+        Args:
+            url: Current feed's url.
+            chunks: Iterable of the bytes chunks of the feed's content.
+
+        Returns:
+            Iterator. The lines of the feed content.
+        """
+        is_zipped_file = self.feed_url_to_config and self.feed_url_to_config.get(url).get('is_zipped_file')  # type: ignore
+        if is_zipped_file:
+            chunks = gunzip_chunks(chunks)
+        decoder = codecs.getincrementaldecoder(self.encoding)()
+        partial_line = ''
+        for chunk in chunks:
+            lines = (partial_line + decoder.decode(chunk)).split('\n')
+            partial_line = lines.pop()
+            yield from lines
+        yield from (partial_line + decoder.decode(b'', final=True)).split('\n')
+
+
+def iterate_spooled_chunks(spool):
+    """Reads a spooled feed in chunks, and closes the spool once it was read.
+
+    Args:
+        spool: The temporary file the feed was spooled to.
+
+    Returns:
+        Iterator. The bytes chunks of the feed.
+    """
+    with spool:
+        yield from iter(lambda: spool.read(CHUNK_SIZE), b'')
+
+
+def gunzip_chunks(chunks):
+    """Decompresses a gzip stream incrementally, including streams of multiple gzip members.
+
+    Args:
+        chunks: Iterable of the compressed bytes chunks.
+
+    Returns:
+        Iterator. The decompressed bytes chunks.
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            chunk = b''
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+    yield decompressor.flush()
 
 
 def determine_indicator_type(indicator_type, default_indicator_type, value):
@@ -240,40 +342,51 @@ def create_fields_mapping(raw_json: Dict[str, Any], mapping: Dict[str, Union[Tup
     return fields_mapping
 
 
-def fetch_indicators_command(client: Client, default_indicator_type: str, **kwargs):
-    iterator = client.build_iterator(**kwargs)
-    indicators = []
+def url_indicators_generator(client: Client, url: str, reader, default_indicator_type: str):
     config = client.feed_url_to_config or {}
+    mapping = config.get(url, {}).get('mapping', {})
+    for item in reader:
+        raw_json = dict(item)
+        value = item.get('value')
+        if not value and len(item) > 1:
+            value = next(iter(item.values()))
+        if value:
+            raw_json['value'] = value
+            conf_indicator_type = config.get(url, {}).get('indicator_type')
+            indicator_type = determine_indicator_type(conf_indicator_type, default_indicator_type, value)
+            raw_json['type'] = indicator_type
+            yield {
+                'value': value,
+                'type': indicator_type,
+                'rawJSON': raw_json,
+                'fields': create_fields_mapping(raw_json, mapping) if mapping else {}
+            }
+
+
+def fetch_indicators_command(client: Client, default_indicator_type: str,
+                             delta_tracker: Optional[FeedDeltaTracker] = None, **kwargs):
+    """
+    Lazily yields the indicators of the feed, so they can be submitted in batches without holding the whole feed.
+    :param client: The client
+    :param default_indicator_type: The default indicator type
+    :param delta_tracker: If given, only the indicators that were added or changed since the last fetch are yielded.
+    :param kwargs: Arguments to send to the HTTP API endpoint
+    :return: Generator of indicators
+    """
+    iterator = client.build_iterator(**kwargs)
     for url_to_reader in iterator:
         for url, reader in url_to_reader.items():
-            mapping = config.get(url, {}).get('mapping', {})
-            for item in reader:
-                raw_json = dict(item)
-                value = item.get('value')
-                if not value and len(item) > 1:
-                    value = next(iter(item.values()))
-                if value:
-                    raw_json['value'] = value
-                    conf_indicator_type = config.get(url, {}).get('indicator_type')
-                    indicator_type = determine_indicator_type(conf_indicator_type, default_indicator_type, value)
-                    raw_json['type'] = indicator_type
-                    indicator = {
-                        'value': value,
-                        'type': indicator_type,
-                        'rawJSON': raw_json,
-                        'fields': create_fields_mapping(raw_json, mapping) if mapping else {}
-                    }
-                    indicators.append(indicator)
-
-    return indicators
+            url_indicators = url_indicators_generator(client, url, reader, default_indicator_type)
+            if delta_tracker is not None:
+                url_indicators = delta_tracker.filter_new_or_changed(url, url_indicators)
+            yield from url_indicators
 
 
 def get_indicators_command(client, args):
     itype = args.get('indicator_type', demisto.params().get('indicator_type'))
     limit = int(args.get('limit'))
-    indicators_list = fetch_indicators_command(client, itype)
-    entry_result = indicators_list[:limit]
-    hr = tableToMarkdown('Indicators', entry_result, headers=['value', 'type', 'fields'])
+    indicators_list = list(itertools.islice(fetch_indicators_command(client, itype), limit))
+    hr = tableToMarkdown('Indicators', indicators_list, headers=['value', 'type', 'fields'])
     return hr, {}, indicators_list
 
 
@@ -294,10 +407,20 @@ def feed_main(feed_name, params=None, prefix=''):
     }
     try:
         if command == 'fetch-indicators':
-            indicators = fetch_indicators_command(client, params.get('indicator_type'))
-            # we submit the indicators in batches
-            for b in batch(indicators, batch_size=2000):
-                demisto.createIndicators(b)  # type: ignore
+            fetch_cache = FeedFetchCache() if client.conditional_fetch else None
+            delta_tracker = FeedDeltaTracker(keep_values=client.delta_report_removed) if client.delta_fetch else None
+            indicators = fetch_indicators_command(client, params.get('indicator_type'), delta_tracker=delta_tracker,
+                                                  fetch_cache=fetch_cache)
+            # we stream the indicators and submit them in batches, so memory is bounded by the batch size
+            submitter = IndicatorsSubmitter(batch_size=INDICATORS_BATCH_SIZE)
+            submitter.submit(indicators)
+            demisto.debug(f'{feed_name} - submitted indicators: {submitter.get_stats()}')
+            if delta_tracker is not None:
+                if client.delta_report_removed:
+                    report_removed_indicators(feed_name, delta_tracker.get_removed())
+                delta_tracker.save()
+            if fetch_cache is not None:
+                fetch_cache.save()
         else:
             args = demisto.args()
             args['feed_name'] = feed_name
@@ -147,7 +147,7 @@ def test_get_feed_content():
             m.get(url, content=feed_url_to_config.get(url).get('content'))
             raw_response = requests.get(url)
 
-            assert client.get_feed_content_divided_to_lines(url, raw_response) == expected_output
+            assert list(client.get_feed_content_divided_to_lines(url, raw_response)) == expected_output
 
 
 def test_date_format_parsing():
@@ -156,3 +156,60 @@ def test_date_format_parsing():
 
     formatted_date = date_format_parsing('2020-02-01 12:13:14.11111')
     assert formatted_date == '2020-02-01T12:13:14Z'
+
+
+def test_fetch_indicators_delta(mocker):
+    """
+    Given
+    - A CSV feed which was fetched with 2 IPs.
+
+    When
+    - Fetching again with a delta tracker, after the country of one IP changed and another IP was added.
+
+    Then
+    - Ensure only the changed and the added IPs are returned.
+    """
+    feed_url_to_config = {
+        'https://ipstack.com': {
+            'fieldnames': ['value', 'country'],
+            'indicator_type': 'IP'
+        }
+    }
+    mocker.patch.object(demisto, 'getIntegrationContext', return_value={})
+    mocker.patch.object(demisto, 'setIntegrationContext',
+                        side_effect=lambda context: demisto.getIntegrationContext.configure_mock(return_value=context))
+
+    with requests_mock.Mocker() as m:
+        client = Client(url='https://ipstack.com', feed_url_to_config=feed_url_to_config, escapechar='\\')
+
+        m.get('https://ipstack.com', content=b'1.1.1.1,US\n2.2.2.2,US')
+        delta_tracker = FeedDeltaTracker()
+        indicators = list(fetch_indicators_command(client, 'IP', delta_tracker=delta_tracker))
+        assert [ind['value'] for ind in indicators] == ['1.1.1.1', '2.2.2.2']
+        delta_tracker.save()
+
+        m.get('https://ipstack.com', content=b'1.1.1.1,US\n2.2.2.2,IL\n3.3.3.3,US')
+        delta_tracker = FeedDeltaTracker()
+        indicators = list(fetch_indicators_command(client, 'IP', delta_tracker=delta_tracker))
+        assert [ind['value'] for ind in indicators] == ['2.2.2.2', '3.3.3.3']
+        assert delta_tracker.get_removed() == []
+
+
+def test_divide_chunks_to_lines():
+    """
+    Given
+    - A gzip stream of two members, whose content has a multi byte character and is split to tiny chunks.
+
+    When
+    - Dividing the chunks to lines.
+
+    Then
+    - Ensure the lines are the same as decompressing and decoding the whole content at once.
+    """
+    import gzip
+    text = 'value,name\n1.1.1.1,café\n2.2.2.2,naïve\n'
+    content = gzip.compress(text[:20].encode('utf8')) + gzip.compress(text[20:].encode('utf8'))
+    client = Client(url='https://ipstack.com', encoding='utf8',
+                    feed_url_to_config={'https://ipstack.com': {'is_zipped_file': True}})
+    chunks = (content[i:i + 3] for i in range(0, len(content), 3))
+    assert list(client.divide_chunks_to_lines('https://ipstack.com', chunks)) == text.split('\n')
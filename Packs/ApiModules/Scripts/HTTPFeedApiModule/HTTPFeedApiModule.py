@@ -6,21 +6,96 @@ from CommonServerUserPython import *
 import urllib3
 import requests
 import traceback
+import itertools
+from urllib.parse import urlparse
 from dateutil.parser import parse
-from typing import Optional, Pattern, List
+from typing import Optional, Pattern, List, Iterator, Iterable, Dict
 
 # disable insecure warnings
 urllib3.disable_warnings()
 
 ''' GLOBALS '''
 TAGS = 'feedTags'
+INDICATORS_BATCH_SIZE = 2000
+WHOLE_MATCH_TRANSFORM = r'\g<0>'
+
+
+class ExtractionPlan:
+    def __init__(self, feed_config: dict, indicator_type: str = '', custom_fields_mapping: dict = None):
+        """Precompiled recipe for extracting an indicator and its fields from a single feed line.
+        Built once per feed URL, so the per-line parsing does not repeat the configuration work.
+        :param feed_config: The configuration of the feed URL, see ``Client.feed_url_to_config``.
+        :param indicator_type: The default indicator type, used if the feed configuration has no type.
+        :param custom_fields_mapping: Dict mapping the extracted fields to indicator fields in Demisto.
+        """
+        self.indicator_regex: Optional[Pattern] = None
+        self.indicator_transform = WHOLE_MATCH_TRANSFORM
+        indicator = feed_config.get('indicator')
+        if indicator and 'regex' in indicator:
+            self.indicator_regex = re.compile(indicator['regex'])
+            self.indicator_transform = indicator.get('transform', WHOLE_MATCH_TRANSFORM)
+
+        self.fields: List[tuple] = []
+        for field in feed_config.get('fields', []):
+            for f, fattrs in field.items():
+                if 'regex' in fattrs:
+                    self.fields.append((f, re.compile(fattrs['regex']), fattrs.get('transform', WHOLE_MATCH_TRANSFORM)))
+
+        self.configured_indicator_type: Optional[str] = feed_config.get('indicator_type')
+        self.indicator_type = feed_config.get('indicator_type', indicator_type)
+
+        custom_fields_mapping = custom_fields_mapping or {}
+        self.custom_fields: List[tuple] = [(TAGS, TAGS)] + [
+            (attribute, field) for attribute, field in custom_fields_mapping.items() if attribute != TAGS
+        ]
+        self.has_custom_fields_mapping = len(custom_fields_mapping) > 0
+
+    def extract(self, line: str):
+        """
+        Applies the plan to a single line.
+        :param line: The stripped, non empty line.
+        :return: The extracted attributes and the indicator value, or None and an empty value if the line is not
+            matched by the indicator regex.
+        """
+        if self.indicator_regex is not None:
+            match = self.indicator_regex.search(line)
+            if match is None:
+                return None, ''
+            extracted_indicator = match.expand(self.indicator_transform)
+        else:
+            extracted_indicator = line.split()[0]
+
+        attributes: dict = {}
+        for f, regex, transform in self.fields:
+            m = regex.search(line)
+            if m is None:
+                continue
+            value = m.expand(transform)
+            try:
+                attributes[f] = int(value)
+            except ValueError:
+                attributes[f] = value
+        attributes['value'] = extracted_indicator
+        attributes['type'] = self.indicator_type
+        return attributes, extracted_indicator
+
+    def create_custom_fields(self, attributes: dict) -> dict:
+        """
+        Maps the extracted attributes to indicator fields in Demisto.
+        :param attributes: The extracted attributes.
+        :return: The custom fields.
+        """
+        return {field: attributes[attribute] for attribute, field in self.custom_fields if attribute in attributes}
 
 
 class Client(BaseClient):
     def __init__(self, url: str, feed_name: str = 'http', insecure: bool = False, credentials: dict = None,
                  ignore_regex: str = None, encoding: str = None, indicator_type: str = '',
                  indicator: str = '', fields: str = '{}', feed_url_to_config: dict = None, polling_timeout: int = 20,
-                 headers: dict = None, proxy: bool = False, custom_fields_mapping: dict = None, **kwargs):
+                 headers: dict = None, proxy: bool = False, custom_fields_mapping: dict = None,
+                 max_concurrent_downloads: int = DEFAULT_MAX_WORKERS, max_downloads_per_host: int = 2,
+                 conditional_fetch: bool = False, delta_fetch: bool = False, delta_report_removed: bool = False,
+                 **kwargs):
         """Implements class for miners of plain text feeds over HTTP.
         **Config parameters**
         :param: url: URL of the feed.
@@ -60,6 +135,14 @@ class Client(BaseClient):
             }]
         }
         :param: proxy: Use proxy in requests.
+        :param: max_concurrent_downloads: The maximal number of feed URLs to download concurrently.
+        :param: max_downloads_per_host: The maximal number of feed URLs to download concurrently from the same host.
+        :param: conditional_fetch: boolean, if *true* fetch sends conditional requests (ETag / Last-Modified) and
+            skips the feed URLs whose content did not change since the last fetch. Default: *false*
+        :param: delta_fetch: boolean, if *true* fetch submits only the indicators that were added or changed since the
+            last fetch. Default: *false*
+        :param: delta_report_removed: boolean, if *true* the indicators that were removed from the feed since the last
+            fetch are reported in the integration log. Requires *delta_fetch*. Default: *false*
         **Extraction dictionary**
             Extraction dictionaries contain the following keys:
             :regex: Python regular expression for searching the text.
@@ -104,6 +187,12 @@ class Client(BaseClient):
         self.headers = headers
         self.encoding = encoding
         self.feed_name = feed_name
+        self.max_concurrent_downloads = int(max_concurrent_downloads)
+        self.max_downloads_per_host = int(max_downloads_per_host)
+        self.download_session = create_pooled_session(pool_maxsize=self.max_concurrent_downloads)
+        self.conditional_fetch = argToBoolean(conditional_fetch)
+        self.delta_fetch = argToBoolean(delta_fetch)
+        self.delta_report_removed = argToBoolean(delta_report_removed)
         if not credentials:
             credentials = {}
         self.username = None
@@ -137,6 +226,25 @@ class Client(BaseClient):
             custom_fields_mapping = {}
         self.custom_fields_mapping = custom_fields_mapping
 
+        self.url_to_extraction_plan: Dict[str, ExtractionPlan] = {}
+        if isinstance(self.feed_url_to_config, dict):
+            for feed_url, feed_config in self.feed_url_to_config.items():
+                self.url_to_extraction_plan[feed_url] = ExtractionPlan(feed_config, self.indicator_type,
+                                                                       self.custom_fields_mapping)
+
+    def get_extraction_plan(self, url: str) -> ExtractionPlan:
+        """
+        Get the precompiled extraction plan of the given feed URL. URLs without a configuration get a default plan,
+        which is cached as well.
+        :param url: The feed URL
+        :return: The extraction plan
+        """
+        plan = self.url_to_extraction_plan.get(url)
+        if plan is None:
+            plan = ExtractionPlan({}, self.indicator_type, self.custom_fields_mapping)
+            self.url_to_extraction_plan[url] = plan
+        return plan
+
     def get_feed_config(self, fields_json: str = '', indicator_json: str = ''):
         """
         Get the feed configuration from the indicator and field JSON strings.
@@ -188,9 +296,11 @@ class Client(BaseClient):
 
         return config
 
-    def build_iterator(self, **kwargs):
+    def build_iterator(self, fetch_cache: Optional[FeedFetchCache] = None, **kwargs):
         """
         For each URL (service), send an HTTP request to get indicators and return them after filtering by Regex
+        :param fetch_cache: If given, conditional requests are sent and URLs whose content did not change since the
+            last fetch are skipped.
         :param kwargs: Arguments to send to the HTTP API endpoint
         :return: List of indicators
         """
@@ -203,58 +313,79 @@ class Client(BaseClient):
 
         if self.username is not None and self.password is not None:
             kwargs['auth'] = (self.username, self.password)
+
+        def download(url):
+            request_kwargs = kwargs
+            if fetch_cache is not None:
+                request_kwargs = dict(kwargs, headers=dict(kwargs.get('headers') or {},
+                                                           **fetch_cache.get_request_headers(url)))
+            r = self.download_session.get(
+                url,
+                **request_kwargs
+            )
+            try:
+                r.raise_for_status()
+            except Exception:
+                LOG(f'{self.feed_name!r} - exception in request:'
+                    f' {r.status_code!r} {r.content!r}')
+                raise
+            if fetch_cache is not None and fetch_cache.is_unchanged(url, response=r):
+                return None
+            # the body is read here, so the feeds are downloaded concurrently and the connection is released to the
+            # pool before the feeds are parsed
+            spool, content_hash = FeedFetchCache.spool_response(r)
+            if fetch_cache is not None:
+                if fetch_cache.is_unchanged(url, content_hash=content_hash):
+                    spool.close()
+                    return None
+                fetch_cache.update(url, r, content_hash)
+            return iterate_spooled_lines(spool)
+
+        urls = self._base_url
+        if not isinstance(urls, list):
+            urls = [urls]
         try:
-            urls = self._base_url
-            url_to_response_list: List[dict] = []
-            if not isinstance(urls, list):
-                urls = [urls]
-            for url in urls:
-                r = requests.get(
-                    url,
-                    **kwargs
-                )
-                try:
-                    r.raise_for_status()
-                except Exception:
-                    LOG(f'{self.feed_name!r} - exception in request:'
-                        f' {r.status_code!r} {r.content!r}')
-                    raise
-                url_to_response_list.append({url: r})
+            url_to_lines = execute_concurrently(download, urls, max_workers=self.max_concurrent_downloads,
+                                                key_func=lambda url: urlparse(url).netloc,
+                                                max_workers_per_key=self.max_downloads_per_host)
         except requests.ConnectionError:
             raise requests.ConnectionError('Failed to establish a new connection. Please make sure your URL is valid.')
 
         results = []
-        for url_to_response in url_to_response_list:
-            for url, lines in url_to_response.items():
-                result = lines.iter_lines()
-                if self.encoding is not None:
-                    result = map(
-                        lambda x: x.decode(self.encoding).encode('utf_8'),
-                        result
-                    )
-                else:
-                    result = map(
-                        lambda x: x.decode('utf_8'),
-                        result
-                    )
-                if self.ignore_regex is not None:
-                    result = filter(
-                        lambda x: self.ignore_regex.match(x) is None,  # type: ignore[union-attr]
-                        result
-                    )
-                results.append({url: result})
+        for url, lines in zip(urls, url_to_lines):
+            if lines is None:
+                demisto.debug(f'{self.feed_name} - {url} did not change since the last fetch, skipping it')
+                continue
+            result = lines
+            if self.encoding is not None:
+                result = map(
+                    lambda x: x.decode(self.encoding).encode('utf_8'),
+                    result
+                )
+            else:
+                result = map(
+                    lambda x: x.decode('utf_8'),
+                    result
+                )
+            if self.ignore_regex is not None:
+                result = filter(
+                    lambda x: self.ignore_regex.match(x) is None,  # type: ignore[union-attr]
+                    result
+                )
+            results.append({url: result})
         return results
 
-    def custom_fields_creator(self, attributes: dict):
-        created_custom_fields = {}
-        for attribute in attributes.keys():
-            if attribute in self.custom_fields_mapping.keys() or attribute == TAGS:
-                if attribute == TAGS:
-                    created_custom_fields[attribute] = attributes[attribute]
-                else:
-                    created_custom_fields[self.custom_fields_mapping[attribute]] = attributes[attribute]
 
-        return created_custom_fields
+def iterate_spooled_lines(spool):
+    """
+    Lazily yields the lines of a spooled feed, and closes the spool once they were read.
+    :param spool: The temporary file the feed was spooled to
+    :return: Generator of the lines, without their line breaks
+    """
+    with spool:
+        for line in spool:
+            # like requests' iter_lines, lines may also end with a carriage return alone
+            yield from line.splitlines()
 
 
 def datestring_to_millisecond_timestamp(datestring):
@@ -271,98 +402,79 @@ def get_indicator_fields(line, url, feed_tags: list, client: Client):
     :param feed_tags: The indicator tags.
     :return: The indicator
     """
-    attributes = None
-    value: str = ''
-    indicator = None
-    fields_to_extract = []
-    feed_config = client.feed_url_to_config.get(url, {})
-    if feed_config:
-        if 'indicator' in feed_config:
-            indicator = feed_config['indicator']
-            if 'regex' in indicator:
-                indicator['regex'] = re.compile(indicator['regex'])
-            if 'transform' not in indicator:
-                indicator['transform'] = r'\g<0>'
-
-    if 'fields' in feed_config:
-        fields = feed_config['fields']
-        for field in fields:
-            for f, fattrs in field.items():
-                field = {f: {}}
-                if 'regex' in fattrs:
-                    field[f]['regex'] = re.compile(fattrs['regex'])
-                if 'transform' not in fattrs:
-                    field[f]['transform'] = r'\g<0>'
-                else:
-                    field[f]['transform'] = fattrs['transform']
-                fields_to_extract.append(field)
-
     line = line.strip()
-    if line:
-        extracted_indicator = line.split()[0]
-        if indicator:
-            extracted_indicator = indicator['regex'].search(line)
-            if extracted_indicator is None:
-                return attributes, value
-            if 'transform' in indicator:
-                extracted_indicator = extracted_indicator.expand(indicator['transform'])
-        attributes = {}
-        for field in fields_to_extract:
-            for f, fattrs in field.items():
-                m = fattrs['regex'].search(line)
+    if not line:
+        return None, ''
+    attributes, value = client.get_extraction_plan(url).extract(line)
+    if attributes is not None:
+        attributes['tags'] = feed_tags
+    return attributes, value
 
-                if m is None:
-                    continue
 
-                attributes[f] = m.expand(fattrs['transform'])
+def url_indicators_generator(client: Client, url: str, lines: Iterable[str], feed_tags: list,
+                             itype: str) -> Iterator[dict]:
+    """
+    Lazily yields the indicators of a single feed URL.
+    :param client: The client
+    :param url: The feed URL
+    :param lines: The lines of the feed
+    :param feed_tags: The indicator tags.
+    :param itype: The default indicator type.
+    :return: Generator of indicators
+    """
+    plan = client.get_extraction_plan(url)
+    indicator_type = itype if plan.configured_indicator_type is None else plan.configured_indicator_type
+    for line in lines:
+        attributes, value = get_indicator_fields(line, url, feed_tags, client)
+        if value:
+            if 'lastseenbysource' in attributes.keys():
+                attributes['lastseenbysource'] = datestring_to_millisecond_timestamp(
+                    attributes['lastseenbysource'])
+
+            if 'firstseenbysource' in attributes.keys():
+                attributes['firstseenbysource'] = datestring_to_millisecond_timestamp(
+                    attributes['firstseenbysource'])
+
+            indicator_data = {
+                "value": value,
+                "type": indicator_type,
+                "rawJSON": attributes,
+            }
 
-                try:
-                    i = int(attributes[f])
-                except Exception:
-                    pass
-                else:
-                    attributes[f] = i
-        attributes['value'] = value = extracted_indicator
-        attributes['type'] = feed_config.get('indicator_type', client.indicator_type)
-        attributes['tags'] = feed_tags
-    return attributes, value
+            if plan.has_custom_fields_mapping or TAGS in attributes:
+                indicator_data["fields"] = plan.create_custom_fields(attributes)
 
+            yield indicator_data
 
-def fetch_indicators_command(client, feed_tags, itype, **kwargs):
+
+def indicators_generator(client: Client, feed_tags: list, itype: str, delta_tracker: Optional[FeedDeltaTracker] = None,
+                         **kwargs) -> Iterator[dict]:
+    """
+    Lazily yields the indicators of the feed, one line at a time, so the feed is never held in memory as a whole.
+    :param client: The client
+    :param feed_tags: The indicator tags.
+    :param itype: The default indicator type.
+    :param delta_tracker: If given, only the indicators that were added or changed since the last fetch are yielded.
+    :return: Generator of indicators
+    """
     iterators = client.build_iterator(**kwargs)
-    indicators = []
     for iterator in iterators:
         for url, lines in iterator.items():
-            for line in lines:
-                attributes, value = get_indicator_fields(line, url, feed_tags, client)
-                if value:
-                    if 'lastseenbysource' in attributes.keys():
-                        attributes['lastseenbysource'] = datestring_to_millisecond_timestamp(
-                            attributes['lastseenbysource'])
+            url_indicators = url_indicators_generator(client, url, lines, feed_tags, itype)
+            if delta_tracker is not None:
+                url_indicators = delta_tracker.filter_new_or_changed(url, url_indicators)
+            yield from url_indicators
 
-                    if 'firstseenbysource' in attributes.keys():
-                        attributes['firstseenbysource'] = datestring_to_millisecond_timestamp(
-                            attributes['firstseenbysource'])
 
-                    indicator_data = {
-                        "value": value,
-                        "type": client.feed_url_to_config.get(url, {}).get('indicator_type', itype),
-                        "rawJSON": attributes,
-                    }
-
-                    if len(client.custom_fields_mapping.keys()) > 0 or TAGS in attributes.keys():
-                        custom_fields = client.custom_fields_creator(attributes)
-                        indicator_data["fields"] = custom_fields
-
-                    indicators.append(indicator_data)
-    return indicators
+def fetch_indicators_command(client, feed_tags, itype, **kwargs):
+    return list(indicators_generator(client, feed_tags, itype, **kwargs))
 
 
 def get_indicators_command(client: Client, args):
     itype = args.get('indicator_type', client.indicator_type)
     limit = int(args.get('limit'))
     feed_tags = args.get('feedTags')
-    indicators_list = fetch_indicators_command(client, feed_tags, itype)[:limit]
+    indicators_list = list(itertools.islice(indicators_generator(client, feed_tags, itype), limit))
     entry_result = camelize(indicators_list)
     hr = tableToMarkdown('Indicators', entry_result, headers=['Value', 'Type', 'Rawjson'])
     return hr, {}, indicators_list
@@ -402,10 +514,20 @@ def feed_main(feed_name, params=None, prefix=''):
     }
     try:
         if command == 'fetch-indicators':
-            indicators = fetch_indicators_command(client, feed_tags, params.get('indicator_type'))
-            # we submit the indicators in batches
-            for b in batch(indicators, batch_size=2000):
-                demisto.createIndicators(b)
+            fetch_cache = FeedFetchCache() if client.conditional_fetch else None
+            delta_tracker = FeedDeltaTracker(keep_values=client.delta_report_removed) if client.delta_fetch else None
+            indicators = indicators_generator(client, feed_tags, params.get('indicator_type'),
+                                              delta_tracker=delta_tracker, fetch_cache=fetch_cache)
+            # we stream the indicators and submit them in batches, so memory is bounded by the batch size
+            submitter = IndicatorsSubmitter(batch_size=INDICATORS_BATCH_SIZE)
+            submitter.submit(indicators)
+            demisto.debug(f'{feed_name} - submitted indicators: {submitter.get_stats()}')
+            if delta_tracker is not None:
+                if client.delta_report_removed:
+                    report_removed_indicators(feed_name, delta_tracker.get_removed())
+                delta_tracker.save()
+            if fetch_cache is not None:
+                fetch_cache.save()
         else:
             args = demisto.args()
             args['feed_name'] = feed_name
@@ -1,4 +1,5 @@
-from HTTPFeedApiModule import get_indicators_command, Client, datestring_to_millisecond_timestamp, feed_main
+from HTTPFeedApiModule import get_indicators_command, Client, datestring_to_millisecond_timestamp, feed_main, \
+    indicators_generator, get_indicator_fields, FeedFetchCache
 import requests_mock
 import demistomock as demisto
 
@@ -119,7 +120,8 @@ def test_custom_fields_creator():
         'old_field2': "value2"
     }
 
-    custom_fields = client.custom_fields_creator(attributes)
+    custom_fields = client.get_extraction_plan('https://www.spamhaus.org/drop/asndrop.txt').create_custom_fields(
+        attributes)
 
     assert custom_fields.get('new_field1') == "value1"
     assert custom_fields.get('new_field2') == "value2"
@@ -287,3 +289,180 @@ def test_feed_main_test_module(mocker, requests_mock):
     assert demisto.results.call_count == 1
     results = demisto.results.call_args[0][0]
     assert results['HumanReadable'] == 'ok'
+
+
+def test_indicators_generator_is_lazy(requests_mock):
+    """
+    Given
+    - A feed of 466 ASN lines.
+
+    When
+    - Consuming only the first indicator of the generator.
+
+    Then
+    - Ensure an indicator is yielded without parsing the entire feed.
+    """
+    feed_url = 'https://www.spamhaus.org/drop/asndrop.txt'
+    with open('test_data/asn_ranges.txt') as asn_ranges_txt:
+        asn_ranges = asn_ranges_txt.read().encode('utf8')
+    requests_mock.get(feed_url, content=asn_ranges)
+    client = Client(url=feed_url, ignore_regex='^;.*', indicator_type='ASN')
+    generator = indicators_generator(client, [], 'ASN')
+    first = next(generator)
+    assert first['value'].startswith('AS')
+    assert first['type'] == 'ASN'
+
+
+def test_extraction_plan_is_built_once(mocker):
+    """
+    Given
+    - A feed configuration with an indicator regex, field regexes and a custom fields mapping.
+
+    When
+    - Extracting indicators from several lines.
+
+    Then
+    - Ensure the regexes are compiled only when the client is created.
+    - Ensure the indicator, fields and custom fields are extracted as expected.
+    """
+    feed_url = 'https://www.spamhaus.org/drop/asndrop.txt'
+    feed_url_to_config = {
+        feed_url: {
+            'indicator_type': 'ASN',
+            'indicator': {
+                'regex': '^AS[0-9]+'
+            },
+            'fields': [
+                {
+                    'asndrop_country': {
+                        'regex': r'^.*;\W([a-zA-Z]+)\W+',
+                        'transform': r'\1'
+                    }
+                },
+                {
+                    'asndrop_number': {
+                        'regex': r'^AS([0-9]+)',
+                        'transform': r'\1'
+                    }
+                }
+            ]
+        }
+    }
+    client = Client(url=feed_url, feed_url_to_config=feed_url_to_config,
+                    custom_fields_mapping={'asndrop_country': 'country'})
+    compile_mock = mocker.patch('HTTPFeedApiModule.re.compile')
+
+    attributes, value = get_indicator_fields('AS397539 ; US | LAKSH CYBERSECURITY', feed_url, ['tag'], client)
+    assert value == 'AS397539'
+    assert attributes == {'asndrop_country': 'US', 'asndrop_number': 397539, 'value': 'AS397539', 'type': 'ASN',
+                          'tags': ['tag']}
+    assert client.get_extraction_plan(feed_url).create_custom_fields(attributes) == {'country': 'US'}
+
+    assert get_indicator_fields('; comment line', feed_url, ['tag'], client) == (None, '')
+    assert get_indicator_fields('   ', feed_url, ['tag'], client) == (None, '')
+    assert compile_mock.call_count == 0
+
+
+def test_build_iterator_multiple_urls(mocker, requests_mock):
+    """
+    Given
+    - A feed with 3 URLs, served by 2 hosts.
+
+    When
+    - Building the iterator.
+
+    Then
+    - Ensure all the URLs are downloaded and returned in the order of the URLs.
+    - Ensure the content is read by the concurrent downloads, before the lines are iterated.
+    """
+    urls = ['https://www.spamhaus.org/drop/drop.txt', 'https://www.dshield.org/block.txt',
+            'https://www.spamhaus.org/drop/edrop.txt']
+    for i, url in enumerate(urls):
+        requests_mock.get(url, content=f'1.1.1.{i}\r\n2.2.2.{i}'.encode('utf8'))
+    client = Client(url=urls, feed_url_to_config={url: {'indicator_type': 'IP'} for url in urls},
+                    max_concurrent_downloads=3)
+    spool_response = mocker.spy(FeedFetchCache, 'spool_response')
+    iterators = client.build_iterator()
+    assert spool_response.call_count == 3
+    assert [list(it.keys())[0] for it in iterators] == urls
+    assert [list(list(it.values())[0]) for it in iterators] == [
+        ['1.1.1.0', '2.2.2.0'], ['1.1.1.1', '2.2.2.1'], ['1.1.1.2', '2.2.2.2']]
+
+
+def test_feed_main_conditional_fetch(mocker, requests_mock):
+    """
+    Given
+    - A feed configured with conditional fetch.
+
+    When
+    - Fetching indicators 3 times: the feed is new, then its content is the same, then the server responds with 304.
+
+    Then
+    - Ensure createIndicators is called only on the first fetch.
+    - Ensure the ETag of the first fetch is sent on the next fetches.
+    """
+    feed_url = 'https://www.spamhaus.org/drop/asndrop.txt'
+    mocker.patch.object(demisto, 'params', return_value={
+        'url': feed_url,
+        'ignore_regex': '^;.*',
+        'indicator_type': 'ASN',
+        'conditional_fetch': True
+    })
+    mocker.patch.object(demisto, 'command', return_value='fetch-indicators')
+    mocker.patch.object(demisto, 'createIndicators')
+    mocker.patch.object(demisto, 'getIntegrationContext', return_value={})
+    mocker.patch.object(demisto, 'setIntegrationContext',
+                        side_effect=lambda context: demisto.getIntegrationContext.configure_mock(return_value=context))
+
+    with open('test_data/asn_ranges.txt') as asn_ranges_txt:
+        asn_ranges = asn_ranges_txt.read().encode('utf8')
+
+    requests_mock.get(feed_url, content=asn_ranges, headers={'ETag': '"v1"'})
+    feed_main('great_feed_name')
+    assert demisto.createIndicators.call_count == 1
+    assert len(demisto.createIndicators.call_args[0][0]) == 466
+
+    feed_main('great_feed_name')
+    assert requests_mock.last_request.headers['If-None-Match'] == '"v1"'
+    assert demisto.createIndicators.call_count == 1
+
+    requests_mock.get(feed_url, status_code=304)
+    feed_main('great_feed_name')
+    assert demisto.createIndicators.call_count == 1
+
+
+def test_feed_main_delta_fetch(mocker, requests_mock):
+    """
+    Given
+    - A feed configured with delta fetch, which was fetched with 3 IPs.
+
+    When
+    - Fetching again, after one IP was removed and one IP was added.
+
+    Then
+    - Ensure createIndicators is called only with the added IP.
+    - Ensure the removed IP is reported.
+    """
+    feed_url = 'https://www.dshield.org/block.txt'
+    mocker.patch.object(demisto, 'params', return_value={
+        'url': feed_url,
+        'indicator_type': 'IP',
+        'delta_fetch': True,
+        'delta_report_removed': True
+    })
+    mocker.patch.object(demisto, 'command', return_value='fetch-indicators')
+    mocker.patch.object(demisto, 'createIndicators')
+    mocker.patch.object(demisto, 'info')
+    mocker.patch.object(demisto, 'getIntegrationContext', return_value={})
+    mocker.patch.object(demisto, 'setIntegrationContext',
+                        side_effect=lambda context: demisto.getIntegrationContext.configure_mock(return_value=context))
+
+    requests_mock.get(feed_url, content=b'1.1.1.1\n2.2.2.2\n3.3.3.3')
+    feed_main('great_feed_name')
+    assert [ind['value'] for ind in demisto.createIndicators.call_args[0][0]] == ['1.1.1.1', '2.2.2.2', '3.3.3.3']
+
+    requests_mock.get(feed_url, content=b'1.1.1.1\n3.3.3.3\n4.4.4.4')
+    feed_main('great_feed_name')
+    assert demisto.createIndicators.call_count == 2
+    assert [ind['value'] for ind in demisto.createIndicators.call_args[0][0]] == ['4.4.4.4']
+    assert '1 indicators were removed from the feed since the last fetch: 2.2.2.2' in demisto.info.call_args[0][0]
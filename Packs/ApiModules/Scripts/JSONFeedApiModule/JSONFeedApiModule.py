@@ -1,14 +1,29 @@
 from CommonServerPython import *
 
 ''' IMPORTS '''
+import codecs
+import itertools
 import urllib3
 import jmespath
 import tldextract
-from typing import List, Dict, Union, Optional
+from urllib.parse import urlparse
+from typing import List, Dict, Optional, Iterable, Iterator, Tuple
 
 # disable insecure warnings
 urllib3.disable_warnings()
 
+INDICATORS_BATCH_SIZE = 2000
+CHUNK_SIZE = 64 * 1024
+ITEMS_EXPRESSION_BATCH_SIZE = 1000
+# An extractor which selects an array by a path of object keys, optionally followed by an expression which can be
+# applied to each of the array items separately (a filter, a flatten or a projection), e.g. "prefixes[?service=='S3']"
+STREAMABLE_EXTRACTOR_REGEX = re.compile(r'^(?P<path>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)'
+                                        r'(?P<items_expression>\[(?:\?|\*?\]).*)?$')
+WHITESPACE_REGEX = re.compile(r'\s*')
+
+
+INDICATOR_TYPE_DETECTOR = None  # type: Optional[IndicatorTypeDetector]
+
 
 def auto_detect_indicator_type(indicator_value):
     """Infer the type of the indicator.
@@ -17,49 +32,175 @@ def auto_detect_indicator_type(indicator_value):
     Returns:
         str. The type of the indicator.
     """
-    if re.match(ipv4cidrRegex, indicator_value):
-        return FeedIndicatorType.CIDR
-
-    if re.match(ipv6cidrRegex, indicator_value):
-        return FeedIndicatorType.IPv6CIDR
-
-    if re.match(ipv4Regex, indicator_value):
-        return FeedIndicatorType.IP
-
-    if re.match(ipv6Regex, indicator_value):
-        return FeedIndicatorType.IPv6
-
-    if re.match(sha256Regex, indicator_value):
-        return FeedIndicatorType.File
-
-    if re.match(urlRegex, indicator_value):
-        return FeedIndicatorType.URL
-
-    if re.match(md5Regex, indicator_value):
-        return FeedIndicatorType.File
-
-    if re.match(sha1Regex, indicator_value):
-        return FeedIndicatorType.File
+    global INDICATOR_TYPE_DETECTOR
+    if INDICATOR_TYPE_DETECTOR is None:
+        try:
+            # the public suffix list snapshot bundled with tldextract is loaded once, instead of being fetched
+            public_suffixes = tldextract.TLDExtract(suffix_list_urls=None).tlds
+        except Exception as e:
+            demisto.debug(f'Failed loading the public suffix list, domains will not be detected: {e}')
+            public_suffixes = []
+        INDICATOR_TYPE_DETECTOR = IndicatorTypeDetector(public_suffixes)
+    return INDICATOR_TYPE_DETECTOR.detect(indicator_value)
+
+
+def split_streamable_extractor(extractor: str) -> Optional[Tuple[List[str], Optional[jmespath.parser.ParsedResult]]]:
+    """Splits an extractor to the path of the array it selects and the expression to apply on each of its items.
+    Args:
+        extractor(str): The JMESPath extractor of the feed.
+    Returns:
+        tuple. The path keys and the compiled items expression (or None), or None if the extractor can not be
+        applied to the array items one at a time.
+    """
+    match = STREAMABLE_EXTRACTOR_REGEX.match(extractor or '')
+    if not match:
+        return None
+    items_expression = match.group('items_expression')
+    if items_expression and '|' in items_expression:
+        return None
+    return match.group('path').split('.'), jmespath.compile(items_expression) if items_expression else None
+
+
+class JSONArrayStreamer:
+    def __init__(self, chunks: Iterable[bytes], path: List[str]):
+        """Incrementally parses a JSON document and yields the items of the array found at a path of object keys,
+        so only the current item (rather than the whole document) is held in memory.
+        :param chunks: The bytes chunks of the UTF-8 encoded JSON document.
+        :param path: The keys of the objects leading to the array.
+        """
+        self._chunks = iter(chunks)
+        self._path = path
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _read_more(self) -> bool:
+        """Reads at least as much text as is left in the buffer (so a value that spans many chunks is decoded in
+        amortized linear time), dropping the consumed part of the buffer.
+        Returns:
+            bool. False if the document was fully read already.
+        """
+        if self._eof:
+            return False
+        remaining = self._buffer[self._pos:]
+        texts = [remaining]
+        read_size = 0
+        while not self._eof and read_size <= len(remaining):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                texts.append(self._text_decoder.decode(b'', final=True))
+            else:
+                text = self._text_decoder.decode(chunk)
+                read_size += len(text)
+                texts.append(text)
+        self._buffer = ''.join(texts)
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            self._pos = WHITESPACE_REGEX.match(self._buffer, self._pos).end()  # type: ignore
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                raise ValueError('Unexpected end of the JSON document')
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f'Expected one of {chars!r} but found {char!r}')
+        self._pos += 1
+        return char
+
+    def _decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._read_more():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._read_more():
+                continue
+            self._pos = end
+            return value
+
+    def _find_path(self) -> bool:
+        for key in self._path:
+            if self._peek() != '{':
+                return False
+            self._pos += 1
+            if self._peek() == '}':
+                return False
+            while True:
+                current_key = self._decode_value()
+                self._expect(':')
+                if current_key == key:
+                    break
+                self._decode_value()
+                if self._expect(',}') == '}':
+                    return False
+        return self._peek() == '['
+
+    def __iter__(self) -> Iterator:
+        if not self._find_path():
+            return
+        self._pos += 1
+        if self._peek() == ']':
+            return
+        while True:
+            yield self._decode_value()
+            if self._expect(',]') == ']':
+                return
+
+
+def iterate_spooled_chunks(spool) -> Iterator[bytes]:
+    """Reads a spooled JSON document in chunks, and closes the spool once it was read.
+    Args:
+        spool: The temporary file the document was spooled to.
+    Returns:
+        Iterator. The bytes chunks of the document.
+    """
+    with spool:
+        yield from iter(lambda: spool.read(CHUNK_SIZE), b'')
 
-    if re.match(emailRegex, indicator_value):
-        return FeedIndicatorType.Email
 
+def stream_extracted_items(chunks: Iterable[bytes], path: List[str],
+                           items_expression: Optional[jmespath.parser.ParsedResult]) -> Iterator:
+    """Yields the items which the extractor selects, parsing the JSON document incrementally.
+    Args:
+        chunks: The bytes chunks of the JSON document.
+        path: The keys of the objects leading to the array of items.
+        items_expression: The compiled JMESPath expression to apply on each item, if any.
+    Returns:
+        Iterator. The extracted items.
+    """
     try:
-        if tldextract.extract(indicator_value).suffix:
-            if '*' in indicator_value:
-                return FeedIndicatorType.DomainGlob
-            return FeedIndicatorType.Domain
-    except Exception:
-        pass
-
-    return None
+        items = iter(JSONArrayStreamer(chunks, path))
+        if items_expression is None:
+            yield from items
+            return
+        # the expression applies to each item separately, so it is searched on small batches of items at once
+        items_batch = list(itertools.islice(items, ITEMS_EXPRESSION_BATCH_SIZE))
+        while items_batch:
+            yield from items_expression.search(items_batch) or []
+            items_batch = list(itertools.islice(items, ITEMS_EXPRESSION_BATCH_SIZE))
+    except ValueError as VE:
+        raise ValueError(f'Could not parse returned data to Json. \n\nError massage: {VE}')
 
 
 class Client:
     def __init__(self, url: str = '', credentials: dict = None,
                  feed_name_to_config: Dict[str, dict] = None, source_name: str = 'JSON',
                  extractor: str = '', indicator: str = 'indicator',
-                 insecure: bool = False, cert_file: str = None, key_file: str = None, headers: dict = None, **_):
+                 insecure: bool = False, cert_file: str = None, key_file: str = None, headers: dict = None,
+                 max_concurrent_downloads: int = DEFAULT_MAX_WORKERS, max_downloads_per_host: int = 2,
+                 conditional_fetch: bool = False, incremental_parsing: bool = False, **_):
         """
         Implements class for miners of JSON feeds over http/https.
         :param url: URL of the feed.
@@ -76,6 +217,13 @@ class Client:
         :param: headers: Header parameters are optional to specify a user-agent or an api-token
         Example: headers = {'user-agent': 'my-app/0.0.1'} or Authorization: Bearer
         (curl -H "Authorization: Bearer " "https://api-url.com/api/v1/iocs?first_seen_since=2016-1-1")
+        :param: max_concurrent_downloads: The maximal number of feeds to download concurrently.
+        :param: max_downloads_per_host: The maximal number of feeds to download concurrently from the same host.
+        :param: conditional_fetch: if *True* fetch sends conditional requests (ETag / Last-Modified) and skips the
+        feeds whose content did not change since the last fetch.
+        :param: incremental_parsing: if *True* feeds whose extractor selects an array by a path of keys, optionally
+        followed by a filter or a projection (e.g. "prefixes[?service=='AMAZON']"), are parsed incrementally and their
+        items are yielded one at a time, instead of loading the whole JSON document. Can be set per feed as well.
          Example:
             Example feed config:
             'AMAZON': {
@@ -117,28 +265,78 @@ class Client:
 
         self.cert = (cert_file, key_file) if cert_file and key_file else None
 
-    def build_iterator(self, **kwargs) -> List:
-        results = []
-        for feed_name, feed in self.feed_name_to_config.items():
-            r = requests.get(
-                url=feed.get('url', self.url),
+        self.max_concurrent_downloads = int(max_concurrent_downloads)
+        self.max_downloads_per_host = int(max_downloads_per_host)
+        self.session = create_pooled_session(pool_maxsize=self.max_concurrent_downloads)
+        self.conditional_fetch = argToBoolean(conditional_fetch)
+        self.incremental_parsing = argToBoolean(incremental_parsing)
+
+    def build_iterator(self, fetch_cache: Optional[FeedFetchCache] = None, **kwargs) -> List:
+        """
+        Downloads the feeds and extracts their indicators.
+        :param fetch_cache: If given, conditional requests are sent and feeds whose content did not change since the
+            last fetch are returned with no indicators.
+        :param kwargs: Arguments to send to the HTTP API endpoint
+        :return: List of dictionaries mapping each feed name to its extracted indicators
+        """
+        def download(feed_name):
+            feed = self.feed_name_to_config[feed_name]
+            url = feed.get('url', self.url)
+            headers = self.headers
+            if fetch_cache is not None:
+                headers = dict(self.headers or {}, **fetch_cache.get_request_headers(url))
+            streamable_extractor = None
+            if argToBoolean(feed.get('incremental_parsing', self.incremental_parsing)):
+                streamable_extractor = split_streamable_extractor(feed.get('extractor'))
+            r = self.session.get(
+                url=url,
                 verify=self.verify,
                 auth=self.auth,
                 cert=self.cert,
-                headers=self.headers,
+                headers=headers,
+                stream=streamable_extractor is not None,
                 **kwargs
             )
 
             try:
                 r.raise_for_status()
+                chunks = None
+                if fetch_cache is not None:
+                    if fetch_cache.is_unchanged(url, response=r):
+                        demisto.debug(f'{feed_name} did not change since the last fetch, skipping it')
+                        return {feed_name: []}
+                    if streamable_extractor is not None:
+                        spool, content_hash = FeedFetchCache.spool_response(r, chunk_size=CHUNK_SIZE)
+                        chunks = iterate_spooled_chunks(spool)
+                    else:
+                        content_hash = FeedFetchCache.hash_content(r.content)
+                    if fetch_cache.is_unchanged(url, content_hash=content_hash):
+                        demisto.debug(f'{feed_name} did not change since the last fetch, skipping it')
+                        if chunks is not None:
+                            spool.close()
+                        return {feed_name: []}
+                    fetch_cache.update(url, r, content_hash)
+                if streamable_extractor is not None:
+                    path, items_expression = streamable_extractor
+                    if chunks is None:
+                        # the document is read here, so the feeds are downloaded concurrently and the connection is
+                        # released to the pool before the feeds are parsed
+                        spool, _ = FeedFetchCache.spool_response(r, chunk_size=CHUNK_SIZE)
+                        chunks = iterate_spooled_chunks(spool)
+                    return {feed_name: stream_extracted_items(chunks, path, items_expression)}
                 data = r.json()
                 result = jmespath.search(expression=feed.get('extractor'), data=data)
-                results.append({feed_name: result})
+                return {feed_name: result}
 
             except ValueError as VE:
                 raise ValueError(f'Could not parse returned data to Json. \n\nError massage: {VE}')
 
-        return results
+        # the feeds are downloaded and parsed concurrently, and returned in the order of the configuration
+        return execute_concurrently(download, self.feed_name_to_config.keys(),
+                                    max_workers=self.max_concurrent_downloads,
+                                    key_func=lambda feed_name: urlparse(
+                                        self.feed_name_to_config[feed_name].get('url', self.url)).netloc,
+                                    max_workers_per_key=self.max_downloads_per_host)
 
 
 def test_module(client, params) -> str:
@@ -146,14 +344,13 @@ def test_module(client, params) -> str:
     return 'ok'
 
 
-def fetch_indicators_command(client: Client, indicator_type: str, feedTags: list, **kwargs) -> Union[Dict, List[Dict]]:
+def fetch_indicators_command(client: Client, indicator_type: str, feedTags: list, **kwargs) -> Iterator[Dict]:
     """
-    Fetches the indicators from client.
+    Lazily yields the indicators from client, so they can be submitted in batches without holding the whole feed.
     :param client: Client of a JSON Feed
     :param indicator_type: the default indicator type
     :param feedTags: the indicator tags
     """
-    indicators = []
     for result in client.build_iterator(**kwargs):
         for service_name, items in result.items():
             feed_config = client.feed_name_to_config.get(service_name, {})
@@ -180,9 +377,7 @@ def fetch_indicators_command(client: Client, indicator_type: str, feedTags: list
 
                 indicator['rawJSON'] = item
 
-                indicators.append(indicator)
-
-    return indicators
+                yield indicator
 
 
 def extract_all_fields_from_indicator(indicator, indicator_key):
@@ -237,14 +432,19 @@ def feed_main(params, feed_name, prefix):
             return_outputs(test_module(client, params))
 
         elif command == 'fetch-indicators':
-            indicators = fetch_indicators_command(client, indicator_type, feedTags)
-            for b in batch(indicators, batch_size=2000):
-                demisto.createIndicators(b)
+            fetch_cache = FeedFetchCache() if client.conditional_fetch else None
+            indicators = fetch_indicators_command(client, indicator_type, feedTags, fetch_cache=fetch_cache)
+            # we stream the indicators and submit them in batches, so memory is bounded by the batch size
+            submitter = IndicatorsSubmitter(batch_size=INDICATORS_BATCH_SIZE)
+            submitter.submit(indicators)
+            demisto.debug(f'{feed_name} - submitted indicators: {submitter.get_stats()}')
+            if fetch_cache is not None:
+                fetch_cache.save()
 
         elif command == f'{prefix}get-indicators':
             # dummy command for testing
             limit = int(demisto.args().get('limit', 10))
-            indicators = fetch_indicators_command(client, indicator_type, feedTags)[:limit]
+            indicators = list(itertools.islice(fetch_indicators_command(client, indicator_type, feedTags), limit))
             hr = tableToMarkdown('Indicators', indicators, headers=['value', 'type', 'rawJSON'])
             return_outputs(hr, {}, indicators)
 
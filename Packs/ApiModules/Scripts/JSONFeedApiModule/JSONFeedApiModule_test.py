@@ -1,6 +1,8 @@
-from JSONFeedApiModule import Client, fetch_indicators_command, jmespath
+from JSONFeedApiModule import Client, fetch_indicators_command, jmespath, stream_extracted_items, auto_detect_indicator_type, \
+    split_streamable_extractor
 from CommonServerPython import *
 import requests_mock
+import pytest
 
 
 def test_json_feed_no_config():
@@ -19,7 +21,7 @@ def test_json_feed_no_config():
             insecure=True
         )
 
-        indicators = fetch_indicators_command(client=client, indicator_type='CIDR', feedTags=['test'])
+        indicators = list(fetch_indicators_command(client=client, indicator_type='CIDR', feedTags=['test']))
         assert len(jmespath.search(expression="[].rawJSON.service", data=indicators)) == 1117
 
 
@@ -47,7 +49,7 @@ def test_json_feed_with_config():
             insecure=True
         )
 
-        indicators = fetch_indicators_command(client=client, indicator_type='CIDR', feedTags=['test'])
+        indicators = list(fetch_indicators_command(client=client, indicator_type='CIDR', feedTags=['test']))
         assert len(jmespath.search(expression="[].rawJSON.service", data=indicators)) == 1117
 
 
@@ -78,9 +80,99 @@ def test_json_feed_with_config_mapping():
             insecure=True
         )
 
-        indicators = fetch_indicators_command(client=client, indicator_type='CIDR', feedTags=['test'])
+        indicators = list(fetch_indicators_command(client=client, indicator_type='CIDR', feedTags=['test']))
         assert len(jmespath.search(expression="[].rawJSON.service", data=indicators)) == 1117
         indicator = indicators[0]
         custom_fields = indicator['fields']
         assert 'Region' in custom_fields
         assert 'region' in indicator['rawJSON']
+
+
+def test_json_feed_conditional_fetch(mocker):
+    """
+    Given
+    - A JSON feed which was already fetched, with ETag "v1".
+
+    When
+    - Fetching with a fetch cache while the server responds with 304 (Not Modified).
+
+    Then
+    - Ensure the ETag is sent and no indicators are returned.
+    """
+    url = 'https://ip-ranges.amazonaws.com/ip-ranges.json'
+    mocker.patch.object(demisto, 'getIntegrationContext', return_value={
+        'feed_url_to_fetch_state': {url: {'etag': '"v1"', 'last_modified': None, 'content_hash': 'hash'}}
+    })
+
+    with requests_mock.Mocker() as m:
+        m.get(url, status_code=304)
+        client = Client(url=url, extractor="prefixes[?service=='AMAZON']", indicator='ip_prefix')
+
+        indicators = list(fetch_indicators_command(client=client, indicator_type='CIDR', feedTags=['test'],
+                                                   fetch_cache=FeedFetchCache()))
+        assert m.last_request.headers['If-None-Match'] == '"v1"'
+        assert indicators == []
+
+
+STREAMING_EXTRACTORS = [
+    "prefixes[?service=='AMAZON']",
+    "prefixes[?service=='S3' && region=='us-east-1']",
+    'ipv6_prefixes[].{ip: ipv6_prefix}',
+    'prefixes',
+    'no_such_key[]',
+    'syncToken[]',
+]
+
+
+@pytest.mark.parametrize('extractor', STREAMING_EXTRACTORS)
+def test_stream_extracted_items(extractor):
+    """
+    Given
+    - The AWS IP ranges JSON document, split to small chunks.
+
+    When
+    - Streaming the items selected by an extractor.
+
+    Then
+    - Ensure the items are the same as searching the extractor on the whole document.
+    """
+    with open('test_data/amazon_ip_ranges.json', 'rb') as ip_ranges_json:
+        content = ip_ranges_json.read()
+    chunks = (content[i:i + 7] for i in range(0, len(content), 7))
+    path, items_expression = split_streamable_extractor(extractor)
+    expected = jmespath.search(extractor, json.loads(content)) or []
+    assert list(stream_extracted_items(chunks, path, items_expression)) == expected
+
+
+@pytest.mark.parametrize('extractor', ['@', 'prefixes[0]', 'sort_by(prefixes, &region)', 'prefixes[?a] | [0]'])
+def test_split_streamable_extractor_not_streamable(extractor):
+    assert split_streamable_extractor(extractor) is None
+
+
+def test_json_feed_incremental_parsing():
+    with open('test_data/amazon_ip_ranges.json') as ip_ranges_json:
+        ip_ranges = json.load(ip_ranges_json)
+
+    with requests_mock.Mocker() as m:
+        m.get('https://ip-ranges.amazonaws.com/ip-ranges.json', json=ip_ranges)
+
+        client = Client(
+            url='https://ip-ranges.amazonaws.com/ip-ranges.json',
+            extractor="prefixes[?service=='AMAZON']",
+            indicator='ip_prefix',
+            incremental_parsing=True
+        )
+
+        indicators = list(fetch_indicators_command(client=client, indicator_type='CIDR', feedTags=['test']))
+        assert len(jmespath.search(expression="[].rawJSON.service", data=indicators)) == 1117
+
+
+@pytest.mark.parametrize('indicator_value, indicator_type', [
+    ('8.8.8.8', FeedIndicatorType.IP),
+    ('https://www.example.com/index.html', FeedIndicatorType.URL),
+    ('example.co.uk', FeedIndicatorType.Domain),
+    ('*.example.xn--p1ai', FeedIndicatorType.DomainGlob),
+    ('example', None),
+])
+def test_auto_detect_indicator_type(indicator_value, indicator_type):
+    assert auto_detect_indicator_type(indicator_value) == indicator_type
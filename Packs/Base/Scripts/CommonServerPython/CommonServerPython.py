@@ -6,12 +6,17 @@ Note that adding code to CommonServerUserPython can override functions in Common
 from __future__ import print_function
 
 import base64
+import email.utils
+import hashlib
+import itertools
 import json
 import logging
 import os
 import re
 import socket
 import sys
+import tempfile
+import threading
 import time
 import traceback
 import xml.etree.cElementTree as ET
@@ -29,9 +34,16 @@ try:
 except Exception:
     pass
 
+# concurrent.futures is available in Python 3 only
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None  # type: ignore
+
 CONTENT_RELEASE_VERSION = '0.0.0'
 CONTENT_BRANCH_NAME = 'master'
 IS_PY3 = sys.version_info[0] == 3
+DEFAULT_MAX_WORKERS = 4
 
 # pylint: disable=undefined-variable
 if IS_PY3:
@@ -1188,7 +1200,7 @@ def appendContext(key, data, dedup=False):
         demisto.setContext(key, data)
 
 
-def tableToMarkdown(name, t, headers=None, headerTransform=None, removeNull=False, metadata=None):
+def tableToMarkdown(name, t, headers=None, headerTransform=None, removeNull=False, metadata=None, max_rows=None):
     """
        Converts a demisto table in JSON form to a Markdown table
 
@@ -1211,20 +1223,40 @@ def tableToMarkdown(name, t, headers=None, headerTransform=None, removeNull=Fals
        :type metadata: ``str``
        :param metadata: Metadata about the table contents
 
+       :type max_rows: ``int``
+       :param max_rows: The maximum number of rows to present. If the table has more rows, the rest are left out and
+            a note about it is added after the table. Default is to present all rows.
+
        :return: A string representation of the markdown table
        :rtype: ``str``
     """
+    lines = list(table_to_markdown_lines(name, t, headers, headerTransform, removeNull, metadata, max_rows))
+    try:
+        return ''.join(lines)
+    except UnicodeDecodeError:
+        # py2: byte strings that are not ascii (e.g. the name) cannot be joined with unicode lines
+        return ''.join([line.encode('utf-8') if isinstance(line, unicode) else line for line in lines])  # type: ignore
 
-    mdResult = ''
+
+def table_to_markdown_lines(name, t, headers=None, headerTransform=None, removeNull=False, metadata=None,
+                            max_rows=None):
+    """
+       Converts a demisto table in JSON form to a Markdown table, one line at a time, so a large table can be
+       written out (e.g. to a file) without holding the whole markdown string. Takes the same arguments as
+       ``tableToMarkdown``.
+
+       :return: A generator of the lines of the markdown table, each ending with a line break
+       :rtype: ``generator``
+    """
     if name:
-        mdResult = '### ' + name + '\n'
+        yield '### ' + name + '\n'
 
     if metadata:
-        mdResult += metadata + '\n'
+        yield metadata + '\n'
 
     if not t or len(t) == 0:
-        mdResult += '**No entries.**\n'
-        return mdResult
+        yield '**No entries.**\n'
+        return
 
     if not isinstance(t, list):
         t = [t]
@@ -1237,51 +1269,69 @@ def tableToMarkdown(name, t, headers=None, headerTransform=None, removeNull=Fals
         # should be only one header
         if headers and len(headers) > 0:
             header = headers[0]
-            t = map(lambda item: dict((h, item) for h in [header]), t)
+            t = [{header: item} for item in t]
         else:
             raise Exception("Missing headers param for tableToMarkdown. Example: headers=['Some Header']")
 
     # in case of headers was not provided (backward compatibility)
     if not headers:
-        headers = list(t[0].keys())
-        headers.sort()
+        headers = sorted(t[0].keys())
+
+    total_rows = len(t)
+    if max_rows is not None and total_rows > max_rows:
+        t = t[:max_rows]
 
     if removeNull:
-        headers_aux = headers[:]
-        for header in headers_aux:
-            if all(obj.get(header) in ('', None, [], {}) for obj in t):
-                headers.remove(header)
+        # a single pass over the rows, which stops once every column was found to have a value
+        null_headers = set(headers)
+        for obj in t:
+            null_headers.difference_update([header for header in null_headers
+                                            if obj.get(header) not in ('', None, [], {})])
+            if not null_headers:
+                break
+        headers = [header for header in headers if header not in null_headers]
 
     if t and len(headers) > 0:
-        newHeaders = []
-        if headerTransform is None:  # noqa
-            headerTransform = lambda s: s  # noqa
-        for header in headers:
-            newHeaders.append(headerTransform(header))
-        mdResult += '|'
-        if len(newHeaders) == 1:
-            mdResult += newHeaders[0]
+        if headerTransform is None:
+            yield '|' + '|'.join(headers) + '|\n'
         else:
-            mdResult += '|'.join(newHeaders)
-        mdResult += '|\n'
-        sep = '---'
-        mdResult += '|' + '|'.join([sep] * len(headers)) + '|\n'
+            yield '|' + '|'.join([headerTransform(header) for header in headers]) + '|\n'
+        yield '|' + '|'.join(['---'] * len(headers)) + '|\n'
         for entry in t:
-            vals = [stringEscapeMD((formatCell(entry.get(h, ''), False) if entry.get(h) is not None else ''),
-                                   True, True) for h in headers]
+            vals = [_markdown_table_cell(entry.get(h)) for h in headers]
             # this pipe is optional
-            mdResult += '| '
             try:
-                mdResult += ' | '.join(vals)
+                yield '| ' + ' | '.join(vals) + ' |\n'
             except UnicodeDecodeError:
                 vals = [str(v) for v in vals]
-                mdResult += ' | '.join(vals)
-            mdResult += ' |\n'
+                yield '| ' + ' | '.join(vals) + ' |\n'
 
     else:
-        mdResult += '**No entries.**\n'
+        yield '**No entries.**\n'
 
-    return mdResult
+    if total_rows > len(t):
+        yield '\n**Showing the first {} of {} entries.**\n'.format(len(t), total_rows)
+
+
+def _markdown_table_cell(value):
+    """
+       Formats a value as the content of a markdown table cell, escaping only the values that need it
+    """
+    if value is None:
+        return ''
+    if type(value) is int:
+        return str(value)
+    if not isinstance(value, STRING_TYPES):
+        value = formatCell(value, False)
+    elif not IS_PY3 and isinstance(value, str):
+        # py2: decoded, so it can be joined with the unicode cells formatted from other values
+        try:
+            value = value.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    if '|' in value or '\n' in value or '\r' in value:
+        value = stringEscapeMD(value, True, True)
+    return value
 
 
 tblToMd = tableToMarkdown
@@ -1780,6 +1830,56 @@ def is_ip_valid(s, accept_v6_ips=False):
         return True
 
 
+def ip_ints_to_ranges(ip_ints):
+    """
+       Merges IP addresses, given as integers, to the ranges of consecutive addresses they form.
+       The addresses are sorted once and then merged in a single pass, duplicates are ignored.
+
+       :type ip_ints: ``iterable``
+       :param ip_ints: The IP addresses as integers, all of the same IP version (required)
+
+       :return: The (first, last) addresses of the ranges, sorted
+       :rtype: ``list``
+    """
+    ranges = []
+    first = last = None
+    for ip_int in sorted(ip_ints):
+        if last is not None and ip_int <= last + 1:
+            last = max(last, ip_int)
+            continue
+        if last is not None:
+            ranges.append((first, last))
+        first = last = ip_int
+    if last is not None:
+        ranges.append((first, last))
+    return ranges
+
+
+def ip_range_to_cidrs(first, last, max_prefix_length=32):
+    """
+       Splits a range of IP addresses, given as integers, to the minimal list of CIDRs which covers it exactly.
+
+       :type first: ``int``
+       :param first: The first address of the range (required)
+       :type last: ``int``
+       :param last: The last address of the range (required)
+       :type max_prefix_length: ``int``
+       :param max_prefix_length: The number of bits of the addresses - 32 for IPv4, 128 for IPv6
+
+       :return: The (network address, prefix length) of the CIDRs, sorted
+       :rtype: ``list``
+    """
+    cidrs = []
+    while first <= last:
+        # the largest block which starts at the first address (i.e. is aligned to it) and does not exceed the range
+        block_bits = (last - first + 1).bit_length() - 1
+        if first:
+            block_bits = min(block_bits, (first & -first).bit_length() - 1)
+        cidrs.append((first, max_prefix_length - block_bits))
+        first += 1 << block_bits
+    return cidrs
+
+
 class Common(object):
     class Indicator(object):
         """
@@ -3280,6 +3380,26 @@ H || val.SSDeep && val.SSDeep == obj.SSDeep)': {'Malicious': {'Vendor': 'Vendor'
 
 # Will add only if 'requests' module imported
 if 'requests' in sys.modules:
+    def create_pooled_session(pool_maxsize=DEFAULT_MAX_WORKERS, trust_env=True):
+        """Creates a requests session whose connection pool can keep ``pool_maxsize`` connections to each host,
+        so it can be shared between concurrent requests (see ``execute_concurrently``) without reconnecting.
+
+        :type pool_maxsize: ``int``
+        :param pool_maxsize: The maximal number of connections to keep alive per host.
+
+        :type trust_env: ``bool``
+        :param trust_env: Whether to honour the environment settings (e.g. proxy environment variables).
+
+        :return: The session
+        :rtype: ``requests.Session``
+        """
+        session = requests.Session()
+        session.trust_env = trust_env
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     class BaseClient(object):
         """Client to use in integrations with powerful _http_request
         :type base_url: ``str``
@@ -3306,19 +3426,36 @@ if 'requests' in sys.modules:
             The request authorization, for example: (username, password).
             Can be None.
 
+        :type pool_connections: ``int``
+        :param pool_connections: The number of hosts to keep connection pools for.
+
+        :type pool_maxsize: ``int``
+        :param pool_maxsize: The maximal number of connections to keep alive per host.
+
+        :type keep_alive: ``bool``
+        :param keep_alive: Whether to keep connections alive, to be reused by the following requests.
+
         :return: No data returned
         :rtype: ``None``
         """
 
-        def __init__(self, base_url, verify=True, proxy=False, ok_codes=tuple(), headers=None, auth=None):
+        def __init__(self, base_url, verify=True, proxy=False, ok_codes=tuple(), headers=None, auth=None,
+                     pool_connections=10, pool_maxsize=10, keep_alive=True):
             self._base_url = base_url
             self._verify = verify
             self._ok_codes = ok_codes
             self._headers = headers
             self._auth = auth
+            self._pool_connections = pool_connections
+            self._pool_maxsize = pool_maxsize
+            self._rate_limiter = RateLimiter()
+            # the adapters are kept per retry policy, so their connection pools are reused between requests
+            self._retry_policy_to_adapter = {}  # type: dict
             self._session = requests.Session()
             if not proxy:
                 self._session.trust_env = False
+            if not keep_alive:
+                self._session.headers['Connection'] = 'close'
 
         def _implement_retry(self, retries=0,
                              status_list_to_retry=None,
@@ -3363,23 +3500,56 @@ if 'requests' in sys.modules:
                 been exhausted.
             """
             try:
-                retry = Retry(
-                    total=retries,
-                    read=retries,
-                    connect=retries,
-                    backoff_factor=backoff_factor,
-                    status=retries,
-                    status_forcelist=status_list_to_retry,
-                    method_whitelist=frozenset(['GET', 'POST', 'PUT']),
-                    raise_on_status=raise_on_status,
-                    raise_on_redirect=raise_on_redirect
-                )
-                adapter = HTTPAdapter(max_retries=retry)
+                retry_policy = (retries, frozenset(status_list_to_retry or []), backoff_factor, raise_on_redirect,
+                                raise_on_status)
+                adapter = self._retry_policy_to_adapter.get(retry_policy)
+                if adapter is None:
+                    retry = Retry(
+                        total=retries,
+                        read=retries,
+                        connect=retries,
+                        backoff_factor=backoff_factor,
+                        status=retries,
+                        status_forcelist=status_list_to_retry,
+                        method_whitelist=frozenset(['GET', 'POST', 'PUT']),
+                        raise_on_status=raise_on_status,
+                        raise_on_redirect=raise_on_redirect
+                    )
+                    adapter = HTTPAdapter(max_retries=retry, pool_connections=self._pool_connections,
+                                          pool_maxsize=self._pool_maxsize)
+                    self._retry_policy_to_adapter[retry_policy] = adapter
+                elif self._session.adapters.get('https://') is adapter and \
+                        self._session.adapters.get('http://') is adapter:
+                    return
                 self._session.mount('http://', adapter)
                 self._session.mount('https://', adapter)
             except NameError:
                 pass
 
+        def get_connection_stats(self):
+            """
+            Gets statistics of the connections of the client - how many requests were sent and over how many
+            connections, i.e. how many of the requests reused a connection that was kept alive.
+            Only the connection pools that are currently kept are counted (see ``pool_connections``).
+
+            :return: The number of ``requests`` sent, ``connections`` opened and ``reused_connections`` requests.
+            :rtype: ``dict``
+            """
+            requests_count = connections_count = 0
+            for adapter in self._retry_policy_to_adapter.values():
+                pool_managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+                for pool_manager in pool_managers:
+                    for pool_key in pool_manager.pools.keys():
+                        pool = pool_manager.pools.get(pool_key)
+                        if pool is not None:
+                            requests_count += pool.num_requests
+                            connections_count += pool.num_connections
+            return {
+                'requests': requests_count,
+                'connections': connections_count,
+                'reused_connections': max(requests_count - connections_count, 0)
+            }
+
         def _http_request(self, method, url_suffix, full_url=None, headers=None, auth=None, json_data=None,
                           params=None, data=None, files=None, timeout=10, resp_type='json', ok_codes=None,
                           return_empty_response = False, retries=0, status_list_to_retry=None,
@@ -3551,6 +3721,81 @@ if 'requests' in sys.modules:
                 err_msg = 'Max Retries Error- Request attempts with {} retries failed. \n{}'.format(retries, reason)
                 raise DemistoException(err_msg, exception)
 
+        def _http_requests_concurrently(self, requests_args, max_workers=DEFAULT_MAX_WORKERS,
+                                        max_workers_per_host=None, max_rate_limit_retries=3, retries=0,
+                                        status_list_to_retry=None, backoff_factor=5, raise_on_redirect=False,
+                                        raise_on_status=False):
+            """Sends several requests concurrently (using ``_http_request``) over the connection pool of the client.
+            A request that is rate limited by the server (HTTP 429, or HTTP 503 with a Retry-After header) is sent
+            again after the time the server asked for, and the other requests to that host are held back meanwhile.
+
+            :type requests_args: ``list``
+            :param requests_args: The arguments of the ``_http_request`` call of each request, for example:
+                [{'method': 'GET', 'url_suffix': 'alerts/1'}, {'method': 'GET', 'url_suffix': 'alerts/2'}].
+
+            :type max_workers: ``int``
+            :param max_workers: The maximal number of concurrent requests.
+
+            :type max_workers_per_host: ``int``
+            :param max_workers_per_host: The maximal number of concurrent requests to the same host.
+
+            :type max_rate_limit_retries: ``int``
+            :param max_rate_limit_retries: How many times to send again a request which was rate limited.
+
+            The ``retries``, ``status_list_to_retry``, ``backoff_factor``, ``raise_on_redirect`` and
+            ``raise_on_status`` arguments are as in ``_http_request``, and apply to all the requests.
+
+            :return: The results of the requests, in the order of ``requests_args``.
+                The result of a request that failed is the exception it raised.
+            :rtype: ``list``
+            """
+            # the retry policy is mounted once, so the requests do not replace the adapters of each other
+            self._implement_retry(retries, status_list_to_retry, backoff_factor, raise_on_redirect, raise_on_status)
+            rate_limit_hook = self._create_rate_limit_hook(max_rate_limit_retries)
+
+            def get_host(request_args):
+                address = request_args.get('full_url') or urljoin(self._base_url, request_args.get('url_suffix', ''))
+                return requests.compat.urlparse(address).netloc
+
+            def send(request_args):
+                request_args = dict(request_args, retries=retries, status_list_to_retry=status_list_to_retry,
+                                    backoff_factor=backoff_factor, raise_on_redirect=raise_on_redirect,
+                                    raise_on_status=raise_on_status)
+                hooks = dict(request_args.get('hooks') or {})
+                response_hooks = hooks.get('response') or []
+                hooks['response'] = [rate_limit_hook] + (
+                    [response_hooks] if callable(response_hooks) else list(response_hooks))
+                request_args['hooks'] = hooks
+                self._rate_limiter.wait(get_host(request_args))
+                try:
+                    return self._http_request(**request_args)
+                except Exception as exception:
+                    return exception
+
+            return execute_concurrently(send, requests_args, max_workers=max_workers, key_func=get_host,
+                                        max_workers_per_key=max_workers_per_host)
+
+        def _create_rate_limit_hook(self, max_rate_limit_retries):
+            """Creates a response hook which sends a rate limited request again, after the time the server asked for.
+
+            :type max_rate_limit_retries: ``int``
+            :param max_rate_limit_retries: How many times to send again a request which was rate limited.
+
+            :return: The hook, to be passed in the ``hooks`` argument of the request
+            :rtype: ``callable``
+            """
+            def rate_limit_hook(response, **kwargs):
+                for _ in range(max_rate_limit_retries):
+                    if not self._rate_limiter.is_rate_limited(response.status_code, response.headers):
+                        break
+                    host = requests.compat.urlparse(response.request.url).netloc
+                    self._rate_limiter.pause(host, response.headers.get('Retry-After'))
+                    self._rate_limiter.wait(host)
+                    response.close()
+                    response = response.connection.send(response.request, **kwargs)
+                return response
+
+            return rate_limit_hook
 
         def _is_status_code_valid(self, response, ok_codes=None):
             """If the status code is OK, return 'True'.
@@ -3575,6 +3820,8 @@ if 'requests' in sys.modules:
 
 def batch(iterable, batch_size=1):
     """Gets an iterable and yields slices of it.
+    Slices of a sequence (e.g. a list) are of its type, any other iterable (e.g. a generator) is consumed lazily
+    into lists.
 
     :type iterable: ``list``
     :param iterable: list or other iterable object.
@@ -3585,12 +3832,676 @@ def batch(iterable, batch_size=1):
     :rtype: ``list``
     :return:: Iterable slices of given
     """
-    current_batch = iterable[:batch_size]
-    not_batched = iterable[batch_size:]
+    if hasattr(iterable, '__getitem__') and hasattr(iterable, '__len__'):
+        for start in range(0, len(iterable), batch_size):
+            yield iterable[start:start + batch_size]
+        return
+    iterator = iter(iterable)
+    current_batch = list(itertools.islice(iterator, batch_size))
     while current_batch:
         yield current_batch
-        current_batch = not_batched[:batch_size]
-        not_batched = not_batched[batch_size:]
+        current_batch = list(itertools.islice(iterator, batch_size))
+
+
+class IndicatorsSubmitter(object):
+    """Submits indicators to the server (``demisto.createIndicators``) in batches, which are flushed when they reach
+    ``batch_size`` indicators or ``max_batch_bytes`` bytes, so a stream of indicators is never held in memory as a
+    whole. Keeps counters of the submitted batches and of the time it took to submit them.
+
+    :type batch_size: ``int``
+    :param batch_size: The maximal number of indicators in a batch.
+
+    :type max_batch_bytes: ``int``
+    :param max_batch_bytes: The maximal size of a batch, by the JSON size of its indicators.
+        If None, the size of the batches is not limited (and the indicators are not serialized to measure it).
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    def __init__(self, batch_size=2000, max_batch_bytes=None):
+        self._batch_size = batch_size
+        self._max_batch_bytes = max_batch_bytes
+        self._batch = []  # type: list
+        self._batch_bytes = 0
+        self.batches_count = 0
+        self.indicators_count = 0
+        self.submitted_bytes = 0
+        self.submit_time = 0.0
+        self.max_submit_time = 0.0
+
+    def add(self, indicator):
+        """Adds an indicator to the current batch, and submits the batch if it is full.
+
+        :type indicator: ``dict``
+        :param indicator: The indicator to submit.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        if self._max_batch_bytes:
+            indicator_bytes = len(json.dumps(indicator))
+            if self._batch and self._batch_bytes + indicator_bytes > self._max_batch_bytes:
+                self.flush()
+            self._batch_bytes += indicator_bytes
+        self._batch.append(indicator)
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def submit(self, indicators):
+        """Submits indicators in batches, including the last partial batch.
+
+        :type indicators: ``iterable``
+        :param indicators: The indicators to submit, e.g. a list or a generator.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        if not self._max_batch_bytes:
+            # whole batches are submitted without going through the current batch
+            self.flush()
+            for indicators_batch in batch(indicators, batch_size=self._batch_size):
+                self._batch = indicators_batch if isinstance(indicators_batch, list) else list(indicators_batch)
+                self.flush()
+            return
+        for indicator in indicators:
+            self.add(indicator)
+        self.flush()
+
+    def flush(self):
+        """Submits the current batch, if it is not empty.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        if not self._batch:
+            return
+        start_time = time.time()
+        demisto.createIndicators(self._batch)
+        submit_time = time.time() - start_time
+        self.batches_count += 1
+        self.indicators_count += len(self._batch)
+        self.submitted_bytes += self._batch_bytes
+        self.submit_time += submit_time
+        self.max_submit_time = max(self.max_submit_time, submit_time)
+        self._batch = []
+        self._batch_bytes = 0
+
+    def get_stats(self):
+        """Gets the counters of the submitted indicators, e.g. to be logged at the end of a fetch.
+
+        :return: The number of submitted ``indicators`` and ``batches``, their ``bytes`` (if measured), and the total
+            and the maximal seconds it took to submit a batch (``submit_time`` and ``max_submit_time``).
+        :rtype: ``dict``
+        """
+        return {
+            'indicators': self.indicators_count,
+            'batches': self.batches_count,
+            'bytes': self.submitted_bytes,
+            'submit_time': self.submit_time,
+            'max_submit_time': self.max_submit_time
+        }
+
+
+class IndicatorsSearcher(object):
+    """Iterates over the indicators found by a query (``demisto.searchIndicators``) a page at a time, so only a single
+    page is held in memory. Each page continues the search from where the previous page ended (``searchAfter``) when
+    the server supports it, and by page number otherwise.
+    Iterating over the searcher yields the indicators, and ``iter_pages`` yields them page by page.
+
+    :type query: ``str``
+    :param query: The indicators query.
+
+    :type page_size: ``int``
+    :param page_size: The number of indicators to get in each call to the server.
+
+    :type limit: ``int``
+    :param limit: The maximal number of indicators to return. If None, all the found indicators are returned.
+
+    :type page: ``int``
+    :param page: The page to start the search from.
+
+    :type search_args: ``dict``
+    :param search_args: Other arguments of ``demisto.searchIndicators``, for example: fromdate, todate.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    def __init__(self, query='', page_size=200, limit=None, page=0, **search_args):
+        self._query = query
+        self._page_size = page_size
+        self._limit = limit
+        self._search_args = search_args
+        self.page = page
+        self.search_after = None
+        self.total = None
+        self.fetched = 0
+
+    def __iter__(self):
+        for indicators_page in self.iter_pages():
+            for indicator in indicators_page:
+                yield indicator
+
+    def iter_pages(self):
+        """Searches the indicators page by page, until the last page or the limit is reached.
+
+        :return: Generator of the pages, each is a list of indicators
+        :rtype: ``iterator``
+        """
+        while self._limit is None or self.fetched < self._limit:
+            search_args = dict(self._search_args, query=self._query, size=self._page_size)
+            if self.search_after:
+                search_args['searchAfter'] = self.search_after
+            else:
+                search_args['page'] = self.page
+            res = demisto.searchIndicators(**search_args) or {}
+            indicators_page = res.get('iocs') or []
+            found_count = len(indicators_page)
+            self.page += 1
+            self.search_after = res.get('searchAfter')
+            self.total = res.get('total', self.total)
+            if self._limit is not None:
+                indicators_page = indicators_page[:self._limit - self.fetched]
+            self.fetched += len(indicators_page)
+            if indicators_page:
+                yield indicators_page
+            if found_count < self._page_size:
+                break
+
+
+def execute_concurrently(func, items, max_workers=DEFAULT_MAX_WORKERS, key_func=None, max_workers_per_key=None):
+    """Calls a function on each of the items using a bounded pool of threads.
+    Falls back to sequential calls if there is a single item or threads are not available (Python 2).
+
+    :type func: ``callable``
+    :param func: The function to call with each item.
+
+    :type items: ``iterable``
+    :param items: The items to call the function with.
+
+    :type max_workers: ``int``
+    :param max_workers: The maximal number of concurrent calls.
+
+    :type key_func: ``callable``
+    :param key_func: A function that returns the group of an item, for example the host of a URL.
+
+    :type max_workers_per_key: ``int``
+    :param max_workers_per_key: The maximal number of concurrent calls for items of the same group.
+
+    :rtype: ``list``
+    :return: The results of the calls, in the order of the items.
+        If a call raised an exception, the first such exception (by the order of the items) is raised.
+    """
+    items = list(items)
+    key_to_semaphore = {}  # type: dict
+    if key_func is not None and max_workers_per_key:
+        for item in items:
+            key = key_func(item)
+            if key not in key_to_semaphore:
+                key_to_semaphore[key] = threading.BoundedSemaphore(max_workers_per_key)
+
+    def call(item):
+        if not key_to_semaphore:
+            return func(item)
+        with key_to_semaphore[key_func(item)]:
+            return func(item)
+
+    if ThreadPoolExecutor is None or len(items) <= 1 or max_workers <= 1:
+        return [call(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
+
+
+class RateLimiter(object):
+    """Holds back the requests to hosts that asked to slow down (HTTP 429, or HTTP 503 with a Retry-After header)
+    for the time given in their Retry-After header. It is thread-safe, so it can be shared by concurrent requests.
+
+    :type default_retry_after: ``float``
+    :param default_retry_after: The seconds to hold back a host which did not send a valid Retry-After header.
+
+    :type max_retry_after: ``float``
+    :param max_retry_after: The maximal seconds to hold back a host.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    def __init__(self, default_retry_after=1, max_retry_after=60):
+        self._default_retry_after = default_retry_after
+        self._max_retry_after = max_retry_after
+        self._host_to_resume_time = {}  # type: dict
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_rate_limited(status_code, headers):
+        """Checks whether a response says that the request was rate limited.
+
+        :type status_code: ``int``
+        :param status_code: The status code of the response.
+
+        :type headers: ``dict``
+        :param headers: The headers of the response.
+
+        :return: Whether the request was rate limited
+        :rtype: ``bool``
+        """
+        return status_code == 429 or (status_code == 503 and 'Retry-After' in headers)
+
+    def parse_retry_after(self, retry_after):
+        """Parses a Retry-After header, which is either a number of seconds or an HTTP date.
+
+        :type retry_after: ``str``
+        :param retry_after: The value of the header, can be None.
+
+        :return: The seconds to wait
+        :rtype: ``float``
+        """
+        if not retry_after:
+            return self._default_retry_after
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            retry_date = email.utils.parsedate_tz(retry_after)
+            if retry_date is None:
+                return self._default_retry_after
+            seconds = email.utils.mktime_tz(retry_date) - time.time()
+        return min(max(seconds, 0), self._max_retry_after)
+
+    def pause(self, host, retry_after=None):
+        """Holds back the requests to a host.
+
+        :type host: ``str``
+        :param host: The host which asked to slow down.
+
+        :type retry_after: ``str``
+        :param retry_after: The value of the Retry-After header the host sent, can be None.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        resume_time = time.time() + self.parse_retry_after(retry_after)
+        with self._lock:
+            if resume_time > self._host_to_resume_time.get(host, 0):
+                self._host_to_resume_time[host] = resume_time
+
+    def wait(self, host):
+        """Waits until requests can be sent to a host.
+
+        :type host: ``str``
+        :param host: The host to send a request to.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        with self._lock:
+            resume_time = self._host_to_resume_time.get(host, 0)
+            if resume_time and resume_time <= time.time():
+                del self._host_to_resume_time[host]
+        delay = resume_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class FeedFetchCache(object):
+    """Keeps the HTTP validators (ETag and Last-Modified) and a hash of the content of feed URLs in the integration
+    context, so a fetch can send a conditional request and skip the URLs whose content did not change.
+    Updates are kept pending until ``save`` is called, which should be done only after the indicators of the fetch
+    were created, so a failed fetch is not skipped by the next one.
+
+    :type context_key: ``str``
+    :param context_key: The integration context key to keep the state of the feed URLs under.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    def __init__(self, context_key='feed_url_to_fetch_state'):
+        self._context_key = context_key
+        self._url_to_state = demisto.getIntegrationContext().get(context_key) or {}
+        self._pending_url_to_state = {}  # type: dict
+
+    @staticmethod
+    def create_content_hasher():
+        """Creates a hash object to incrementally hash the content of a feed, e.g. while it is downloaded.
+
+        :return: The hash object, use its ``hexdigest()`` as the content hash
+        :rtype: ``hashlib.sha256``
+        """
+        return hashlib.sha256()
+
+    @staticmethod
+    def hash_content(content):
+        """Hashes the content of a feed.
+
+        :type content: ``bytes``
+        :param content: The content to hash.
+
+        :return: The hex digest of the content
+        :rtype: ``str``
+        """
+        hasher = FeedFetchCache.create_content_hasher()
+        hasher.update(content)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def spool_response(response, chunk_size=64 * 1024, max_memory_size=10 * 1024 * 1024):
+        """Downloads the body of a streamed response into a temporary file, which is kept in memory only up to
+        ``max_memory_size`` bytes, and hashes it on the way. This allows checking whether the content changed before
+        parsing it, without holding a large feed in memory.
+
+        :type response: ``requests.Response``
+        :param response: The streamed response.
+
+        :type chunk_size: ``int``
+        :param chunk_size: The size of the chunks to read.
+
+        :type max_memory_size: ``int``
+        :param max_memory_size: The maximal size to keep in memory before spilling to disk.
+
+        :return: The temporary file, positioned at its start, and the hash of the content
+        :rtype: ``tuple``
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+        hasher = FeedFetchCache.create_content_hasher()
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            hasher.update(chunk)
+            spool.write(chunk)
+        spool.seek(0)
+        return spool, hasher.hexdigest()
+
+    def get_request_headers(self, url):
+        """Builds the conditional request headers of a URL, from the validators of its last fetch.
+
+        :type url: ``str``
+        :param url: The feed URL.
+
+        :return: The If-None-Match and If-Modified-Since headers, if known
+        :rtype: ``dict``
+        """
+        state = self._url_to_state.get(url) or {}
+        headers = {}
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+        return headers
+
+    def is_unchanged(self, url, response=None, content_hash=None):
+        """Checks whether the content of a URL did not change since its last fetch, either because the server
+        responded with 304 (Not Modified), or because the content hash is the same.
+
+        :type url: ``str``
+        :param url: The feed URL.
+
+        :type response: ``requests.Response``
+        :param response: The response of the conditional request.
+
+        :type content_hash: ``str``
+        :param content_hash: The hash of the content, see ``hash_content``.
+
+        :return: Whether the content did not change
+        :rtype: ``bool``
+        """
+        if response is not None and response.status_code == 304:
+            return True
+        state = self._url_to_state.get(url) or {}
+        return bool(content_hash) and state.get('content_hash') == content_hash
+
+    def update(self, url, response, content_hash=None):
+        """Records the validators and the content hash of a fetched URL, to be kept on ``save``.
+
+        :type url: ``str``
+        :param url: The feed URL.
+
+        :type response: ``requests.Response``
+        :param response: The response of the request.
+
+        :type content_hash: ``str``
+        :param content_hash: The hash of the content, see ``hash_content``.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        self._pending_url_to_state[url] = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content_hash': content_hash
+        }
+
+    def save(self):
+        """Keeps the recorded state of the fetched URLs in the integration context.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        if not self._pending_url_to_state:
+            return
+        self._url_to_state.update(self._pending_url_to_state)
+        self._pending_url_to_state = {}
+        integration_context = demisto.getIntegrationContext() or {}
+        integration_context[self._context_key] = self._url_to_state
+        demisto.setIntegrationContext(integration_context)
+
+
+class FeedDeltaTracker(object):
+    """Keeps compact fingerprints of the indicators of the last fetch of each feed URL in the integration context,
+    so a fetch can submit only the indicators that were added or changed since then.
+    Like ``FeedFetchCache``, the fingerprints of the current fetch are kept only when ``save`` is called, which should
+    be done after the indicators were created.
+    URLs that were not fetched (e.g. skipped by a ``FeedFetchCache``) keep the fingerprints of their last fetch.
+
+    :type context_key: ``str``
+    :param context_key: The integration context key to keep the fingerprints under.
+
+    :type keep_values: ``bool``
+    :param keep_values: Whether to keep the indicator values themselves instead of their fingerprints, so the values
+        of removed indicators can be reported. Takes more space in the integration context.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    FINGERPRINT_LENGTH = 16
+
+    def __init__(self, context_key='feed_url_to_indicator_fingerprints', keep_values=False):
+        self._context_key = context_key
+        self._keep_values = keep_values
+        self._url_to_fingerprints = demisto.getIntegrationContext().get(context_key) or {}
+        self._current_url_to_fingerprints = {}  # type: dict
+
+    @classmethod
+    def fingerprint(cls, text):
+        """Creates a short fingerprint of a text.
+
+        :type text: ``str``
+        :param text: The text.
+
+        :return: The fingerprint
+        :rtype: ``str``
+        """
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        return hashlib.sha1(text).hexdigest()[:cls.FINGERPRINT_LENGTH]
+
+    def filter_new_or_changed(self, url, indicators):
+        """Yields only the indicators of a URL that were added or changed since its last fetch.
+
+        :type url: ``str``
+        :param url: The feed URL.
+
+        :type indicators: ``iterable``
+        :param indicators: The indicators of the URL, as passed to ``demisto.createIndicators``.
+
+        :rtype: ``iterator``
+        :return: The new and changed indicators
+        """
+        previous_fingerprints = self._url_to_fingerprints.get(url) or {}
+        current_fingerprints = self._current_url_to_fingerprints.setdefault(url, {})
+        for indicator in indicators:
+            value = indicator.get('value', '')
+            key = value if self._keep_values else self.fingerprint(value)
+            content_fingerprint = self.fingerprint(json.dumps(indicator, sort_keys=True, default=str))
+            current_fingerprints[key] = content_fingerprint
+            if previous_fingerprints.get(key) != content_fingerprint:
+                yield indicator
+
+    def get_removed(self):
+        """Gets the indicators of the fetched URLs that were removed since their last fetch.
+
+        :rtype: ``list``
+        :return: The removed indicator values, or their fingerprints if ``keep_values`` is not set
+        """
+        removed = []
+        for url, current_fingerprints in self._current_url_to_fingerprints.items():
+            previous_fingerprints = self._url_to_fingerprints.get(url) or {}
+            removed.extend(key for key in previous_fingerprints if key not in current_fingerprints)
+        return removed
+
+    def save(self):
+        """Keeps the fingerprints of the fetched URLs in the integration context.
+
+        :return: No data returned
+        :rtype: ``None``
+        """
+        self._url_to_fingerprints.update(self._current_url_to_fingerprints)
+        self._current_url_to_fingerprints = {}
+        integration_context = demisto.getIntegrationContext() or {}
+        integration_context[self._context_key] = self._url_to_fingerprints
+        demisto.setIntegrationContext(integration_context)
+
+
+def report_removed_indicators(feed_name, removed, max_values_to_report=100):
+    """Logs the indicators which were removed from a feed since its last fetch, see ``FeedDeltaTracker.get_removed``.
+
+    :type feed_name: ``str``
+    :param feed_name: The name of the feed.
+
+    :type removed: ``list``
+    :param removed: The removed indicator values.
+
+    :type max_values_to_report: ``int``
+    :param max_values_to_report: The maximal number of removed values to write to the log.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    if removed:
+        demisto.info('{} - {} indicators were removed from the feed since the last fetch: {}'.format(
+            feed_name, len(removed), ', '.join(removed[:max_values_to_report])))
+
+
+class IndicatorTypeDetector(object):
+    """Infers the types of indicator values, e.g. of feeds that have no indicator type configured.
+    The patterns are compiled once, and cheap checks of the value characters decide which of them may match it at
+    all. Domains are detected by a trie of the public suffix rules, and the types of recently seen values are memoized.
+
+    :type public_suffixes: ``list``
+    :param public_suffixes: The public suffix rules (e.g. ``com``, ``co.uk`` or ``*.ck``) used to detect domains.
+        Domains are not detected if not given.
+
+    :type cache_size: ``int``
+    :param cache_size: The number of most recently seen values whose types are memoized.
+
+    :return: No data returned
+    :rtype: ``None``
+    """
+    IPV4_CIDR_REGEX = re.compile(ipv4cidrRegex)
+    IPV6_CIDR_REGEX = re.compile(ipv6cidrRegex)
+    IPV4_REGEX = re.compile(ipv4Regex)
+    IPV6_REGEX = re.compile(ipv6Regex)
+    URL_REGEX = re.compile(urlRegex)
+    EMAIL_REGEX = re.compile(emailRegex)
+    HEX_DIGITS = frozenset('0123456789abcdefABCDEF')
+    URL_FIRST_CHARS = frozenset('hfw')
+    LABEL_SEPARATORS_REGEX = re.compile(u'[.\u3002\uff0e\uff61]')
+
+    def __init__(self, public_suffixes=None, cache_size=10000):
+        self._suffix_trie = {}  # type: dict
+        for rule in public_suffixes or []:
+            node = self._suffix_trie
+            for label in reversed(rule.lower().split('.')):
+                node = node.setdefault(label, {})
+            node[None] = True
+        self._cache_size = cache_size
+        self._cache = OrderedDict()  # type: OrderedDict
+
+    def detect(self, indicator_value):
+        """Infers the type of an indicator.
+
+        :type indicator_value: ``str``
+        :param indicator_value: The indicator value.
+
+        :return: The indicator type (one of ``FeedIndicatorType``), or None if it could not be inferred
+        :rtype: ``str``
+        """
+        try:
+            # re-inserted to keep the most recently seen values last
+            indicator_type = self._cache.pop(indicator_value)
+        except KeyError:
+            indicator_type = self._detect(indicator_value)
+            if len(self._cache) >= self._cache_size:
+                self._cache.popitem(last=False)
+        self._cache[indicator_value] = indicator_type
+        return indicator_type
+
+    def _detect(self, value):
+        if not value:
+            return None
+        first_char = value[0]
+        starts_with_digit = first_char.isdigit()
+        starts_with_hex = first_char in self.HEX_DIGITS
+        has_colon = ':' in value
+
+        if '/' in value:
+            if starts_with_digit and self.IPV4_CIDR_REGEX.match(value):
+                return FeedIndicatorType.CIDR
+            if has_colon and self.IPV6_CIDR_REGEX.match(value):
+                return FeedIndicatorType.IPv6CIDR
+
+        if starts_with_digit and self.IPV4_REGEX.match(value):
+            return FeedIndicatorType.IP
+
+        if has_colon and self.IPV6_REGEX.match(value):
+            return FeedIndicatorType.IPv6
+
+        if starts_with_hex and len(value) >= 64 and sha256Regex.match(value):
+            return FeedIndicatorType.File
+
+        if first_char in self.URL_FIRST_CHARS and self.URL_REGEX.match(value):
+            return FeedIndicatorType.URL
+
+        if starts_with_hex and len(value) >= 32 and (md5Regex.match(value) or sha1Regex.match(value)):
+            return FeedIndicatorType.File
+
+        if '@' in value and self.EMAIL_REGEX.match(value):
+            return FeedIndicatorType.Email
+
+        if self._has_public_suffix(value):
+            if '*' in value:
+                return FeedIndicatorType.DomainGlob
+            return FeedIndicatorType.Domain
+
+        return None
+
+    def _has_public_suffix(self, value):
+        host = value
+        double_slashes_index = host.find('//')
+        if double_slashes_index == 0 or (double_slashes_index > 1 and host[double_slashes_index - 1] == ':'):
+            host = host[double_slashes_index + 2:]
+        host = host.partition('/')[0].partition('?')[0].partition('#')[0].rpartition('@')[-1]
+        host = host.partition(':')[0].strip().lower()
+
+        node = self._suffix_trie
+        for label in reversed(self.LABEL_SEPARATORS_REGEX.split(host.rstrip(u'.\u3002\uff0e\uff61'))):
+            if label.startswith('xn--'):
+                try:
+                    label = label.encode('ascii').decode('idna')
+                except UnicodeError:
+                    pass
+            child = node.get(label)
+            if child is None:
+                return '*' in node
+            if None in child:
+                return True
+            node = child
+        return False
 
 
 class DemistoException(Exception):
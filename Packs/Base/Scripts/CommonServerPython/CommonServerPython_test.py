@@ -15,7 +15,8 @@ from CommonServerPython import xml2json, json2xml, entryTypes, formats, tableToM
     IntegrationLogger, parse_date_string, IS_PY3, DebugLogger, b64_encode, parse_date_range, return_outputs, \
     argToBoolean, ipv4Regex, ipv4cidrRegex, ipv6cidrRegex, ipv6Regex, batch, FeedIndicatorType, \
     encode_string_results, safe_load_json, remove_empty_elements, aws_table_to_markdown, is_demisto_version_ge, \
-    appendContext
+    appendContext, execute_concurrently, FeedFetchCache, FeedDeltaTracker, IndicatorTypeDetector, \
+    report_removed_indicators, ip_ints_to_ranges, ip_range_to_cidrs, table_to_markdown_lines
 
 try:
     from StringIO import StringIO
@@ -189,6 +190,21 @@ def test_is_ip_valid():
     assert not is_ip_valid(invalid_not_ip_with_ip_structure)
 
 
+def test_ip_ints_to_ranges():
+    assert ip_ints_to_ranges([]) == []
+    assert ip_ints_to_ranges([7, 1, 3, 2, 3, 9, 8, 20]) == [(1, 3), (7, 9), (20, 20)]
+
+
+@pytest.mark.parametrize('first, last, max_prefix_length, cidrs', [
+    (0, 2 ** 32 - 1, 32, [(0, 0)]),
+    (5, 5, 32, [(5, 32)]),
+    (3, 19, 32, [(3, 32), (4, 30), (8, 29), (16, 30)]),
+    (2 ** 64, 2 ** 65 - 1, 128, [(2 ** 64, 64)]),
+])
+def test_ip_range_to_cidrs(first, last, max_prefix_length, cidrs):
+    assert ip_range_to_cidrs(first, last, max_prefix_length) == cidrs
+
+
 def test_tbl_to_md_list_values():
     # list values
     data = copy.deepcopy(DATA)
@@ -343,6 +359,48 @@ def test_tbl_to_md_header_with_special_character():
     assert table_with_character == expected_string_with_special_character
 
 
+def test_tbl_to_md_byte_string_with_dict_value():
+    """
+    Given:
+    - A table with a non ascii byte string (in py2) and a dict value, which is formatted as unicode.
+
+    When:
+    - Converting the table to markdown.
+
+    Then:
+    - Ensure the byte string is decoded, and the table is rendered.
+    """
+    data = [{'name': 'caf\xc3\xa9' if not IS_PY3 else u'caf\xe9', 'info': 'x'}, {'name': 'b', 'info': {'k': 'v'}}]
+    table = tableToMarkdown('T', data)
+    assert table == u'''### T
+|info|name|
+|---|---|
+| x | caf\xe9 |
+| k: v | b |
+'''
+
+
+def test_tbl_to_md_max_rows():
+    table = tableToMarkdown('tableToMarkdown test', DATA, max_rows=2)
+    expected_table = '''### tableToMarkdown test
+|header_1|header_2|header_3|
+|---|---|---|
+| a1 | b1 | c1 |
+| a2 | b2 | c2 |
+
+**Showing the first 2 of 3 entries.**
+'''
+    assert table == expected_table
+    assert tableToMarkdown('tableToMarkdown test', DATA, max_rows=3) == tableToMarkdown('tableToMarkdown test', DATA)
+
+
+def test_tbl_to_md_lines():
+    data = [{'a': 1, 'b': None}, {'a': 'x|y', 'b': None}]
+    lines = list(table_to_markdown_lines('tableToMarkdown test', data, removeNull=True))
+    assert lines == ['### tableToMarkdown test\n', '|a|\n', '|---|\n', '| 1 |\n', '| x\\|y |\n']
+    assert ''.join(lines) == tableToMarkdown('tableToMarkdown test', data, removeNull=True)
+
+
 def test_flatten_cell():
     # sanity
     utf8_to_flatten = b'abcdefghijklmnopqrstuvwxyz1234567890!'.decode('utf8')
@@ -1403,6 +1461,166 @@ class TestBaseClient:
         response.status_code = 400
         assert not self.client._is_status_code_valid(response)
 
+    def test_http_request_reuses_adapter(self, requests_mock):
+        """
+            Given
+            - A base client
+
+            When
+            - Making several http request calls with the same and with a different retry policy
+
+            Then
+            - Ensure the adapter of a retry policy is created once and mounted again when the policy is used again
+        """
+        from CommonServerPython import BaseClient
+        client = BaseClient('http://example.com/api/v2/', pool_maxsize=20)
+        requests_mock.get('http://example.com/api/v2/event', text='{}')
+        client._http_request('get', 'event', retries=2, status_list_to_retry=[429])
+        adapter = client._session.adapters['http://']
+        assert adapter._pool_maxsize == 20
+        client._http_request('get', 'event', retries=2, status_list_to_retry=[429])
+        assert client._session.adapters['http://'] is adapter
+        client._http_request('get', 'event', retries=3)
+        assert client._session.adapters['http://'] is not adapter
+        client._http_request('get', 'event', retries=2, status_list_to_retry=[429])
+        assert client._session.adapters['http://'] is adapter
+        assert client._session.adapters['https://'] is adapter
+        assert len(client._retry_policy_to_adapter) == 2
+
+    def test_keep_alive_disabled(self):
+        from CommonServerPython import BaseClient
+        client = BaseClient('http://example.com/api/v2/', keep_alive=False)
+        assert client._session.headers['Connection'] == 'close'
+
+    def test_get_connection_stats(self):
+        """
+            Given
+            - A base client of a local http server which keeps connections alive
+
+            When
+            - Making several http request calls
+
+            Then
+            - Ensure all the requests were sent over a single connection
+        """
+        if not IS_PY3:
+            pytest.skip("test not supported in py2")
+            return
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from CommonServerPython import BaseClient
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        client = BaseClient('http://127.0.0.1:{}/'.format(server.server_port))
+        try:
+            for _ in range(5):
+                client._http_request('get', 'event', retries=1)
+            assert client.get_connection_stats() == {'requests': 5, 'connections': 1, 'reused_connections': 4}
+        finally:
+            client._session.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_http_requests_concurrently(self, requests_mock):
+        """
+            Given
+            - A base client
+
+            When
+            - Sending several requests concurrently, one of them fails and one of them is rate limited once
+
+            Then
+            - Ensure the results are in the order of the requests, the failure is returned as an exception and the
+              rate limited request is sent again
+        """
+        from CommonServerPython import BaseClient, DemistoException
+        client = BaseClient('http://example.com/api/v2/')
+        requests_mock.get('http://example.com/api/v2/alerts/1', json={'id': 1})
+        requests_mock.get('http://example.com/api/v2/alerts/2', status_code=404, text='not found')
+        requests_mock.get('http://example.com/api/v2/alerts/3', [
+            {'status_code': 429, 'headers': {'Retry-After': '0'}},
+            {'json': {'id': 3}}
+        ])
+        requests_mock.get('http://other.com/alerts/4', json={'id': 4})
+        results = client._http_requests_concurrently([
+            {'method': 'GET', 'url_suffix': 'alerts/1'},
+            {'method': 'GET', 'url_suffix': 'alerts/2'},
+            {'method': 'GET', 'url_suffix': 'alerts/3'},
+            {'method': 'GET', 'url_suffix': '', 'full_url': 'http://other.com/alerts/4'}
+        ], max_workers_per_host=2)
+        assert results[0] == {'id': 1}
+        assert isinstance(results[1], DemistoException)
+        assert results[2:] == [{'id': 3}, {'id': 4}]
+        assert requests_mock.call_count == 5
+
+    def test_http_requests_concurrently_rate_limit_exhausted(self, requests_mock):
+        from CommonServerPython import BaseClient, DemistoException
+        client = BaseClient('http://example.com/api/v2/')
+        requests_mock.get('http://example.com/api/v2/alerts/1', status_code=429, headers={'Retry-After': '0'})
+        results = client._http_requests_concurrently([{'method': 'GET', 'url_suffix': 'alerts/1'}],
+                                                     max_rate_limit_retries=2)
+        assert isinstance(results[0], DemistoException)
+        assert requests_mock.call_count == 3
+
+
+RETRY_AFTER_VALUES = [
+    (None, 1),
+    ('5', 5),
+    ('1000', 60),
+    ('invalid', 1),
+    ('Wed, 21 Oct 2015 07:28:00 GMT', 0)
+]
+
+
+@pytest.mark.parametrize('retry_after, seconds', RETRY_AFTER_VALUES)
+def test_rate_limiter_parse_retry_after(retry_after, seconds):
+    from CommonServerPython import RateLimiter
+    assert RateLimiter().parse_retry_after(retry_after) == seconds
+
+
+def test_rate_limiter_wait(mocker):
+    """
+        Given
+        - A rate limiter
+
+        When
+        - A host asked to slow down
+
+        Then
+        - Ensure only the requests to that host wait, and only until the time the host asked for
+    """
+    import time
+    from CommonServerPython import RateLimiter
+    mocker.patch.object(time, 'time', return_value=100)
+    sleep = mocker.patch.object(time, 'sleep')
+    rate_limiter = RateLimiter()
+    assert not RateLimiter.is_rate_limited(503, {})
+    assert RateLimiter.is_rate_limited(503, {'Retry-After': '10'})
+    rate_limiter.pause('example.com', '10')
+    rate_limiter.pause('example.com', '5')
+    rate_limiter.wait('other.com')
+    assert sleep.call_count == 0
+    rate_limiter.wait('example.com')
+    sleep.assert_called_once_with(10)
+    time.time.return_value = 110
+    rate_limiter.wait('example.com')
+    assert sleep.call_count == 1
+
 
 def test_parse_date_string():
     # test unconverted data remains: Z
@@ -1589,14 +1807,310 @@ batch_params = [
     ([1, 2, 3], 5, [[1, 2, 3]]),
     # out of index in end with batches
     ([1, 2, 3, 4, 5], 2, [[1, 2], [3, 4], [5]]),
-    ([1] * 100, 2, [[1, 1]] * 50)
+    ([1] * 100, 2, [[1, 1]] * 50),
+    # iterables which are not lists
+    ((i for i in range(5)), 2, [[0, 1], [2, 3], [4]]),
+    ((1, 2, 3), 2, [(1, 2), (3,)]),
+    ({1}, 2, [[1]])
 ]
 
 
 @pytest.mark.parametrize('iterable, sz, expected', batch_params)
 def test_batch(iterable, sz, expected):
-    for i, item in enumerate(batch(iterable, sz)):
-        assert expected[i] == item
+    assert list(batch(iterable, sz)) == expected
+
+
+def test_indicators_submitter(mocker):
+    """
+        Given
+        - A generator of indicators
+
+        When
+        - Submitting the indicators with an indicators submitter
+
+        Then
+        - Ensure the indicators are submitted in batches of the batch size, including the last partial batch
+    """
+    from CommonServerPython import IndicatorsSubmitter
+    create_indicators = mocker.patch.object(demisto, 'createIndicators')
+    submitter = IndicatorsSubmitter(batch_size=2)
+    submitter.submit({'value': str(i)} for i in range(5))
+    assert [len(call_args[0][0]) for call_args in create_indicators.call_args_list] == [2, 2, 1]
+    stats = submitter.get_stats()
+    assert stats['indicators'] == 5
+    assert stats['batches'] == 3
+
+
+def test_indicators_submitter_max_batch_bytes(mocker):
+    """
+        Given
+        - Indicators, some of them large
+
+        When
+        - Submitting the indicators with an indicators submitter limited by bytes
+
+        Then
+        - Ensure a batch is flushed before it exceeds the byte limit, and an indicator larger than the limit is
+          submitted in a batch of its own
+    """
+    from CommonServerPython import IndicatorsSubmitter
+    create_indicators = mocker.patch.object(demisto, 'createIndicators')
+    submitter = IndicatorsSubmitter(batch_size=10, max_batch_bytes=100)
+    small = {'value': '1.1.1.1'}
+    large = {'value': 'a' * 200}
+    submitter.add(small)
+    submitter.add(small)
+    submitter.add(large)
+    submitter.submit([small])
+    assert [call_args[0][0] for call_args in create_indicators.call_args_list] == [[small, small], [large], [small]]
+    assert submitter.get_stats()['bytes'] == 3 * len(json.dumps(small)) + len(json.dumps(large))
+
+
+class TestIndicatorsSearcher:
+    @staticmethod
+    def search_indicators_pages(total, search_after=False):
+        """Mocks demisto.searchIndicators over a sorted list of `total` indicators"""
+        def search_indicators(query='', size=100, page=0, searchAfter=None):
+            start = searchAfter if searchAfter is not None else page * size
+            res = {'iocs': [{'value': str(i)} for i in range(start, min(start + size, total))], 'total': total}
+            if search_after:
+                res['searchAfter'] = start + size
+            return res
+        return search_indicators
+
+    def test_iterate_all(self, mocker):
+        """
+            Given
+            - 5 indicators, searched with a page size of 2
+
+            When
+            - Iterating over an indicators searcher
+
+            Then
+            - Ensure all the indicators are returned, page by page
+        """
+        from CommonServerPython import IndicatorsSearcher
+        search = mocker.patch.object(demisto, 'searchIndicators', side_effect=self.search_indicators_pages(5))
+        searcher = IndicatorsSearcher('type:IP', page_size=2)
+        assert [len(page) for page in searcher.iter_pages()] == [2, 2, 1]
+        assert search.call_args_list[1][1] == {'query': 'type:IP', 'size': 2, 'page': 1}
+        assert searcher.total == 5
+        assert searcher.page == 3
+
+    def test_limit_and_page(self, mocker):
+        from CommonServerPython import IndicatorsSearcher
+        search = mocker.patch.object(demisto, 'searchIndicators', side_effect=self.search_indicators_pages(10))
+        indicators = list(IndicatorsSearcher(page_size=3, limit=4, page=1))
+        assert [indicator['value'] for indicator in indicators] == ['3', '4', '5', '6']
+        assert search.call_count == 2
+
+    def test_search_after(self, mocker):
+        """
+            Given
+            - A server which returns the searchAfter continuation of a search
+
+            When
+            - Iterating over an indicators searcher
+
+            Then
+            - Ensure the pages after the first continue the search by searchAfter and not by page
+        """
+        from CommonServerPython import IndicatorsSearcher
+        search = mocker.patch.object(demisto, 'searchIndicators',
+                                     side_effect=self.search_indicators_pages(5, search_after=True))
+        indicators = list(IndicatorsSearcher(page_size=2))
+        assert len(indicators) == 5
+        assert 'page' not in search.call_args_list[1][1]
+        assert search.call_args_list[2][1]['searchAfter'] == 4
+
+    def test_no_indicators(self, mocker):
+        from CommonServerPython import IndicatorsSearcher
+        mocker.patch.object(demisto, 'searchIndicators', return_value={})
+        assert list(IndicatorsSearcher('type:IP')) == []
+
+
+def test_execute_concurrently_keeps_order():
+    """
+    Given
+    - Items whose calls take longer the earlier they are.
+
+    When
+    - Executing the calls concurrently.
+
+    Then
+    - Ensure the results are returned in the order of the items.
+    """
+    import time
+
+    def slow_square(i):
+        time.sleep(0.01 * (5 - i))
+        return i * i
+
+    assert execute_concurrently(slow_square, range(5), max_workers=5) == [0, 1, 4, 9, 16]
+
+
+def test_execute_concurrently_limit_per_key():
+    """
+    Given
+    - 6 URLs of the same host, and a limit of 2 concurrent calls per host.
+
+    When
+    - Executing the calls with 6 workers.
+
+    Then
+    - Ensure there are never more than 2 concurrent calls.
+    """
+    import threading
+    import time
+    lock = threading.Lock()
+    state = {'running': 0, 'max_running': 0}
+
+    def call(url):
+        with lock:
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.02)
+        with lock:
+            state['running'] -= 1
+        return url
+
+    urls = ['https://example.com/{}'.format(i) for i in range(6)]
+    results = execute_concurrently(call, urls, max_workers=6, key_func=lambda url: url.split('/')[2],
+                                   max_workers_per_key=2)
+    assert results == urls
+    assert state['max_running'] <= 2
+
+
+def test_execute_concurrently_raises():
+    """
+    Given
+    - A function which fails for one of the items.
+
+    When
+    - Executing the calls concurrently.
+
+    Then
+    - Ensure the exception is raised to the caller.
+    """
+    def fail_on_two(i):
+        if i == 2:
+            raise ValueError('failed on 2')
+        return i
+
+    with raises(ValueError, match='failed on 2'):
+        execute_concurrently(fail_on_two, range(4))
+
+
+def test_feed_fetch_cache(mocker):
+    """
+    Given
+    - A feed URL fetched with an ETag, a Last-Modified and a content hash.
+
+    When
+    - Saving the fetch cache and fetching the URL again.
+
+    Then
+    - Ensure the state is kept in the integration context only on save, without overriding its other keys.
+    - Ensure the conditional request headers are built from the kept state.
+    - Ensure a 304 response or an identical content hash are considered unchanged.
+    """
+    url = 'https://example.com/feed.txt'
+    integration_context = {'other_key': 'other_value'}
+    mocker.patch.object(demisto, 'getIntegrationContext', return_value=integration_context)
+    set_context = mocker.patch.object(demisto, 'setIntegrationContext')
+    response = mocker.Mock(status_code=200, headers={'ETag': '"abc"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+
+    fetch_cache = FeedFetchCache()
+    content_hash = FeedFetchCache.hash_content(b'1.1.1.1')
+    assert fetch_cache.get_request_headers(url) == {}
+    assert not fetch_cache.is_unchanged(url, response=response, content_hash=content_hash)
+    fetch_cache.update(url, response, content_hash)
+    assert not set_context.called
+    fetch_cache.save()
+    saved_context = set_context.call_args[0][0]
+    assert saved_context['other_key'] == 'other_value'
+
+    mocker.patch.object(demisto, 'getIntegrationContext', return_value=saved_context)
+    fetch_cache = FeedFetchCache()
+    assert fetch_cache.get_request_headers(url) == {'If-None-Match': '"abc"',
+                                                    'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+    assert fetch_cache.is_unchanged(url, response=mocker.Mock(status_code=304))
+    assert fetch_cache.is_unchanged(url, content_hash=content_hash)
+    assert not fetch_cache.is_unchanged(url, content_hash=FeedFetchCache.hash_content(b'2.2.2.2'))
+
+
+def test_feed_delta_tracker(mocker):
+    """
+    Given
+    - Two feed URLs which were fetched.
+
+    When
+    - Fetching only the first URL again, after one of its indicators was removed.
+
+    Then
+    - Ensure no indicator is submitted again, and the removed indicator value is reported.
+    - Ensure the fingerprints of the URL which was not fetched are kept.
+    """
+    mocker.patch.object(demisto, 'getIntegrationContext', return_value={})
+    set_context = mocker.patch.object(demisto, 'setIntegrationContext')
+    first_url_indicators = [{'value': '1.1.1.1', 'type': 'IP'}, {'value': '2.2.2.2', 'type': 'IP'}]
+    second_url_indicators = [{'value': 'example.com', 'type': 'Domain'}]
+
+    delta_tracker = FeedDeltaTracker(keep_values=True)
+    assert list(delta_tracker.filter_new_or_changed('first', first_url_indicators)) == first_url_indicators
+    assert list(delta_tracker.filter_new_or_changed('second', second_url_indicators)) == second_url_indicators
+    delta_tracker.save()
+
+    mocker.patch.object(demisto, 'getIntegrationContext', return_value=set_context.call_args[0][0])
+    delta_tracker = FeedDeltaTracker(keep_values=True)
+    assert list(delta_tracker.filter_new_or_changed('first', first_url_indicators[:1])) == []
+    assert delta_tracker.get_removed() == ['2.2.2.2']
+    delta_tracker.save()
+    assert set(set_context.call_args[0][0]['feed_url_to_indicator_fingerprints']['second']) == {'example.com'}
+
+
+def test_report_removed_indicators(mocker):
+    """
+    Given:
+    - Indicators which were removed from a feed, more than the maximal number to report.
+
+    When:
+    - Reporting the removed indicators, and reporting no removed indicators.
+
+    Then:
+    - Ensure the number of removed indicators and the first of them are logged once.
+    """
+    info = mocker.patch.object(demisto, 'info')
+    report_removed_indicators('Feed', ['1.1.1.1', '2.2.2.2', '3.3.3.3'], max_values_to_report=2)
+    report_removed_indicators('Feed', [])
+    info.assert_called_once_with('Feed - 3 indicators were removed from the feed since the last fetch: '
+                                 '1.1.1.1, 2.2.2.2')
+
+
+INDICATOR_TYPES = [
+    ('1.1.1.1', FeedIndicatorType.IP),
+    ('1.1.1.0/24', FeedIndicatorType.CIDR),
+    ('2001:db8::1', FeedIndicatorType.IPv6),
+    ('2001:db8::/32', FeedIndicatorType.IPv6CIDR),
+    ('d41d8cd98f00b204e9800998ecf8427e', FeedIndicatorType.File),
+    ('e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855', FeedIndicatorType.File),
+    ('https://example.com/path', FeedIndicatorType.URL),
+    ('user@example.com', FeedIndicatorType.Email),
+    ('example.co.uk', FeedIndicatorType.Domain),
+    ('*.example.com', FeedIndicatorType.DomainGlob),
+    ('host.example.ck', FeedIndicatorType.Domain),
+    ('ck', None),
+    ('example.notatld', None),
+    ('', None),
+]
+
+
+@pytest.mark.parametrize('indicator_value, indicator_type', INDICATOR_TYPES)
+def test_indicator_type_detector(indicator_value, indicator_type):
+    detector = IndicatorTypeDetector(['com', 'uk', 'co.uk', '*.ck', '!www.ck'], cache_size=2)
+    assert detector.detect(indicator_value) == indicator_type
+    assert detector.detect(indicator_value) == indicator_type
+    assert IndicatorTypeDetector().detect('example.com') is None
 
 
 regexes_test = [
@@ -4,14 +4,19 @@ from CommonServerUserPython import *
 
 
 import re
+import gzip
+import hashlib
+import sqlite3
+import tempfile
 from copy import deepcopy
+from datetime import timezone
 from base64 import b64decode
 from multiprocessing import Process
 from gevent.pywsgi import WSGIServer
 from tempfile import NamedTemporaryFile
 from flask import Flask, Response, request
-from netaddr import IPAddress, iprange_to_cidrs
-from typing import Callable, List, Any, Dict, cast, Tuple
+from netaddr import IPAddress
+from typing import Callable, List, Any, Dict, Optional, Iterator, Iterable, cast, Tuple
 from ssl import SSLContext, SSLError, PROTOCOL_TLSv1_2
 
 
@@ -30,6 +35,16 @@ EDL_VALUES_KEY: str = 'dmst_edl_values'
 EDL_LIMIT_ERR_MSG: str = 'Please provide a valid integer for EDL Size'
 EDL_MISSING_REFRESH_ERR_MSG: str = 'Refresh Rate must be "number date_range_unit", examples: (2 hours, 4 minutes, ' \
                                    '6 months, 1 day, etc.)'
+# lists larger than the threshold are sent in chunks rather than in a single write
+EDL_STREAMING_THRESHOLD: int = 1024 * 1024
+EDL_STREAMING_CHUNK_SIZE: int = 64 * 1024
+# in on demand mode the values are updated by the edl-update command, so the integration context is checked for
+# an update at most once per interval
+EDL_ON_DEMAND_CHECK_INTERVAL: int = 10
+# in incremental refresh mode the index is built again once in the interval (seconds), to drop deleted indicators
+EDL_FULL_REFRESH_INTERVAL: int = 24 * 60 * 60
+# the modified time query of an incremental refresh overlaps the previous refresh, in case of a clock skew
+EDL_INCREMENTAL_REFRESH_OVERLAP: timedelta = timedelta(minutes=1)
 ''' REFORMATTING REGEXES '''
 _PROTOCOL_RE = re.compile('^(?:[a-z]+:)*//')
 _PORT_RE = re.compile(r'^((?:[a-z]+:)*//([a-z0-9\-\.]+)|([a-z0-9\-\.]+))(?:\:[0-9]+)*')
@@ -40,6 +55,116 @@ DONT_COLLAPSE = "Don't Collapse"
 COLLAPSE_TO_CIDR = "To CIDRS"
 COLLAPSE_TO_RANGES = "To Ranges"
 
+''' HELPER CLASSES '''
+
+
+class RenderedEDL:
+    """
+    The EDL values of a refresh, encoded once and kept in memory, so requests are served without reading the
+    integration context and rebuilding the values.
+
+    Parameters:
+        values (str): The EDL values.
+        last_run (int): The time of the refresh the values were created in (the integration context last_run).
+    """
+
+    def __init__(self, values: str, last_run: Optional[int]):
+        self.body: bytes = values.encode('utf-8')
+        self.last_run = last_run
+        self.etag: str = hashlib.sha1(self.body).hexdigest()
+        self.checked_at: float = time.time()
+        self._gzipped_body: Optional[bytes] = None
+
+    @property
+    def gzipped_body(self) -> bytes:
+        """The body compressed with gzip, compressed once on first use"""
+        if self._gzipped_body is None:
+            self._gzipped_body = gzip.compress(self.body)
+        return self._gzipped_body
+
+
+class EDLIndex:
+    """
+    On-disk index of the formatted EDL values of the indicators, which an incremental refresh updates with the
+    indicators modified since the previous refresh, instead of searching and formatting all of them again.
+    The values keep the order the indicators were added in: a modified indicator keeps its position and a new one
+    is added after the existing ones, so the index serves the values in the order a full refresh would.
+
+    Parameters:
+        config (tuple): The parameters the index was built by, the index is built again if they change.
+    """
+
+    def __init__(self, config: tuple):
+        self.config = config
+        self.created_at: float = time.time()
+        self.modified_since: Optional[datetime] = None
+        file_descriptor, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(file_descriptor)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE edl_values (indicator TEXT NOT NULL, value TEXT NOT NULL, '
+                                 'indicator_type TEXT, position INTEGER NOT NULL)')
+        self._connection.execute('CREATE INDEX edl_values_indicator ON edl_values (indicator)')
+        self._connection.execute('CREATE INDEX edl_values_position ON edl_values (position)')
+        self._next_position = 0
+
+    def update(self, iocs: list, panos_compatible: bool, url_port_stripping: bool):
+        """
+        Adds the values of indicators to the index, replacing their previous values in their previous position
+        """
+        positions: Dict[str, int] = {}
+        rows = []
+        for ioc in iocs:
+            indicator = ioc.get('value')
+            if not indicator:
+                continue
+            if indicator not in positions:
+                positions[indicator] = self._get_position(indicator)
+            for value in format_indicator_value(indicator, panos_compatible, url_port_stripping):
+                rows.append((indicator, value, ioc.get('indicator_type'), positions[indicator]))
+        self.remove(positions)
+        self._connection.executemany('INSERT INTO edl_values VALUES (?, ?, ?, ?)', rows)
+
+    def _get_position(self, indicator: str) -> int:
+        """
+        Returns the position of an indicator in the index, or the next free position for a new one
+        """
+        row = self._connection.execute('SELECT position FROM edl_values WHERE indicator = ? LIMIT 1',
+                                       (indicator,)).fetchone()
+        if row:
+            return row[0]
+        self._next_position += 1
+        return self._next_position
+
+    def remove(self, indicators: Iterable[str]):
+        """
+        Removes the values of indicators from the index
+        """
+        self._connection.executemany('DELETE FROM edl_values WHERE indicator = ?',
+                                     ((indicator,) for indicator in indicators))
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def iterate_values(self, limit: int) -> Iterator[dict]:
+        """
+        Yields the values of the index in order, as indicators (with value and indicator_type), up to the limit
+        """
+        cursor = self._connection.execute('SELECT value, indicator_type FROM edl_values ORDER BY position, rowid '
+                                          'LIMIT ?', (limit,))
+        for value, indicator_type in cursor:
+            yield {'value': value, 'indicator_type': indicator_type}
+
+    def close(self):
+        self._connection.close()
+        os.remove(self.path)
+
+
+RENDERED_EDL: Optional[RenderedEDL] = None
+EDL_INDEX: Optional[EDLIndex] = None
+
 ''' HELPER FUNCTIONS '''
 
 
@@ -146,7 +271,7 @@ def find_indicators_to_limit(indicator_query: str, limit: int, offset: int = 0,
         offset_in_page = 0
 
     # the second returned variable is the next page - it is implemented for a future use of repolling
-    iocs, _ = find_indicators_to_limit_loop(indicator_query, limit, next_page=next_page,
+    iocs, _ = find_indicators_to_limit_loop(indicator_query, limit + offset_in_page, next_page=next_page,
                                             panos_compatible=panos_compatible,
                                             url_port_stripping=url_port_stripping)
 
@@ -161,7 +286,7 @@ def find_indicators_to_limit_loop(indicator_query: str, limit: int, total_fetche
                                   next_page: int = 0, last_found_len: int = PAGE_SIZE,
                                   panos_compatible: bool = True, url_port_stripping: bool = False):
     """
-    Finds indicators using while loop with demisto.searchIndicators, and returns result and last page
+    Finds indicators page by page with IndicatorsSearcher, and returns result and last page
 
     Parameters:
         indicator_query (str): Query that determines which indicators to include in
@@ -179,141 +304,157 @@ def find_indicators_to_limit_loop(indicator_query: str, limit: int, total_fetche
     iocs: List[dict] = []
     if not last_found_len:
         last_found_len = total_fetched
-    while last_found_len == PAGE_SIZE and limit and total_fetched < limit:
+    if last_found_len != PAGE_SIZE or not limit or total_fetched >= limit:
+        return iocs, next_page
+    searcher = IndicatorsSearcher(indicator_query, page_size=PAGE_SIZE, limit=limit - total_fetched, page=next_page)
+    for fetched_iocs in searcher.iter_pages():
         formatted_iocs = []
-        fetched_iocs = demisto.searchIndicators(query=indicator_query, page=next_page, size=PAGE_SIZE).get('iocs', [])
         if panos_compatible or url_port_stripping:
             for ioc in fetched_iocs:
-                ioc_value = ioc.get('value', '')
-                if url_port_stripping:
-                    ioc_value = _PORT_RE.sub(_URL_WITHOUT_PORT, ioc_value)
-                if panos_compatible:
-                    # protocol stripping
-                    ioc_value = _PROTOCOL_RE.sub('', ioc_value)
-                    # mix of text and wildcard in domain field handling
-                    ioc_value = _INVALID_TOKEN_RE.sub('*', ioc_value)
-                    # for PAN-OS *.domain.com does not match domain.com
-                    # we should provide both
-                    # this could generate more than num entries according to PAGE_SIZE
-                    if ioc_value.startswith('*.'):
-                        ioc_object_copy = deepcopy(ioc)
-                        ioc_object_copy['value'] = ioc_value.lstrip('*.')
-                        formatted_iocs.append(ioc_object_copy)
-                ioc['value'] = ioc_value
+                # this could generate more than num entries according to PAGE_SIZE
+                ioc_values = format_indicator_value(ioc.get('value', ''), panos_compatible, url_port_stripping)
+                for ioc_value in ioc_values[:-1]:
+                    ioc_object_copy = deepcopy(ioc)
+                    ioc_object_copy['value'] = ioc_value
+                    formatted_iocs.append(ioc_object_copy)
+                ioc['value'] = ioc_values[-1]
                 formatted_iocs.append(ioc)
             iocs.extend(formatted_iocs)
         else:
             iocs.extend(fetched_iocs)
-        last_found_len = len(fetched_iocs)
-        total_fetched += last_found_len
-        next_page += 1
-    return iocs, next_page
-
+    return iocs, searcher.page
 
-def ip_groups_to_cidrs(ip_range_groups: list):
-    """Collapse ip groups list to CIDRs
 
-    Args:
-        ip_range_groups (list): a list of lists containing connected IPs
-
-    Returns:
-        list. a list of CIDRs.
+def format_indicator_value(ioc_value: str, panos_compatible: bool, url_port_stripping: bool) -> List[str]:
     """
-    ip_ranges = []  # type:List
-    for group in ip_range_groups:
-        # handle single ips
-        if len(group) == 1:
-            ip_ranges.append(str(group[0]))
-            continue
-
-        min_ip = group[0]
-        max_ip = group[-1]
-        moved_ip = False
-        # CIDR must begin with an even LSB
-        # if the first ip does not - separate it from the rest of the range
-        if (int(str(min_ip).split('.')[-1]) % 2) != 0:
-            ip_ranges.append(str(min_ip))
-            min_ip = group[1]
-            moved_ip = True
-
-        # CIDR must end with uneven LSB
-        # if the last ip does not - separate it from the rest of the range
-        if (int(str(max_ip).split('.')[-1]) % 2) == 0:
-            ip_ranges.append(str(max_ip))
-            max_ip = group[-2]
-            moved_ip = True
-
-        # if both min and max ips were shifted and there are only 2 ips in the range
-        # we added both ips by the shift and now we move to the next  range
-        if moved_ip and len(group) == 2:
-            continue
-
-        else:
-            ip_ranges.append(str(iprange_to_cidrs(min_ip, max_ip)[0].cidr))
-
-    return ip_ranges
+    Formats an indicator value for the EDL
 
+    Parameters:
+        ioc_value (str): The indicator value
+        panos_compatible (bool): Whether to make the indicators PANOS compatible or not
+        url_port_stripping (bool): Whether to strip the port from URL indicators (if a port is present) or not
 
-def ip_groups_to_ranges(ip_range_groups: list):
-    """Collapse ip groups list to ranges.
+    Returns:
+        list: The EDL values of the indicator (a wildcard domain has two values in PAN-OS compatibility)
+    """
+    if url_port_stripping:
+        ioc_value = _PORT_RE.sub(_URL_WITHOUT_PORT, ioc_value)
+    if panos_compatible:
+        # protocol stripping
+        ioc_value = _PROTOCOL_RE.sub('', ioc_value)
+        # mix of text and wildcard in domain field handling
+        ioc_value = _INVALID_TOKEN_RE.sub('*', ioc_value)
+        # for PAN-OS *.domain.com does not match domain.com
+        # we should provide both
+        if ioc_value.startswith('*.'):
+            return [ioc_value.lstrip('*.'), ioc_value]
+    return [ioc_value]
+
+
+def refresh_edl_index(indicator_query: str, limit: int, panos_compatible: bool = True,
+                      url_port_stripping: bool = False) -> EDLIndex:
+    """
+    Refreshes the EDL index with the indicators modified since its previous refresh: updates the indicators which
+    match the query, and removes the indicators which no longer match it.
+    The index is built again (swapped when complete) if there is none, the parameters changed, or
+    EDL_FULL_REFRESH_INTERVAL passed since it was built, to drop deleted indicators (a search does not return them).
+    Only the full build is limited, the indicators added by incremental refreshes may grow the index past the limit,
+    which applies to the values served from it (see EDLIndex.iterate_values).
 
-    Args:
-        ip_range_groups (list): a list of lists containing connected IPs
+    Parameters:
+        indicator_query (str): Query that determines which indicators to include in
+            the EDL (Cortex XSOAR indicator query syntax)
+        limit (int): The maximum number of indicators to include in the EDL
+        panos_compatible (bool): Whether to make the indicators PANOS compatible or not
+        url_port_stripping (bool): Whether to strip the port from URL indicators (if a port is present) or not
 
     Returns:
-        list. a list of Ranges.
-    """
-    ip_ranges = []  # type:List
-    for group in ip_range_groups:
-        # handle single ips
-        if len(group) == 1:
-            ip_ranges.append(str(group[0]))
-            continue
+        EDLIndex: The refreshed index
+    """
+    global EDL_INDEX
+    refresh_time = datetime.now(timezone.utc)
+    config = (indicator_query, limit, panos_compatible, url_port_stripping)
+    edl_index = EDL_INDEX
+    if edl_index is None or edl_index.config != config or \
+            time.time() - edl_index.created_at > EDL_FULL_REFRESH_INTERVAL:
+        new_edl_index = EDLIndex(config)
+        try:
+            for iocs in IndicatorsSearcher(indicator_query, page_size=PAGE_SIZE, limit=limit).iter_pages():
+                new_edl_index.update(iocs, panos_compatible, url_port_stripping)
+            new_edl_index.commit()
+        except Exception:
+            new_edl_index.close()
+            raise
+        new_edl_index.modified_since = refresh_time
+        EDL_INDEX = new_edl_index
+        if edl_index is not None:
+            edl_index.close()
+        return new_edl_index
+
+    modified_since = cast(datetime, edl_index.modified_since) - EDL_INCREMENTAL_REFRESH_OVERLAP
+    modified_query = f'modified:>"{modified_since.strftime("%Y-%m-%dT%H:%M:%S %z")}"'
+    try:
+        updated_indicators = set()
+        query = f'({indicator_query}) and {modified_query}' if indicator_query else modified_query
+        for iocs in IndicatorsSearcher(query, page_size=PAGE_SIZE).iter_pages():
+            edl_index.update(iocs, panos_compatible, url_port_stripping)
+            updated_indicators.update(ioc.get('value') for ioc in iocs)
+        # the modified indicators which are not in the results of the query no longer match it
+        for iocs in IndicatorsSearcher(modified_query, page_size=PAGE_SIZE).iter_pages():
+            edl_index.remove(ioc.get('value') for ioc in iocs if ioc.get('value') not in updated_indicators)
+        edl_index.commit()
+    except Exception:
+        edl_index.rollback()
+        raise
+    edl_index.modified_since = refresh_time
+    return edl_index
 
-        min_ip = group[0]
-        max_ip = group[-1]
-        ip_ranges.append(str(min_ip) + "-" + str(max_ip))
 
-    return ip_ranges
+def close_edl_index():
+    """
+    Closes the EDL index, removing its file
+    """
+    global EDL_INDEX
+    if EDL_INDEX is not None:
+        EDL_INDEX.close()
+        EDL_INDEX = None
 
 
 def ips_to_ranges(ips: list, collapse_ips):
     """Collapse IPs to Ranges or CIDRs.
 
     Args:
-        ips (list): a list of IP strings.
+        ips (list): a list of IPAddress objects of the same IP version.
         collapse_ips (str): Whether to collapse to Ranges or CIDRs.
 
     Returns:
         list. a list to Ranges or CIDRs.
     """
-    ips_range_groups = []  # type:List
-    ips = sorted(ips)
-
-    if len(ips) > 0:
-        ips_range_groups.append([ips[0]])
-
-    if len(ips) > 1:
-        for ip in ips[1:]:
-            appended = False
+    if not ips:
+        return []
 
-            for group in ips_range_groups:
-                if IPAddress(int(ip) + 1) in group or IPAddress(int(ip) - 1) in group:
-                    group.append(ip)
-                    sorted(group)
-                    appended = True
+    ip_version = ips[0].version
+    max_prefix_length = 32 if ip_version == 4 else 128
+    ip_ranges = []  # type:List
+    for first, last in ip_ints_to_ranges(int(ip) for ip in ips):
+        # handle single ips
+        if first == last:
+            ip_ranges.append(str(IPAddress(first, ip_version)))
 
-            if not appended:
-                ips_range_groups.append([ip])
+        elif collapse_ips == COLLAPSE_TO_RANGES:
+            ip_ranges.append(f'{IPAddress(first, ip_version)}-{IPAddress(last, ip_version)}')
 
-    if collapse_ips == COLLAPSE_TO_RANGES:
-        return ip_groups_to_ranges(ips_range_groups)
+        else:
+            for network, prefix_length in ip_range_to_cidrs(first, last, max_prefix_length):
+                if prefix_length == max_prefix_length:
+                    ip_ranges.append(str(IPAddress(network, ip_version)))
+                else:
+                    ip_ranges.append(f'{IPAddress(network, ip_version)}/{prefix_length}')
 
-    else:
-        return ip_groups_to_cidrs(ips_range_groups)
+    return ip_ranges
 
 
-def create_values_for_returned_dict(iocs: list, collapse_ips: str = DONT_COLLAPSE) -> Tuple[dict, int]:
+def create_values_for_returned_dict(iocs: Iterable[dict], collapse_ips: str = DONT_COLLAPSE) -> Tuple[dict, int]:
     """
     Create a dictionary for output values
     """
@@ -371,6 +512,91 @@ def get_edl_ioc_values(on_demand, limit, indicator_query='', last_run=None, cach
     return values_str
 
 
+def get_rendered_edl(params: dict) -> RenderedEDL:
+    """
+    Gets the EDL values to serve, rendered once per refresh.
+    The integration context is read only when the values may have been refreshed since they were rendered: when the
+    refresh rate has passed, or in on demand mode at most once per EDL_ON_DEMAND_CHECK_INTERVAL seconds.
+    """
+    global RENDERED_EDL
+    on_demand = params.get('on_demand')
+    rendered_edl = RENDERED_EDL
+    if rendered_edl:
+        if on_demand:
+            if time.time() - rendered_edl.checked_at < EDL_ON_DEMAND_CHECK_INTERVAL:
+                return rendered_edl
+        elif rendered_edl.last_run:
+            cache_time, _ = parse_date_range(params.get('cache_refresh_rate'), to_timestamp=True)
+            if rendered_edl.last_run > cache_time:
+                return rendered_edl
+
+    if params.get('incremental_refresh') and not on_demand:
+        limit = try_parse_integer(params.get('edl_size'), EDL_LIMIT_ERR_MSG)
+        now = datetime.now()
+        edl_index = refresh_edl_index(params.get('indicators_query'), limit,
+                                      panos_compatible=params.get('panos_compatible', False),
+                                      url_port_stripping=params.get('url_port_stripping', False))
+        out_dict, _ = create_values_for_returned_dict(edl_index.iterate_values(limit),
+                                                      collapse_ips=params.get('collapse_ips', DONT_COLLAPSE))
+        # the new values are swapped in only when complete, requests in flight keep the previous values
+        RENDERED_EDL = RenderedEDL(out_dict[EDL_VALUES_KEY], date_to_timestamp(now))
+        return RENDERED_EDL
+
+    last_run = demisto.getIntegrationContext().get('last_run')
+    if rendered_edl and on_demand and rendered_edl.last_run == last_run:
+        rendered_edl.checked_at = time.time()
+        return rendered_edl
+
+    values = get_edl_ioc_values(
+        on_demand=on_demand,
+        limit=try_parse_integer(params.get('edl_size'), EDL_LIMIT_ERR_MSG),
+        last_run=last_run,
+        indicator_query=params.get('indicators_query'),
+        cache_refresh_rate=params.get('cache_refresh_rate'),
+        panos_compatible=params.get('panos_compatible', False),
+        url_port_stripping=params.get('url_port_stripping', False),
+        collapse_ips=params.get('collapse_ips')
+    )
+    # the values may have been refreshed above
+    RENDERED_EDL = RenderedEDL(values, demisto.getIntegrationContext().get('last_run'))
+    return RENDERED_EDL
+
+
+def iterate_chunks(body: bytes) -> Iterator[bytes]:
+    """
+    Yields the body in chunks of EDL_STREAMING_CHUNK_SIZE bytes
+    """
+    for offset in range(0, len(body), EDL_STREAMING_CHUNK_SIZE):
+        yield body[offset:offset + EDL_STREAMING_CHUNK_SIZE]
+
+
+def create_edl_response(rendered_edl: RenderedEDL) -> Response:
+    """
+    Creates the response for the rendered EDL values - gzip compressed if the client accepts it, 304 Not Modified if
+    the client already has them (by the If-None-Match header), and streamed in chunks if they are large.
+    """
+    use_gzip = bool(request.accept_encodings['gzip'])
+    if use_gzip:
+        body = rendered_edl.gzipped_body
+        etag = f'{rendered_edl.etag}-gzip'
+    else:
+        body = rendered_edl.body
+        etag = rendered_edl.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif len(body) > EDL_STREAMING_THRESHOLD:
+        response = Response(iterate_chunks(body), status=200, mimetype='text/plain')
+    else:
+        response = Response(body, status=200, mimetype='text/plain')
+
+    if use_gzip and response.status_code == 200:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag)
+    return response
+
+
 def get_ioc_values_str_from_context() -> str:
     """
     Extracts output values from cache
@@ -431,20 +657,7 @@ def route_edl_values() -> Response:
             err_msg: str = 'Basic authentication failed. Make sure you are using the right credentials.'
             demisto.debug(err_msg)
             return Response(err_msg, status=401)
-    panos_compatible: bool = params.get('panos_compatible', False)
-    url_port_stripping: bool = params.get('url_port_stripping', False)
-
-    values = get_edl_ioc_values(
-        on_demand=params.get('on_demand'),
-        limit=try_parse_integer(params.get('edl_size'), EDL_LIMIT_ERR_MSG),
-        last_run=demisto.getIntegrationContext().get('last_run'),
-        indicator_query=params.get('indicators_query'),
-        cache_refresh_rate=params.get('cache_refresh_rate'),
-        panos_compatible=panos_compatible,
-        url_port_stripping=url_port_stripping,
-        collapse_ips=params.get('collapse_ips')
-    )
-    return Response(values, status=200, mimetype='text/plain')
+    return create_edl_response(get_rendered_edl(params))
 
 
 ''' COMMAND FUNCTIONS '''
@@ -533,6 +746,7 @@ def run_long_running(params, is_test=False):
         demisto.error(f'An error occurred in long running loop: {str(e)}')
         raise ValueError(str(e))
     finally:
+        close_edl_index()
         if certificate_path:
             os.unlink(certificate_path)
         if private_key_path:
@@ -1,7 +1,9 @@
 """Imports"""
+import os
 import json
 import pytest
 import demistomock as demisto
+from CommonServerPython import date_to_timestamp, datetime
 from netaddr import IPAddress
 
 IOC_RES_LEN = 38
@@ -306,3 +308,203 @@ class TestHelperFunctions:
         assert "1.1.1.3" not in ip_range_list
         assert "2.2.2.2" in ip_range_list
         assert "25.24.23.22" in ip_range_list
+
+    @pytest.mark.ips_to_cidrs
+    def test_ips_to_ranges_cidr_exact_cover(self):
+        from EDL import ips_to_ranges, COLLAPSE_TO_CIDR
+        ip_list = [IPAddress(f'10.0.0.{i}') for i in range(3, 20)] + [IPAddress('10.0.0.19'), IPAddress('10.0.1.0')]
+
+        ip_range_list = ips_to_ranges(ip_list, COLLAPSE_TO_CIDR)
+        assert ip_range_list == ['10.0.0.3', '10.0.0.4/30', '10.0.0.8/29', '10.0.0.16/30', '10.0.1.0']
+
+    @pytest.mark.ips_to_cidrs
+    def test_ips_to_ranges_ipv6(self):
+        from EDL import ips_to_ranges, COLLAPSE_TO_CIDR, COLLAPSE_TO_RANGES
+        ip_list = [IPAddress('2001:db8::1'), IPAddress('2001:db8::2'), IPAddress('2001:db8::3'), IPAddress('2001:db8::8')]
+
+        assert ips_to_ranges(ip_list, COLLAPSE_TO_CIDR) == ['2001:db8::1', '2001:db8::2/127', '2001:db8::8']
+        assert ips_to_ranges(ip_list, COLLAPSE_TO_RANGES) == ['2001:db8::1-2001:db8::3', '2001:db8::8']
+
+
+@pytest.mark.route_edl_values
+class TestRouteEDLValues:
+    PARAMS = {'edl_size': '10', 'indicators_query': 'type:IP', 'cache_refresh_rate': '5 minutes'}
+
+    @pytest.fixture(autouse=True)
+    def reset_rendered_edl(self):
+        import EDL
+        EDL.RENDERED_EDL = None
+
+    def test_rendered_once_per_refresh(self, mocker):
+        """Test the values are rendered on the first request and then served from memory"""
+        import EDL
+        mocker.patch.object(demisto, 'params', return_value=self.PARAMS)
+        # the context is read before the refresh, and after it for the refresh time
+        get_context = mocker.patch.object(demisto, 'getIntegrationContext',
+                                          side_effect=[{}, {'last_run': date_to_timestamp(datetime.now())}])
+        refresh = mocker.patch.object(EDL, 'refresh_edl_context', return_value='1.1.1.1\n2.2.2.2')
+        client = EDL.APP.test_client()
+
+        first_response = client.get('/')
+        second_response = client.get('/')
+        assert first_response.data == second_response.data == b'1.1.1.1\n2.2.2.2'
+        assert refresh.call_count == 1
+        assert get_context.call_count == 2
+
+    def test_etag_and_gzip(self, mocker):
+        """Test the If-None-Match and Accept-Encoding headers are respected"""
+        import gzip
+        import EDL
+        mocker.patch.object(demisto, 'params', return_value=self.PARAMS)
+        mocker.patch.object(demisto, 'getIntegrationContext', return_value={})
+        mocker.patch.object(EDL, 'refresh_edl_context', return_value='1.1.1.1\n2.2.2.2')
+        client = EDL.APP.test_client()
+
+        response = client.get('/')
+        assert client.get('/', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+        gzip_response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert gzip_response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(gzip_response.data) == b'1.1.1.1\n2.2.2.2'
+        assert gzip_response.headers['ETag'] != response.headers['ETag']
+
+    def test_large_list_streamed(self, mocker):
+        """Test large lists are sent in chunks"""
+        import EDL
+        mocker.patch.object(EDL, 'EDL_STREAMING_THRESHOLD', 10)
+        mocker.patch.object(EDL, 'EDL_STREAMING_CHUNK_SIZE', 4)
+        mocker.patch.object(demisto, 'params', return_value=self.PARAMS)
+        mocker.patch.object(demisto, 'getIntegrationContext', return_value={})
+        mocker.patch.object(EDL, 'refresh_edl_context', return_value='1.1.1.1\n2.2.2.2')
+
+        response = EDL.APP.test_client().get('/')
+        assert response.is_streamed
+        assert response.data == b'1.1.1.1\n2.2.2.2'
+
+    def test_on_demand_update(self, mocker):
+        """Test an update by the edl-update command is served after the check interval"""
+        import EDL
+        mocker.patch.object(demisto, 'params', return_value=dict(self.PARAMS, on_demand=True))
+        mocker.patch.object(demisto, 'getIntegrationContext',
+                            return_value={EDL.EDL_VALUES_KEY: '1.1.1.1', 'last_run': 1})
+        client = EDL.APP.test_client()
+        assert client.get('/').data == b'1.1.1.1'
+
+        mocker.patch.object(demisto, 'getIntegrationContext',
+                            return_value={EDL.EDL_VALUES_KEY: '2.2.2.2', 'last_run': 2})
+        assert client.get('/').data == b'1.1.1.1'
+        EDL.RENDERED_EDL.checked_at -= EDL.EDL_ON_DEMAND_CHECK_INTERVAL
+        assert client.get('/').data == b'2.2.2.2'
+
+
+class TestIncrementalRefresh:
+    PARAMS = {'indicators_query': 'type:IP', 'edl_size': '10', 'cache_refresh_rate': '5 minutes',
+              'incremental_refresh': True}
+
+    @pytest.fixture(autouse=True)
+    def clear_edl_index(self):
+        import EDL
+        EDL.RENDERED_EDL = None
+        yield
+        if EDL.EDL_INDEX:
+            EDL.EDL_INDEX.close()
+        EDL.EDL_INDEX = None
+
+    @staticmethod
+    def search_indicators(results):
+        def search(query, **kwargs):
+            return {'iocs': results.get(query, []) if kwargs.get('page', 0) == 0 else [], 'total': 0}
+        return search
+
+    def test_incremental_refresh(self, mocker):
+        """
+        Given
+            - An EDL index built by a full refresh
+        When
+            - Indicators are modified: one is added, one still matches the query, one no longer matches it
+        Then
+            - The incremental refresh searches only the modified indicators, the modified indicator keeps its place
+              and the added one is added at the end
+        """
+        import EDL
+        mocker.patch.object(demisto, 'params', return_value=self.PARAMS)
+        mocker.patch.object(demisto, 'searchIndicators', side_effect=self.search_indicators(
+            {'type:IP': [{'value': '2.2.2.2', 'indicator_type': 'IP'}, {'value': '1.1.1.1', 'indicator_type': 'IP'}]}))
+        assert EDL.get_rendered_edl(self.PARAMS).body == b'2.2.2.2\n1.1.1.1'
+        edl_index = EDL.EDL_INDEX
+
+        EDL.RENDERED_EDL.last_run = 0
+        modified_since = edl_index.modified_since - EDL.EDL_INCREMENTAL_REFRESH_OVERLAP
+        modified_query = f'modified:>"{modified_since.strftime("%Y-%m-%dT%H:%M:%S %z")}"'
+        search = mocker.patch.object(demisto, 'searchIndicators', side_effect=self.search_indicators({
+            f'(type:IP) and {modified_query}': [{'value': '0.0.0.0', 'indicator_type': 'IP'},
+                                                {'value': '2.2.2.2', 'indicator_type': 'IP'}],
+            modified_query: [{'value': '0.0.0.0', 'indicator_type': 'IP'}, {'value': '1.1.1.1', 'indicator_type': 'IP'},
+                             {'value': '2.2.2.2', 'indicator_type': 'IP'}]
+        }))
+        assert EDL.get_rendered_edl(self.PARAMS).body == b'2.2.2.2\n0.0.0.0'
+        assert EDL.EDL_INDEX is edl_index
+        assert all('modified:>' in call[1]['query'] for call in search.call_args_list)
+
+    def test_incremental_refresh_empty_query(self, mocker):
+        """
+        Given
+            - An EDL index of all the indicators (an empty query), built by a full refresh
+        When
+            - An indicator is added, past the EDL size
+        Then
+            - The incremental refresh searches only by the modification time, and the EDL size limits the values as
+              in a full refresh
+        """
+        import EDL
+        params = dict(self.PARAMS, indicators_query='', edl_size='2')
+        mocker.patch.object(demisto, 'searchIndicators', side_effect=self.search_indicators(
+            {'': [{'value': '2.2.2.2', 'indicator_type': 'IP'}, {'value': '1.1.1.1', 'indicator_type': 'IP'}]}))
+        assert EDL.get_rendered_edl(params).body == b'2.2.2.2\n1.1.1.1'
+        edl_index = EDL.EDL_INDEX
+
+        EDL.RENDERED_EDL.last_run = 0
+        modified_since = edl_index.modified_since - EDL.EDL_INCREMENTAL_REFRESH_OVERLAP
+        modified_query = f'modified:>"{modified_since.strftime("%Y-%m-%dT%H:%M:%S %z")}"'
+        search = mocker.patch.object(demisto, 'searchIndicators', side_effect=self.search_indicators(
+            {modified_query: [{'value': '0.0.0.0', 'indicator_type': 'IP'}]}))
+        assert EDL.get_rendered_edl(params).body == b'2.2.2.2\n1.1.1.1'
+        assert EDL.EDL_INDEX is edl_index
+        assert {call[1]['query'] for call in search.call_args_list} == {modified_query}
+
+    def test_full_refresh_on_config_change(self, mocker):
+        """
+        Given
+            - An EDL index built by a full refresh
+        When
+            - The indicators query is changed
+        Then
+            - The index is built again and swapped
+        """
+        import EDL
+        mocker.patch.object(demisto, 'searchIndicators', side_effect=self.search_indicators(
+            {'type:IP': [{'value': '1.1.1.1', 'indicator_type': 'IP'}],
+             'type:Domain': [{'value': '*.example.com', 'indicator_type': 'Domain'}]}))
+        EDL.refresh_edl_index('type:IP', 10)
+        edl_index = EDL.EDL_INDEX
+
+        assert EDL.refresh_edl_index('type:Domain', 10) is EDL.EDL_INDEX
+        assert EDL.EDL_INDEX is not edl_index
+        assert [value['value'] for value in EDL.EDL_INDEX.iterate_values(10)] == ['example.com', '*.example.com']
+
+    def test_close_edl_index(self, mocker):
+        """
+        Given
+            - An EDL index built by a full refresh
+        When
+            - The EDL index is closed on exit
+        Then
+            - The file of the index is removed
+        """
+        import EDL
+        mocker.patch.object(demisto, 'searchIndicators', side_effect=self.search_indicators(
+            {'type:IP': [{'value': '1.1.1.1', 'indicator_type': 'IP'}]}))
+        path = EDL.refresh_edl_index('type:IP', 10).path
+        EDL.close_edl_index()
+        assert EDL.EDL_INDEX is None
+        assert not os.path.exists(path)
@@ -3,16 +3,18 @@ from CommonServerPython import *
 from CommonServerUserPython import *
 
 import re
+import gzip
 import json
+import hashlib
 import traceback
 from base64 import b64decode
 from multiprocessing import Process
 from gevent.pywsgi import WSGIServer
 from tempfile import NamedTemporaryFile
 from flask import Flask, Response, request
-from netaddr import IPAddress, iprange_to_cidrs
+from netaddr import IPAddress
 from ssl import SSLContext, SSLError, PROTOCOL_TLSv1_2
-from typing import Callable, List, Any, cast, Dict, Tuple
+from typing import Callable, Any, cast, Dict, Tuple, Optional, Iterator
 
 
 class Handler:
@@ -60,6 +62,13 @@ CTX_MISSING_REFRESH_ERR_MSG: str = 'Refresh Rate must be "number date_range_unit
                                    '6 months, 1 day, etc.)'
 CTX_NO_URLS_IN_PROXYSG_FORMAT = 'ProxySG format only outputs URLs - no URLs found in the current query'
 
+# outputs larger than the threshold are sent in chunks rather than in a single write
+STREAMING_THRESHOLD: int = 1024 * 1024
+STREAMING_CHUNK_SIZE: int = 64 * 1024
+# in on demand mode the outputs are updated by the eis-update command, so the integration context is checked for
+# an update at most once per interval
+ON_DEMAND_CHECK_INTERVAL: int = 10
+
 MIMETYPE_JSON_SEQ: str = 'application/json-seq'
 MIMETYPE_JSON: str = 'application/json'
 MIMETYPE_CSV: str = 'text/csv'
@@ -134,6 +143,42 @@ class RequestArguments:
 
         return False
 
+    def get_cache_key(self) -> tuple:
+        """The arguments which determine the output, to keep the rendered output of each request by"""
+        return (self.query, self.out_format, self.limit, self.offset, self.mwg_type, self.strip_port,
+                self.drop_invalids, self.category_default, tuple(self.category_attribute), self.collapse_ips,
+                self.csv_text)
+
+
+class RenderedOutput:
+    """
+    An output of a refresh, encoded once and kept in memory, so requests with the same arguments are served without
+    reading the integration context and formatting the indicators again.
+
+    Parameters:
+        values (str): The formatted indicators.
+        mimetype (str): The mimetype of the output format.
+        last_run (int): The time of the refresh the output was created in (the integration context last_run).
+    """
+
+    def __init__(self, values: str, mimetype: str, last_run: Optional[int]):
+        self.body: bytes = values.encode('utf-8')
+        self.mimetype = mimetype
+        self.last_run = last_run
+        self.etag: str = hashlib.sha1(self.body).hexdigest()
+        self.checked_at: float = time.time()
+        self._gzipped_body: Optional[bytes] = None
+
+    @property
+    def gzipped_body(self) -> bytes:
+        """The body compressed with gzip, compressed once on first use"""
+        if self._gzipped_body is None:
+            self._gzipped_body = gzip.compress(self.body)
+        return self._gzipped_body
+
+
+RENDERED_OUTPUTS: Dict[tuple, RenderedOutput] = {}
+
 
 ''' HELPER FUNCTIONS '''
 
@@ -169,9 +214,11 @@ def get_params_port(params: dict = demisto.params()) -> int:
     return port
 
 
-def refresh_outbound_context(request_args: RequestArguments) -> str:
+def refresh_outbound_context(request_args: RequestArguments, keep_iocs: bool = False) -> str:
     """
-    Refresh the cache values and format using an indicator_query to call demisto.searchIndicators
+    Refresh the cache values and format using an indicator_query to call demisto.searchIndicators.
+    The indicators themselves are kept in the context only if keep_iocs is set, so they can be formatted for requests
+    with other arguments in on demand mode.
     Returns: List(IoCs in output format)
     """
     now = datetime.now()
@@ -221,14 +268,13 @@ def refresh_outbound_context(request_args: RequestArguments) -> str:
     else:
         out_dict[CTX_MIMETYPE_KEY] = MIMETYPE_TEXT
 
-    demisto.setIntegrationContext({
+    integration_context = {
         "last_output": out_dict,
         'last_run': date_to_timestamp(now),
         'last_limit': request_args.limit,
         'last_offset': request_args.offset,
         'last_format': request_args.out_format,
         'last_query': request_args.query,
-        'current_iocs': iocs,
         'mwg_type': request_args.mwg_type,
         'drop_invalids': request_args.drop_invalids,
         'strip_port': request_args.strip_port,
@@ -236,7 +282,10 @@ def refresh_outbound_context(request_args: RequestArguments) -> str:
         'category_attribute': request_args.category_attribute,
         'collapse_ips': request_args.collapse_ips,
         'csv_text': request_args.csv_text
-    })
+    }
+    if keep_iocs:
+        integration_context['current_iocs'] = iocs
+    demisto.setIntegrationContext(integration_context)
     return out_dict[CTX_VALUES_KEY]
 
 
@@ -255,7 +304,7 @@ def find_indicators_with_limit(indicator_query: str, limit: int, offset: int) ->
         next_page = 0
         offset_in_page = 0
 
-    iocs, _ = find_indicators_with_limit_loop(indicator_query, limit, next_page=next_page)
+    iocs, _ = find_indicators_with_limit_loop(indicator_query, limit + offset_in_page, next_page=next_page)
 
     # if offset in page is bigger than the amount of results returned return empty list
     if len(iocs) <= offset_in_page:
@@ -267,127 +316,49 @@ def find_indicators_with_limit(indicator_query: str, limit: int, offset: int) ->
 def find_indicators_with_limit_loop(indicator_query: str, limit: int, total_fetched: int = 0, next_page: int = 0,
                                     last_found_len: int = PAGE_SIZE):
     """
-    Finds indicators using while loop with demisto.searchIndicators, and returns result and last page
+    Finds indicators page by page with IndicatorsSearcher, and returns result and last page
     """
-    iocs: List[dict] = []
     if not last_found_len:
         last_found_len = total_fetched
-    while last_found_len == PAGE_SIZE and limit and total_fetched < limit:
-        fetched_iocs = demisto.searchIndicators(query=indicator_query, page=next_page, size=PAGE_SIZE).get('iocs')
-        iocs.extend(fetched_iocs)
-        last_found_len = len(fetched_iocs)
-        total_fetched += last_found_len
-        next_page += 1
-    return iocs, next_page
-
-
-def ip_groups_to_cidrs(ip_range_groups: list):
-    """Collapse ip groups list to CIDRs
-
-    Args:
-        ip_range_groups (list): a list of lists containing connected IPs
-
-    Returns:
-        list. a list of CIDRs.
-    """
-    ip_ranges = []  # type:List
-    for group in ip_range_groups:
-        # handle single ips
-        if len(group) == 1:
-            ip_ranges.append(str(group[0]))
-            continue
-
-        min_ip = group[0]
-        max_ip = group[-1]
-        moved_ip = False
-        # CIDR must begin with an even LSB
-        # if the first ip does not - separate it from the rest of the range
-        if (int(str(min_ip).split('.')[-1]) % 2) != 0:
-            ip_ranges.append(str(min_ip))
-            min_ip = group[1]
-            moved_ip = True
-
-        # CIDR must end with uneven LSB
-        # if the last ip does not - separate it from the rest of the range
-        if (int(str(max_ip).split('.')[-1]) % 2) == 0:
-            ip_ranges.append(str(max_ip))
-            max_ip = group[-2]
-            moved_ip = True
-
-        # if both min and max ips were shifted and there are only 2 ips in the range
-        # we added both ips by the shift and now we move to the next  range
-        if moved_ip and len(group) == 2:
-            continue
-
-        else:
-            ip_ranges.append(str(iprange_to_cidrs(min_ip, max_ip)[0].cidr))
-
-    return ip_ranges
-
-
-def ip_groups_to_ranges(ip_range_groups: list):
-    """Collapse ip groups list to ranges
-
-    Args:
-        ip_range_groups (list): a list of lists containing connected IPs
-
-    Returns:
-        list. a list of Ranges.
-    """
-    ip_ranges = []  # type:List
-    for group in ip_range_groups:
-        # handle single ips
-        if len(group) == 1:
-            ip_ranges.append(str(group[0]))
-            continue
-
-        min_ip = group[0]
-        max_ip = group[-1]
-        ip_ranges.append(str(min_ip) + "-" + str(max_ip))
-
-    return ip_ranges
+    if last_found_len != PAGE_SIZE or not limit or total_fetched >= limit:
+        return [], next_page
+    searcher = IndicatorsSearcher(indicator_query, page_size=PAGE_SIZE, limit=limit - total_fetched, page=next_page)
+    iocs = list(searcher)
+    return iocs, searcher.page
 
 
 def ips_to_ranges(ips: list, collapse_ips):
     """Collapse IPs to Ranges or CIDRs.
 
     Args:
-        ips (list): a list of IP strings.
+        ips (list): a list of IPAddress objects of the same IP version.
         collapse_ips (str): Whether to collapse to Ranges or CIDRs.
 
     Returns:
         list. a list to Ranges or CIDRs.
     """
-    ips_range_groups = []  # type:List
-    ips = sorted(ips)
-    if len(ips) > 0:
-        ips_range_groups.append([ips[0]])
-
-    if len(ips) > 1:
-        for ip in ips[1:]:
-            appended = False
-
-            if len(ips_range_groups) == 0:
-                ips_range_groups.append([ip])
-                continue
-
-            for group in ips_range_groups:
-                if IPAddress(int(ip) + 1) in group or IPAddress(int(ip) - 1) in group:
-                    group.append(ip)
-                    sorted(group)
-                    appended = True
+    if not ips:
+        return []
 
-            if not appended:
-                ips_range_groups.append([ip])
+    ip_version = ips[0].version
+    max_prefix_length = 32 if ip_version == 4 else 128
+    ip_ranges = []  # type:List
+    for first, last in ip_ints_to_ranges(int(ip) for ip in ips):
+        # handle single ips
+        if first == last:
+            ip_ranges.append(str(IPAddress(first, ip_version)))
 
-    for group in ips_range_groups:
-        sorted(group)
+        elif collapse_ips == COLLAPSE_TO_RANGES:
+            ip_ranges.append(f'{IPAddress(first, ip_version)}-{IPAddress(last, ip_version)}')
 
-    if collapse_ips == COLLAPSE_TO_RANGES:
-        return ip_groups_to_ranges(ips_range_groups)
+        else:
+            for network, prefix_length in ip_range_to_cidrs(first, last, max_prefix_length):
+                if prefix_length == max_prefix_length:
+                    ip_ranges.append(str(IPAddress(network, ip_version)))
+                else:
+                    ip_ranges.append(f'{IPAddress(network, ip_version)}/{prefix_length}')
 
-    else:
-        return ip_groups_to_cidrs(ips_range_groups)
+    return ip_ranges
 
 
 def panos_url_formatting(iocs: list, drop_invalids: bool, strip_port: bool):
@@ -589,9 +560,11 @@ def create_values_for_returned_dict(iocs: list, request_args: RequestArguments)
     return {CTX_VALUES_KEY: list_to_str(formatted_indicators, '\n')}, len(formatted_indicators)
 
 
-def get_outbound_mimetype() -> str:
+def get_outbound_mimetype(integration_context: Optional[dict] = None) -> str:
     """Returns the mimetype of the export_iocs"""
-    ctx = demisto.getIntegrationContext().get('last_output', {})
+    if integration_context is None:
+        integration_context = demisto.getIntegrationContext()
+    ctx = integration_context.get('last_output', {})
     return ctx.get(CTX_MIMETYPE_KEY, 'text/plain')
 
 
@@ -647,6 +620,104 @@ def get_ioc_values_str_from_context(request_args: RequestArguments, iocs=None) -
     return returned_dict.get(CTX_VALUES_KEY, '')
 
 
+def is_rendered_output_valid(rendered_output: RenderedOutput, on_demand: bool, cache_time: Optional[int],
+                             last_run: Optional[int] = None) -> bool:
+    """
+    Checks whether a rendered output is of the latest refresh - in on demand mode, whether it was created in the
+    refresh of the given last_run, and otherwise whether it was created after the given cache_time.
+    """
+    if on_demand:
+        return rendered_output.last_run == last_run
+    return bool(rendered_output.last_run and cache_time and rendered_output.last_run > cache_time)
+
+
+def get_rendered_output(params: dict, request_args: RequestArguments) -> RenderedOutput:
+    """
+    Gets the output to serve for the request arguments, rendered once per refresh.
+    The integration context is read only when the output may have been refreshed since it was rendered: when the
+    refresh rate has passed, or in on demand mode at most once per ON_DEMAND_CHECK_INTERVAL seconds.
+    """
+    on_demand = params.get('on_demand')
+    cache_time = None
+    if not on_demand:
+        cache_time, _ = parse_date_range(params.get('cache_refresh_rate'), to_timestamp=True)
+
+    cache_key = request_args.get_cache_key()
+    rendered_output = RENDERED_OUTPUTS.get(cache_key)
+    if rendered_output:
+        if on_demand:
+            if time.time() - rendered_output.checked_at < ON_DEMAND_CHECK_INTERVAL:
+                return rendered_output
+        elif is_rendered_output_valid(rendered_output, on_demand, cache_time):
+            return rendered_output
+
+    integration_context = demisto.getIntegrationContext()
+    last_run = integration_context.get('last_run')
+    if rendered_output and on_demand and is_rendered_output_valid(rendered_output, on_demand, cache_time, last_run):
+        rendered_output.checked_at = time.time()
+        return rendered_output
+
+    values = get_outbound_ioc_values(
+        on_demand=on_demand,
+        last_update_data=integration_context,
+        cache_refresh_rate=params.get('cache_refresh_rate'),
+        request_args=request_args
+    )
+
+    if not integration_context and on_demand:
+        values = 'You are running in On-Demand mode - please run !eis-update command to initialize the ' \
+                 'export process'
+
+    elif not values:
+        values = "No Results Found For the Query"
+
+    # the output may have been refreshed above
+    integration_context = demisto.getIntegrationContext()
+    last_run = integration_context.get('last_run')
+    mimetype = get_outbound_mimetype(integration_context)
+    # drop the outputs of previous refreshes
+    for key, other_output in list(RENDERED_OUTPUTS.items()):
+        if not is_rendered_output_valid(other_output, on_demand, cache_time, last_run):
+            del RENDERED_OUTPUTS[key]
+    rendered_output = RENDERED_OUTPUTS[cache_key] = RenderedOutput(values, mimetype, last_run)
+    return rendered_output
+
+
+def iterate_chunks(body: bytes) -> Iterator[bytes]:
+    """
+    Yields the body in chunks of STREAMING_CHUNK_SIZE bytes
+    """
+    for offset in range(0, len(body), STREAMING_CHUNK_SIZE):
+        yield body[offset:offset + STREAMING_CHUNK_SIZE]
+
+
+def create_values_response(rendered_output: RenderedOutput) -> Response:
+    """
+    Creates the response for a rendered output - gzip compressed if the client accepts it, 304 Not Modified if the
+    client already has it (by the If-None-Match header), and streamed in chunks if it is large.
+    """
+    use_gzip = bool(request.accept_encodings['gzip'])
+    if use_gzip:
+        body = rendered_output.gzipped_body
+        etag = f'{rendered_output.etag}-gzip'
+    else:
+        body = rendered_output.body
+        etag = rendered_output.etag
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif len(body) > STREAMING_THRESHOLD:
+        response = Response(iterate_chunks(body), status=200, mimetype=rendered_output.mimetype)
+    else:
+        response = Response(body, status=200, mimetype=rendered_output.mimetype)
+
+    if use_gzip and response.status_code == 200:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.set_etag(etag)
+    return response
+
+
 def try_parse_integer(int_to_parse: Any, err_msg: str) -> int:
     """
     Tries to parse an integer, and if fails will throw DemistoException with given err_msg
@@ -775,23 +846,7 @@ def route_list_values() -> Response:
                 return Response(err_msg, status=401)
 
         request_args = get_request_args(params)
-
-        values = get_outbound_ioc_values(
-            on_demand=params.get('on_demand'),
-            last_update_data=demisto.getIntegrationContext(),
-            cache_refresh_rate=params.get('cache_refresh_rate'),
-            request_args=request_args
-        )
-
-        if not demisto.getIntegrationContext() and params.get('on_demand'):
-            values = 'You are running in On-Demand mode - please run !eis-update command to initialize the ' \
-                     'export process'
-
-        elif not values:
-            values = "No Results Found For the Query"
-
-        mimetype = get_outbound_mimetype()
-        return Response(values, status=200, mimetype=mimetype)
+        return create_values_response(get_rendered_output(params, request_args))
 
     except Exception:
         return Response(traceback.format_exc(), status=400, mimetype='text/plain')
@@ -918,7 +973,7 @@ def update_outbound_command(args, params):
     request_args = RequestArguments(query, out_format, limit, offset, mwg_type, strip_port, drop_invalids,
                                     category_default, category_attribute, collapse_ips, csv_text)
 
-    indicators = refresh_outbound_context(request_args)
+    indicators = refresh_outbound_context(request_args, keep_iocs=True)
     if indicators:
         hr = tableToMarkdown('List was updated successfully with the following values', indicators,
                              ['Indicators']) if print_indicators == 'true' else 'List was updated successfully'
@@ -2,6 +2,7 @@
 import json
 import pytest
 import demistomock as demisto
+from CommonServerPython import date_to_timestamp, datetime
 from netaddr import IPAddress
 
 
@@ -309,6 +310,21 @@ class TestHelperFunctions:
             # check that the first value is the second on the list
             assert ei_vals[0].get('value') == '212.115.110.19'
 
+    @pytest.mark.find_indicators_with_limit
+    def test_find_indicators_with_limit_and_offset_in_page(self, mocker):
+        """Test find indicators returns the limit also when the offset is in the middle of a page"""
+        import ExportIndicators as ei
+
+        def search_indicators(query, page, size):
+            return {'iocs': [{'value': str(i)} for i in range(page * size, (page + 1) * size)]}
+
+        search = mocker.patch.object(demisto, 'searchIndicators', side_effect=search_indicators)
+        ei_vals = ei.find_indicators_with_limit(indicator_query='', limit=ei.PAGE_SIZE, offset=ei.PAGE_SIZE + 5)
+        assert len(ei_vals) == ei.PAGE_SIZE
+        assert ei_vals[0]['value'] == str(ei.PAGE_SIZE + 5)
+        # the search starts at the page of the offset
+        assert search.call_args_list[0][1]['page'] == 1
+
     @pytest.mark.find_indicators_with_limit_loop
     def test_find_indicators_with_limit_loop_1(self, mocker):
         """Test find indicators stops when reached last page"""
@@ -567,8 +583,89 @@ class TestHelperFunctions:
         assert "2.2.2.2" in ip_range_list
         assert "25.24.23.22" in ip_range_list
 
+    @pytest.mark.ips_to_cidrs
+    def test_ips_to_ranges_cidr_exact_cover(self):
+        from ExportIndicators import ips_to_ranges, COLLAPSE_TO_CIDR
+        ip_list = [IPAddress(f'10.0.0.{i}') for i in range(3, 20)] + [IPAddress('10.0.0.19'), IPAddress('10.0.1.0')]
+
+        ip_range_list = ips_to_ranges(ip_list, COLLAPSE_TO_CIDR)
+        assert ip_range_list == ['10.0.0.3', '10.0.0.4/30', '10.0.0.8/29', '10.0.0.16/30', '10.0.1.0']
+
+    @pytest.mark.ips_to_cidrs
+    def test_ips_to_ranges_ipv6(self):
+        from ExportIndicators import ips_to_ranges, COLLAPSE_TO_CIDR, COLLAPSE_TO_RANGES
+        ip_list = [IPAddress('2001:db8::1'), IPAddress('2001:db8::2'), IPAddress('2001:db8::3'), IPAddress('2001:db8::8')]
+
+        assert ips_to_ranges(ip_list, COLLAPSE_TO_CIDR) == ['2001:db8::1', '2001:db8::2/127', '2001:db8::8']
+        assert ips_to_ranges(ip_list, COLLAPSE_TO_RANGES) == ['2001:db8::1-2001:db8::3', '2001:db8::8']
+
     def test_empty_integartion_context_mimtype(self, mocker):
         from ExportIndicators import get_outbound_mimetype
         mocker.patch.object(demisto, 'getIntegrationContext', return_value={})
         mimtype = get_outbound_mimetype()
         assert mimtype == 'text/plain'
+
+
+@pytest.mark.route_list_values
+class TestRouteListValues:
+    PARAMS = {'list_size': '10', 'indicators_query': 'type:IP', 'cache_refresh_rate': '5 minutes', 'format': 'text'}
+
+    @pytest.fixture(autouse=True)
+    def reset_rendered_outputs(self):
+        import ExportIndicators as ei
+        ei.RENDERED_OUTPUTS.clear()
+
+    def test_rendered_once_per_arguments(self, mocker):
+        """Test each output is rendered on the first request with its arguments and then served from memory"""
+        import ExportIndicators as ei
+        mocker.patch.object(demisto, 'params', return_value=self.PARAMS)
+        context = {}
+
+        def refresh(request_args, keep_iocs=False):
+            values = f'{request_args.out_format}:1.1.1.1'
+            context.update({'last_run': date_to_timestamp(datetime.now()), 'last_format': request_args.out_format,
+                            'last_output': {ei.CTX_VALUES_KEY: values, ei.CTX_MIMETYPE_KEY: 'text/plain'}})
+            return values
+
+        mocker.patch.object(demisto, 'getIntegrationContext', side_effect=lambda: dict(context))
+        refresh_mock = mocker.patch.object(ei, 'refresh_outbound_context', side_effect=refresh)
+        client = ei.APP.test_client()
+
+        assert client.get('/').data == b'text:1.1.1.1'
+        assert client.get('/?v=csv').data == b'csv:1.1.1.1'
+        assert client.get('/').data == b'text:1.1.1.1'
+        assert client.get('/?v=csv').data == b'csv:1.1.1.1'
+        assert refresh_mock.call_count == 2
+
+    def test_etag_and_gzip(self, mocker):
+        """Test the If-None-Match and Accept-Encoding headers are respected"""
+        import gzip
+        import ExportIndicators as ei
+        mocker.patch.object(demisto, 'params', return_value=dict(self.PARAMS, on_demand=True))
+        mocker.patch.object(demisto, 'getIntegrationContext', return_value={
+            'last_run': 1, 'last_format': 'text', 'last_limit': 10, 'last_offset': 0, 'mwg_type': 'string',
+            'drop_invalids': False, 'strip_port': False, 'category_default': 'bc_category', 'category_attribute': [],
+            'collapse_ips': "Don't Collapse", 'csv_text': False,
+            'last_output': {ei.CTX_VALUES_KEY: '1.1.1.1', ei.CTX_MIMETYPE_KEY: 'text/plain'}})
+        client = ei.APP.test_client()
+
+        response = client.get('/')
+        assert response.data == b'1.1.1.1'
+        assert client.get('/', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+        gzip_response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+        assert gzip_response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(gzip_response.data) == b'1.1.1.1'
+
+    def test_large_output_streamed(self, mocker):
+        """Test large outputs are sent in chunks"""
+        import ExportIndicators as ei
+        mocker.patch.object(ei, 'STREAMING_THRESHOLD', 10)
+        mocker.patch.object(ei, 'STREAMING_CHUNK_SIZE', 4)
+        mocker.patch.object(demisto, 'params', return_value=self.PARAMS)
+        mocker.patch.object(demisto, 'getIntegrationContext', return_value={})
+        mocker.patch.object(ei, 'refresh_outbound_context', return_value='1.1.1.1\n2.2.2.2')
+
+        response = ei.APP.test_client().get('/')
+        assert response.is_streamed
+        assert response.data == b'1.1.1.1\n2.2.2.2'
@@ -8,6 +8,9 @@ from elasticsearch_dsl import Search
 from elasticsearch_dsl.query import QueryString
 import requests
 import warnings
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # Disable insecure warnings
 requests.packages.urllib3.disable_warnings()
@@ -26,6 +29,10 @@ HTTP_ERRORS = {
 
 '''VARIABLES FOR FETCH INDICATORS'''
 FETCH_SIZE = 50
+SCROLL_SIZE = 1000
+INDICATORS_BATCH_SIZE = 2000
+# the maximal number of indicators whose enrichments are held before they are submitted
+ENRICHMENTS_BUFFER_SIZE = 2000
 API_KEY_PREFIX = '_api_key_id:'
 MODULE_TO_FEEDMAP_KEY = 'moduleToFeedMap'
 FEED_TYPE_GENERIC = 'Generic Feed (fill in configuration below)'
@@ -35,7 +42,8 @@ FEED_TYPE_CORTEX_MT = 'Cortex XSOAR MT Shared Feed'
 
 class ElasticsearchClient:
     def __init__(self, insecure=None, server=None, username=None, password=None, api_key=None, api_id=None,
-                 time_field=None, time_method=None, fetch_index=None, fetch_time=None, query=None):
+                 time_field=None, time_method=None, fetch_index=None, fetch_time=None, query=None,
+                 scroll_size=SCROLL_SIZE, scroll_slices=1):
         self._insecure = insecure
         self._proxy = handle_proxy()
         # _elasticsearch_builder expects _proxy to be None if empty
@@ -50,6 +58,8 @@ class ElasticsearchClient:
         self.fetch_index = fetch_index
         self.fetch_time = fetch_time
         self.query = query
+        self.scroll_size = scroll_size
+        self.scroll_slices = scroll_slices
         self.es = self._elasticsearch_builder()
 
     def _elasticsearch_builder(self):
@@ -136,12 +146,12 @@ def get_indicators_command(client, feed_type, src_val, src_type, default_type):
     now = datetime.now()
     if feed_type == FEED_TYPE_GENERIC:
         search = get_scan_generic_format(client, now)
-        ioc_lst = get_generic_indicators(search, src_val, src_type, default_type)
+        ioc_lst = get_generic_indicators(search, src_val, src_type, default_type, client.scroll_slices)
         hr = tableToMarkdown('Indicators', ioc_lst, [src_val])
     else:
         # Insight is the name of the indicator object as it's saved into the database
         search = get_scan_insight_format(client, now, feed_type=feed_type)
-        ioc_lst, ioc_enrch_lst = get_demisto_indicators(search)
+        ioc_lst, ioc_enrch_lst = get_demisto_indicators(search, client.scroll_slices)
         hr = tableToMarkdown('Indicators', list(set(map(lambda ioc: ioc.get('name'), ioc_lst))), 'Name')
         if ioc_enrch_lst:
             for ioc_enrch in ioc_enrch_lst:
@@ -149,21 +159,21 @@ def get_indicators_command(client, feed_type, src_val, src_type, default_type):
     return_outputs(hr, {}, ioc_lst)
 
 
-def get_generic_indicators(search, src_val, src_type, default_type):
+def get_generic_indicators(search, src_val, src_type, default_type, scroll_slices=1):
     """Implements get indicators in generic format"""
     ioc_lst: list = []
-    for hit in search.scan():
+    for hit in scan_hits(search, scroll_slices):
         hit_lst = extract_indicators_from_generic_hit(hit, src_val, src_type, default_type)
         ioc_lst.extend(hit_lst)
     return ioc_lst
 
 
-def get_demisto_indicators(search):
+def get_demisto_indicators(search, scroll_slices=1):
     """Implements get indicators in insight format"""
     limit = int(demisto.args().get('limit', FETCH_SIZE))
     ioc_lst: list = []
     ioc_enrch_lst: list = []
-    for hit in search.scan():
+    for hit in scan_hits(search, scroll_slices):
         hit_lst, hit_enrch_lst = extract_indicators_from_insight_hit(hit)
         ioc_lst.extend(hit_lst)
         ioc_enrch_lst.extend(hit_enrch_lst)
@@ -176,32 +186,91 @@ def fetch_indicators_command(client, feed_type, src_val, src_type, default_type,
     """Implements fetch-indicators command"""
     last_fetch_timestamp = get_last_fetch_timestamp(last_fetch, client.time_method, client.fetch_time)
     now = datetime.now()
-    ioc_lst: list = []
+    # the indicators are submitted in batches as the scroll proceeds
+    submitter = IndicatorsSubmitter(batch_size=INDICATORS_BATCH_SIZE)
     ioc_enrch_lst: list = []
     if feed_type != FEED_TYPE_GENERIC:
         # Insight is the name of the indicator object as it's saved into the database
         search = get_scan_insight_format(client, now, last_fetch_timestamp)
-        for hit in search.scan():
+        for hit in scan_hits(search, client.scroll_slices):
             hit_lst, hit_enrch_lst = extract_indicators_from_insight_hit(hit)
-            ioc_lst.extend(hit_lst)
+            for ioc in hit_lst:
+                submitter.add(ioc)
             ioc_enrch_lst.extend(hit_enrch_lst)
+            if len(ioc_enrch_lst) >= ENRICHMENTS_BUFFER_SIZE:
+                submit_enrichments(submitter, ioc_enrch_lst)
+                ioc_enrch_lst = []
     else:
         search = get_scan_generic_format(client, now, last_fetch_timestamp)
-        for hit in search.scan():
-            ioc_lst.extend(extract_indicators_from_generic_hit(hit, src_val, src_type, default_type))
-
-    if ioc_lst:
-        for b in batch(ioc_lst, batch_size=2000):
-            demisto.createIndicators(b)
-    if ioc_enrch_lst:
-        ioc_enrch_batches = create_enrichment_batches(ioc_enrch_lst)
-        for enrch_batch in ioc_enrch_batches:
-            # ensure batch sizes don't exceed 2000
-            for b in batch(enrch_batch, batch_size=2000):
-                demisto.createIndicators(b)
+        for hit in scan_hits(search, client.scroll_slices):
+            for ioc in extract_indicators_from_generic_hit(hit, src_val, src_type, default_type):
+                submitter.add(ioc)
+
+    submitter.flush()
+    submit_enrichments(submitter, ioc_enrch_lst)
+    demisto.debug(f'Elasticsearch feed - submitted indicators: {submitter.get_stats()}')
     demisto.setLastRun({'time': now.timestamp() * 1000})
 
 
+def submit_enrichments(submitter, ioc_enrch_lst):
+    """
+    Submits enrichments, after the indicators they enrich. Enrichments of the same indicator are submitted in
+    different batches
+    """
+    if not ioc_enrch_lst:
+        return
+    submitter.flush()
+    for enrch_batch in create_enrichment_batches(ioc_enrch_lst):
+        # ensure batch sizes don't exceed 2000
+        submitter.submit(enrch_batch)
+
+
+def scan_hits(search, scroll_slices=1):
+    """
+    Yields the hits of a search by the scroll API. When there is more than one scroll slice, the slices are
+    scrolled concurrently, and their hits are yielded as they arrive.
+    """
+    if scroll_slices <= 1:
+        yield from search.scan()
+        return
+
+    hits_queue: queue.Queue = queue.Queue(maxsize=INDICATORS_BATCH_SIZE)
+    stop_scan = threading.Event()
+
+    def scan_slice(slice_id):
+        scan = search.extra(slice={'id': slice_id, 'max': scroll_slices}).scan()
+        try:
+            for hit in scan:
+                while not stop_scan.is_set():
+                    try:
+                        hits_queue.put(hit, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop_scan.is_set():
+                    return
+        finally:
+            # clears the scroll of the slice when it is stopped
+            scan.close()
+
+    with ThreadPoolExecutor(max_workers=scroll_slices) as executor:
+        futures = [executor.submit(scan_slice, slice_id) for slice_id in range(scroll_slices)]
+        try:
+            while True:
+                try:
+                    yield hits_queue.get(timeout=0.1)
+                except queue.Empty:
+                    for future in futures:
+                        if future.done() and future.exception():
+                            raise future.exception()  # type: ignore
+                    # the slices put all their hits before they are done
+                    if all(future.done() for future in futures) and hits_queue.empty():
+                        break
+        finally:
+            # stops the slices if the hits are not consumed to the end
+            stop_scan.set()
+
+
 def get_last_fetch_timestamp(last_fetch, time_method, fetch_time):
     """Get the last fetch timestamp"""
     if last_fetch:
@@ -231,7 +300,7 @@ def get_scan_generic_format(client, now, last_fetch_timestamp=None):
         search = Search(using=es, index=fetch_index).filter({'range': range_field}).query(query)
     else:
         search = Search(using=es, index=fetch_index).query(QueryString(query=client.query))
-    return search
+    return search.params(size=client.scroll_size)
 
 
 def extract_indicators_from_generic_hit(hit, src_val, src_type, default_type):
@@ -261,7 +330,7 @@ def get_scan_insight_format(client, now, last_fetch_timestamp=None, feed_type=No
     elif not indices:
         indices = '_all'
     search = Search(using=es, index=indices).filter({'range': range_field}).query(query)
-    return search
+    return search.params(size=client.scroll_size)
 
 
 def extract_indicators_from_insight_hit(hit):
@@ -329,9 +398,14 @@ def main():
         fetch_index = params.get('fetch_index')
         fetch_time = params.get('fetch_time', '3 days')
         query = params.get('es_query')
+        try:
+            scroll_size = int(params.get('scroll_size') or SCROLL_SIZE)
+            scroll_slices = int(params.get('scroll_slices') or 1)
+        except ValueError:
+            raise ValueError('Please provide a valid integer for "Scroll Size" and "Scroll Slices"')
         api_id, api_key = extract_api_from_username_password(username, password)
         client = ElasticsearchClient(insecure, server, username, password, api_key, api_id, time_field, time_method,
-                                     fetch_index, fetch_time, query)
+                                     fetch_index, fetch_time, query, scroll_size, scroll_slices)
         src_val = params.get('src_val')
         src_type = params.get('src_type')
         default_type = params.get('default_type')
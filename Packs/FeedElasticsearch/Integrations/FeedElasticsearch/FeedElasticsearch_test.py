@@ -1,3 +1,8 @@
+import threading
+import pytest
+import demistomock as demisto
+
+
 class MockHit:
     def __init__(self, hit_val):
         self._hit_val = hit_val
@@ -263,3 +268,83 @@ def test_extract_api_from_username_password_username_api_key():
     import FeedElasticsearch as esf
     username = esf.API_KEY_PREFIX + 'api_id'
     assert esf.extract_api_from_username_password(username, 'api_key') == ('api_id', 'api_key')
+
+
+class MockSearch:
+    def __init__(self, hits, slice_id=None, slices=None, parent=None):
+        self._hits = hits
+        self._slice_id = slice_id
+        self._slices = slices
+        # the scans of the slices are recorded in the search they were sliced from
+        self.scanned: list = parent.scanned if parent else []
+        self.closed_scans: list = parent.closed_scans if parent else []
+        self.scan_threads: list = parent.scan_threads if parent else []
+
+    def extra(self, slice):
+        return MockSearch(self._hits, slice['id'], slice['max'], self)
+
+    def scan(self):
+        self.scan_threads.append(threading.current_thread())
+        try:
+            for i, hit in enumerate(self._hits):
+                if self._slices is None or i % self._slices == self._slice_id:
+                    self.scanned.append(hit)
+                    yield hit
+        finally:
+            self.closed_scans.append(self._slice_id)
+
+
+@pytest.mark.parametrize('scroll_slices', [1, 3])
+def test_scan_hits(scroll_slices):
+    import FeedElasticsearch as esf
+    hits = list(range(100))
+    assert sorted(esf.scan_hits(MockSearch(hits), scroll_slices)) == hits
+
+
+def test_scan_hits_stopped():
+    """Test the slices are stopped and their scans are closed when the hits are not consumed to the end"""
+    import FeedElasticsearch as esf
+    search = MockSearch(list(range(esf.INDICATORS_BATCH_SIZE * 4)))
+    hits = esf.scan_hits(search, 2)
+    assert next(hits) is not None
+    hits.close()
+    assert sorted(search.closed_scans) == [0, 1]
+    assert not any(thread.is_alive() for thread in search.scan_threads)
+    assert len(search.scanned) < esf.INDICATORS_BATCH_SIZE * 4
+
+
+def test_fetch_indicators_streamed(mocker):
+    """
+    Given
+        - Insight hits with enrichments, more than the enrichments buffer
+    When
+        - Fetching indicators
+    Then
+        - The indicators are submitted as the scroll proceeds, and enrichments are submitted after their indicators
+    """
+    from elasticsearch import Elasticsearch
+    import FeedElasticsearch as esf
+    mocker.patch.object(Elasticsearch, '__init__', return_value=None)
+    mocker.patch.object(esf, 'INDICATORS_BATCH_SIZE', 2)
+    mocker.patch.object(esf, 'ENRICHMENTS_BUFFER_SIZE', 2)
+    hits = []
+    for value in ('a.com', 'b.com', 'c.com'):
+        hits.append(MockHit({'name': value, 'moduleToFeedMap': {
+            'VirusTotal.VirusTotal': {'value': value, 'sourceBrand': 'VirusTotal', 'isEnrichment': True},
+            'Whois.Whois': {'value': value, 'sourceBrand': 'Whois', 'isEnrichment': True}
+        }}))
+    mocker.patch.object(esf, 'get_scan_insight_format', return_value=MockSearch(hits))
+    create_indicators = mocker.patch.object(demisto, 'createIndicators')
+    mocker.patch.object(demisto, 'setLastRun')
+    client = esf.ElasticsearchClient(time_method='Simple-Date', fetch_time='3 days')
+
+    esf.fetch_indicators_command(client, esf.FEED_TYPE_CORTEX, None, None, None, None)
+
+    batches = [call[0][0] for call in create_indicators.call_args_list]
+    assert [len(b) for b in batches] == [2, 2, 2, 1, 1, 1]
+    assert [ioc['value'] for ioc in batches[0]] == ['a.com', 'b.com']
+    # the two enrichments of each indicator are in different batches
+    assert [(ioc['value'], ioc['sourceBrand']) for ioc in batches[1]] == [('a.com', 'VirusTotal'), ('b.com', 'VirusTotal')]
+    assert [(ioc['value'], ioc['sourceBrand']) for ioc in batches[2]] == [('a.com', 'Whois'), ('b.com', 'Whois')]
+    assert batches[3][0]['value'] == 'c.com'
+    assert batches[3][0]['moduleToFeedMap'] == {}
@@ -3,9 +3,9 @@ from CommonServerPython import *  # noqa: E402 lgtm [py/polluting-import]
 from CommonServerUserPython import *  # noqa: E402 lgtm [py/polluting-import]
 
 from typing import List, Dict, Set
-import json
+import bisect
+import copy
 import requests
-from stix2 import TAXIICollectionSource, Filter
 from taxii2client import Server, Collection, ApiRoot
 
 ''' CONSTANT VARIABLES '''
@@ -35,6 +35,18 @@ mitre_field_mapping = {
     "mitretype": {"name": "type", "type": "str"}
 }
 
+# The types of the MITRE concepts, in the order the indicators are created:
+# Technique, Mitigation, Group, Malware and Tool
+MITRE_CONCEPT_TYPES = ['attack-pattern', 'course-of-action', 'intrusion-set', 'malware', 'tool']
+
+COLLECTIONS_CACHE_KEY = 'collections'
+SEARCH_INDEX_KEY = 'searchIndex'
+# the search index is built again after a fetch, or when it is older than this (in seconds)
+SEARCH_INDEX_MAX_AGE = 24 * 60 * 60
+TOKEN_RE = re.compile(r'\w+')
+# the number of candidate indicators of a search loaded by each query
+SEARCH_CANDIDATES_CHUNK_SIZE = 100
+
 # Disable insecure warnings
 requests.packages.urllib3.disable_warnings()
 
@@ -73,7 +85,57 @@ class Client:
         self.get_roots()
         self.get_collections()
 
-    def build_iterator(self, limit: int = -1) -> List:
+    def get_collection_objects(self, collection, collections_cache=None):
+        """
+        Retrieves the objects of the MITRE concept types from a collection in a single request, over the connection
+        shared by the collections of the server.
+        If a collections cache is given, only the objects added since the last retrieval are requested, and merged
+        into the cached objects of the collection. The objects are not requested at all if nothing was added.
+
+        Returns:
+            list. The objects of the collection.
+        """
+        if collections_cache is None:
+            return collection.get_objects(type=MITRE_CONCEPT_TYPES).get('objects') or []
+
+        cached = collections_cache.get(collection.id) or {}
+        added_after = cached.get('added')
+        manifest = collection.get_manifest(type=MITRE_CONCEPT_TYPES, added_after=added_after).get('objects') or []
+        if cached and not manifest:
+            return cached.get('objects', [])
+
+        objects = collection.get_objects(type=MITRE_CONCEPT_TYPES, added_after=added_after).get('objects') or []
+        if cached:
+            # newer versions replace the cached objects in place, new objects are added at the end
+            objects_by_id = {x.get('id'): x for x in cached.get('objects', [])}
+            objects_by_id.update((x.get('id'), x) for x in objects)
+            objects = list(objects_by_id.values())
+        collections_cache[collection.id] = {
+            'added': max([x.get('date_added') or '' for x in manifest] + [added_after or '']) or None,
+            'objects': objects
+        }
+        return objects
+
+    def iterate_collections_objects(self, limit: int = -1, collections_cache=None):
+        """
+        Retrieves the objects of all the collections, concurrently. With a limit, the collections are retrieved
+        one by one when iterated, so the ones after the limit is reached are not retrieved.
+
+        Returns:
+            iterable. The objects of each collection, in the order of the collections.
+        """
+        def get_objects(collection):
+            try:
+                return self.get_collection_objects(collection, collections_cache)
+            except Exception as err:
+                demisto.debug(f"Failed to retrieve the MITRE collection {collection.id} - {err}")
+                return ((collections_cache or {}).get(collection.id) or {}).get('objects', [])
+
+        if limit > 0:
+            return map(get_objects, self.collections)
+        return execute_concurrently(get_objects, self.collections)
+
+    def build_iterator(self, limit: int = -1, collections_cache=None) -> List:
 
         """Retrieves all entries from the feed.
 
@@ -88,40 +150,22 @@ class Client:
         counter = 0
 
         # For each collection
-        for collection in self.collections:
-
-            # Stop when we have reached the limit defined
-            if 0 < limit <= counter:
-                break
-
-            # Establish TAXII2 Collection instance
-            collection_url = urljoin(self.base_url, f'stix/collections/{collection.id}/')
-            collection_data = Collection(collection_url)
-
-            # Supply the collection to TAXIICollection
-            tc_source = TAXIICollectionSource(collection_data)
+        for collection_objects in self.iterate_collections_objects(limit, collections_cache):
 
-            # Create filters to retrieve content
-            filter_objs = {
-                "Technique": {"name": "attack-pattern", "filter": Filter("type", "=", "attack-pattern")},
-                "Mitigation": {"name": "course-of-action", "filter": Filter("type", "=", "course-of-action")},
-                "Group": {"name": "intrusion-set", "filter": Filter("type", "=", "intrusion-set")},
-                "Malware": {"name": "malware", "filter": Filter("type", "=", "malware")},
-                "Tool": {"name": "tool", "filter": Filter("type", "=", "tool")},
-            }
+            # Group the content by concept
+            mitre_data_by_type: Dict[str, List[Dict]] = {concept_type: [] for concept_type in MITRE_CONCEPT_TYPES}
+            for mitre_item in collection_objects:
+                if mitre_item.get('type') in mitre_data_by_type:
+                    mitre_data_by_type[mitre_item['type']].append(mitre_item)
 
             # Retrieve content
-            for concept in filter_objs:
+            for concept_type in MITRE_CONCEPT_TYPES:
 
                 # Stop when we have reached the limit defined
                 if 0 < limit <= counter:
                     break
 
-                input_filter = filter_objs[concept]['filter']
-                try:
-                    mitre_data = tc_source.query(input_filter)
-                except Exception:
-                    continue
+                mitre_data = mitre_data_by_type[concept_type]
 
                 # For each item in the MITRE list, add an indicator to the indicators list
                 for mitreItem in mitre_data:
@@ -130,7 +174,8 @@ class Client:
                     if 0 < limit <= counter:
                         break
 
-                    mitre_item_json = json.loads(str(mitreItem))
+                    # the indicators are merged into their raw JSON, so the cached item is not modified
+                    mitre_item_json = copy.deepcopy(mitreItem)
                     value = None
 
                     # Try and map a friendly name to the value before the real ID
@@ -227,6 +272,10 @@ class Client:
                                     })
                                     external_refs.add(x)
 
+            # Stop when we have reached the limit defined, before the next collection is retrieved
+            if 0 < limit <= counter:
+                break
+
         # Finally, map all the fields from the indicator
         # rawjson to the fields in the indicator
         for indicator in indicators:
@@ -256,8 +305,8 @@ def test_module(client):
         return_error('Could not connect to server')
 
 
-def fetch_indicators(client):
-    indicators = client.build_iterator()
+def fetch_indicators(client, collections_cache=None):
+    indicators = client.build_iterator(collections_cache=collections_cache)
     return indicators
 
 
@@ -300,6 +349,100 @@ def show_feeds_command(client, args):
     })
 
 
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def build_search_index(client):
+    """
+    Builds the search index of the MITRE indicators: their IDs, and an inverted index from the words of their text
+    fields (names, IDs, descriptions etc.) to their positions in the IDs. The index only narrows the candidates of a
+    search, which are then loaded from the server.
+    """
+    ids = list()
+    tokens: Dict[str, List[int]] = dict()
+    page = 0
+    size = 1000
+    raw_data = demisto.searchIndicators(query=f'type:"{client.indicatorType}"', page=page, size=size)
+    while len(raw_data.get('iocs', [])) > 0:
+        for indicator in raw_data.get('iocs', []):
+            position = len(ids)
+            custom_fields = indicator.get('CustomFields') or {}
+            ids.append(indicator.get('id'))
+            for token in {token for v in custom_fields.values() if isinstance(v, str) for token in tokenize(v)}:
+                tokens.setdefault(token, []).append(position)
+        page += 1
+        raw_data = demisto.searchIndicators(query=f'type:"{client.indicatorType}"', page=page, size=size)
+    return {
+        'created': time.time(),
+        'ids': ids,
+        'tokens': tokens
+    }
+
+
+def get_search_index(client):
+    """
+    Gets the search index from the integration context, and builds it if it was reset by a fetch or is too old
+    """
+    integration_context = demisto.getIntegrationContext() or {}
+    search_index = integration_context.get(SEARCH_INDEX_KEY)
+    if not search_index or 'ids' not in search_index or \
+            time.time() - search_index.get('created', 0) > SEARCH_INDEX_MAX_AGE:
+        search_index = build_search_index(client)
+        integration_context[SEARCH_INDEX_KEY] = search_index
+        demisto.setIntegrationContext(integration_context)
+    return search_index
+
+
+def find_in_search_index(search_index, search):
+    """
+    Finds the candidate indicators of a search, which may have a text field containing the search string.
+    The candidates are found by the words of the search string in the inverted index: the first word may end a
+    token, the middle words are whole tokens, and the last word may start a token (a single word may be anywhere in a
+    token).
+
+    Returns:
+        list. The IDs of the candidates, in the index order, or None if the search string has no words (any indicator
+        is a candidate).
+    """
+    words = tokenize(search)
+    if not words:
+        return None
+    tokens = search_index['tokens']
+    candidates: Set[int] = set()
+    for i, word in enumerate(words):
+        if 0 < i < len(words) - 1:
+            word_candidates = set(tokens.get(word, []))
+        elif i == 0:
+            # may be a suffix (or a part, if it is the only word) of a token
+            word_candidates = {position for token in tokens if word in token for position in tokens[token]}
+        else:
+            # may be a prefix of a token
+            sorted_tokens = search_index.setdefault('sorted_tokens', sorted(tokens))
+            start = bisect.bisect_left(sorted_tokens, word)
+            word_candidates = set()
+            for token in sorted_tokens[start:]:
+                if not token.startswith(word):
+                    break
+                word_candidates.update(tokens[token])
+        candidates = word_candidates if i == 0 else candidates & word_candidates
+        if not candidates:
+            return []
+    return [search_index['ids'][position] for position in sorted(candidates)]
+
+
+def search_candidates(client, candidate_ids):
+    """
+    Yields the current indicators of the candidates of a search, all the MITRE indicators if candidate_ids is None
+    """
+    if candidate_ids is None:
+        yield from IndicatorsSearcher(f'type:"{client.indicatorType}"', page_size=1000)
+        return
+    for ids in batch(candidate_ids, batch_size=SEARCH_CANDIDATES_CHUNK_SIZE):
+        ids_query = ' or '.join(f'id:"{indicator_id}"' for indicator_id in ids)
+        yield from IndicatorsSearcher(f'type:"{client.indicatorType}" and ({ids_query})', page_size=len(ids))
+
+
 def search_command(client, args):
     search = args.get('search')
     demisto_urls = demisto.demistoUrls()
@@ -307,43 +450,27 @@ def search_command(client, args):
     sensitive = True if args.get('casesensitive') == 'True' else False
     return_list_md: List[Dict] = list()
     entries = list()
-    all_indicators = list()
-    page = 0
-    size = 1000
-    raw_data = demisto.searchIndicators(query=f'type:"{client.indicatorType}"', page=page, size=size)
-    while len(raw_data.get('iocs', [])) > 0:
-        all_indicators.extend(raw_data.get('iocs', []))
-        page += 1
-        raw_data = demisto.searchIndicators(query=f'type:"{client.indicatorType}"', page=page, size=size)
+    mitre_names: Set[str] = set()
 
-    for indicator in all_indicators:
+    candidate_ids = find_in_search_index(get_search_index(client), search)
+    if not sensitive:
+        search = search.lower()
+    for indicator in search_candidates(client, candidate_ids):
         custom_fields = indicator.get('CustomFields', {})
+        if custom_fields.get('mitrename') in mitre_names:
+            continue
         for v in custom_fields.values():
-            if type(v) != str:
-                continue
-            if sensitive:
-                if search in v and custom_fields.get('mitrename') not in [x.get('mitrename') for x in return_list_md]:
-                    return_list_md.append({
-                        'mitrename': custom_fields.get('mitrename'),
-                        'Name': f"[{custom_fields.get('mitrename', '')}]({urljoin(indicator_url, indicator.get('id'))})",
-                    })
-                    entries.append({
-                        "id": f"{indicator.get('id')}",
-                        "value": f"{indicator.get('value')}"
-                    })
-                    break
-            else:
-                if search.lower() in v.lower() \
-                        and custom_fields.get('mitrename') not in [x.get('mitrename') for x in return_list_md]:
-                    return_list_md.append({
-                        'mitrename': custom_fields.get('mitrename'),
-                        'Name': f"[{custom_fields.get('mitrename', '')}]({urljoin(indicator_url, indicator.get('id'))})",
-                    })
-                    entries.append({
-                        "id": f"{indicator.get('id')}",
-                        "value": f"{indicator.get('value')}"
-                    })
-                    break
+            if isinstance(v, str) and search in (v if sensitive else v.lower()):
+                mitre_names.add(custom_fields.get('mitrename'))
+                return_list_md.append({
+                    'mitrename': custom_fields.get('mitrename'),
+                    'Name': f"[{custom_fields.get('mitrename', '')}]({urljoin(indicator_url, indicator.get('id'))})",
+                })
+                entries.append({
+                    "id": f"{indicator.get('id')}",
+                    "value": f"{indicator.get('value')}"
+                })
+                break
     return_list_md = sorted(return_list_md, key=lambda name: name['mitrename'])
     return_list_md = [{"Name": x.get('Name')} for x in return_list_md]
 
@@ -418,9 +545,18 @@ def main():
             test_module(client)
 
         elif demisto.command() == 'fetch-indicators':
-            indicators = fetch_indicators(client)
+            # the collections are cached in the last run, which only the fetch loads, unlike the integration context
+            collections_cache = (demisto.getLastRun() or {}).get(COLLECTIONS_CACHE_KEY) or {}
+            last_added = {k: v.get('added') for k, v in collections_cache.items()}
+            indicators = fetch_indicators(client, collections_cache)
             for iter_ in batch(indicators, batch_size=2000):
                 demisto.createIndicators(iter_)
+            if last_added != {k: v.get('added') for k, v in collections_cache.items()}:
+                demisto.setLastRun({COLLECTIONS_CACHE_KEY: collections_cache})
+                # the search index is built again by the next search, with the fetched indicators
+                integration_context = demisto.getIntegrationContext() or {}
+                if integration_context.pop(SEARCH_INDEX_KEY, None):
+                    demisto.setIntegrationContext(integration_context)
 
         else:
             commands[command](client, args)
@@ -0,0 +1,251 @@
+import re
+import pytest
+import demistomock as demisto
+
+INDICATORS = [
+    {'id': '1', 'value': 'T1003', 'score': 0, 'CustomFields': {
+        'mitrename': 'Credential Dumping', 'mitreid': 'attack-pattern--1',
+        'mitredescription': 'Adversaries may attempt to dump credentials to obtain account login information.',
+        'mitrekillchainphases': [{'phase_name': 'credential-access'}]}},
+    {'id': '2', 'value': 'T1110', 'score': 0, 'CustomFields': {
+        'mitrename': 'Brute Force', 'mitreid': 'attack-pattern--2',
+        'mitredescription': 'Adversaries may use brute force techniques to attempt access to accounts.'}},
+    {'id': '3', 'value': 'G0007', 'score': 0, 'CustomFields': {
+        'mitrename': 'APT28', 'mitreid': 'intrusion-set--3',
+        'mitredescription': 'APT28 is a threat group that has been attributed to Russia.'}},
+    {'id': '4', 'value': 'APT28', 'score': 0, 'CustomFields': {
+        'mitrename': 'APT28', 'mitreid': 'intrusion-set--3',
+        'mitredescription': 'APT28 is a threat group that has been attributed to Russia.'}},
+]
+
+
+class MockClient:
+    indicatorType = 'MITRE ATT&CK'
+
+
+def mock_search_indicators(indicators):
+    def search_indicators(query, page, size):
+        # the indicators are found by their type, IDs (id:"1" or id:"2") or value (value:T1003)
+        ids = re.findall(r'id:"(\w+)"', query)
+        value = re.search(r'value:(\S+)', query)
+        found = [indicator for indicator in indicators if (not ids or indicator['id'] in ids)
+                 and (not value or indicator['value'].lower() == value.group(1).lower())]
+        return {'iocs': found if page == 0 else []}
+    return search_indicators
+
+
+@pytest.fixture()
+def search_index(mocker):
+    from FeedMitreAttack import build_search_index
+    mocker.patch.object(demisto, 'searchIndicators', side_effect=mock_search_indicators(INDICATORS))
+    return build_search_index(MockClient())
+
+
+@pytest.mark.parametrize('search, sensitive', [
+    ('credential', False), ('Credential', True), ('credential', True), ('dump cred', False), ('dumping', False),
+    ('ential dum', False), ('brute force tech', False), ('apt', False), ('28 is', False), ('russia.', False),
+    ('attack-pattern--', False), ('not there', False)
+])
+def test_find_in_search_index(search_index, search, sensitive):
+    """
+    Given
+        - A search index of MITRE indicators
+    When
+        - Searching for a substring
+    Then
+        - The candidates found by the index include the indicators with a text field containing the substring
+    """
+    from FeedMitreAttack import find_in_search_index
+    expected = {indicator['id'] for indicator in INDICATORS
+                if any(isinstance(v, str) and (search in v if sensitive else search.lower() in v.lower())
+                       for v in indicator['CustomFields'].values())}
+    candidates = find_in_search_index(search_index, search)
+    assert expected <= set(candidates)
+    assert candidates == sorted(candidates)
+    assert 'customFields' not in str(search_index)
+
+
+def test_find_in_search_index_no_words(search_index):
+    from FeedMitreAttack import find_in_search_index
+    assert find_in_search_index(search_index, '.') is None
+
+
+def test_search_command(mocker):
+    """
+    Given
+        - MITRE indicators, two of them with the same name
+    When
+        - Running the search command twice, and an indicator is modified after the search index is built
+    Then
+        - The search index is built once, the results are deduplicated by name, and the current fields of the
+          indicators are matched
+    """
+    import copy
+    import FeedMitreAttack
+    indicators = copy.deepcopy(INDICATORS)
+    integration_context: dict = {}
+    mocker.patch.object(demisto, 'getIntegrationContext', side_effect=lambda: integration_context)
+    mocker.patch.object(demisto, 'setIntegrationContext', side_effect=integration_context.update)
+    mocker.patch.object(demisto, 'searchIndicators', side_effect=mock_search_indicators(indicators))
+    build_search_index = mocker.spy(FeedMitreAttack, 'build_search_index')
+    mocker.patch.object(demisto, 'demistoUrls', return_value={'server': 'https://server'})
+    return_outputs = mocker.patch.object(FeedMitreAttack, 'return_outputs')
+
+    FeedMitreAttack.search_command(MockClient(), {'search': 'russia'})
+    indicators[1]['CustomFields']['mitredescription'] = 'Adversaries may guess passwords.'
+    indicators[1]['CustomFields']['mitrename'] = 'Password Guessing'
+    FeedMitreAttack.search_command(MockClient(), {'search': 'adversaries'})
+    FeedMitreAttack.search_command(MockClient(), {'search': 'brute force'})
+
+    assert build_search_index.call_count == 1
+    assert return_outputs.call_args_list[0][0][1]['indicators(val.id && val.id == obj.id)'] == [
+        {'id': '3', 'value': 'G0007'}]
+    assert [x['Name'] for x in return_outputs.call_args_list[1][0][2]] == [
+        '[Credential Dumping](https://server/#/indicator/1)', '[Password Guessing](https://server/#/indicator/2)']
+    assert return_outputs.call_args_list[2][0][2] == []
+
+
+def test_reputation_command(mocker):
+    """
+    Given
+        - MITRE indicators
+    When
+        - Running the reputation command
+    Then
+        - The indicator is searched by its value on the server
+    """
+    import FeedMitreAttack
+    search = mocker.patch.object(demisto, 'searchIndicators', side_effect=mock_search_indicators(INDICATORS))
+    mocker.patch.object(demisto, 'demistoUrls', return_value={'server': 'https://server'})
+    return_outputs = mocker.patch.object(FeedMitreAttack, 'return_outputs')
+
+    FeedMitreAttack.reputation_command(MockClient(), {'indicator': 't1110'})
+
+    assert search.call_args[1]['query'] == 'type:"MITRE ATT&CK" value:t1110'
+    assert return_outputs.call_count == 1
+    assert return_outputs.call_args[0][1]['MITRE.ATT&CK(val.value && val.value = obj.value)']['indicatorid'] == '2'
+
+
+class MockCollection:
+    def __init__(self, collection_id, objects):
+        self.id = collection_id
+        self.objects = objects
+        self.requests: list = []
+
+    def added_after(self, added_after):
+        return [x for x in self.objects if not added_after or x['date_added'] > added_after]
+
+    def get_manifest(self, type, added_after=None):
+        self.requests.append(('manifest', added_after))
+        return {'objects': [{'id': x['id'], 'date_added': x['date_added']} for x in self.added_after(added_after)]}
+
+    def get_objects(self, type, added_after=None):
+        self.requests.append(('objects', added_after))
+        return {'objects': [{k: v for k, v in x.items() if k != 'date_added'} for x in self.added_after(added_after)
+                            if x['type'] in type]}
+
+
+def mitre_object(object_type, object_id, external_id, date_added):
+    return {'type': object_type, 'id': f'{object_type}--{object_id}', 'name': external_id, 'date_added': date_added,
+            'external_references': [{'source_name': 'mitre-attack', 'external_id': external_id}]}
+
+
+@pytest.fixture()
+def collections_client():
+    from FeedMitreAttack import Client
+    client = Client('https://cti-taxii.mitre.org', {}, False, False, 'None')
+    client.collections = [
+        MockCollection('enterprise', [
+            mitre_object('tool', 1, 'S0002', '2020-01-01T00:00:00.000Z'),
+            mitre_object('relationship', 2, 'R0001', '2020-01-01T00:00:00.000Z'),
+            mitre_object('attack-pattern', 3, 'T1003', '2020-01-02T00:00:00.000Z'),
+        ]),
+        MockCollection('mobile', [
+            mitre_object('attack-pattern', 4, 'T1404', '2020-01-01T00:00:00.000Z'),
+        ]),
+    ]
+    return client
+
+
+def test_build_iterator(collections_client):
+    """
+    Given
+        - Collections with objects of MITRE concepts and other objects
+    When
+        - Building the indicators
+    Then
+        - Each collection is requested once, and the indicators are created in the order of the concepts
+    """
+    indicators = collections_client.build_iterator()
+
+    assert [x['value'] for x in indicators] == ['T1003', 'S0002', 'T1404']
+    assert all(x.requests == [('objects', None)] for x in collections_client.collections)
+
+    assert [x['value'] for x in collections_client.build_iterator(limit=1)] == ['T1003']
+    assert collections_client.collections[1].requests == [('objects', None)]
+
+
+def test_build_iterator_cached(collections_client):
+    """
+    Given
+        - A collections cache filled by a previous fetch
+    When
+        - Building the indicators again, after an object was added to one of the collections
+    Then
+        - The unchanged collection is not requested, only the added objects are requested from the changed one,
+          and the indicators are the same as without a cache
+    """
+    collections_cache: dict = {}
+    collections_client.build_iterator(collections_cache=collections_cache)
+    assert collections_cache['enterprise']['added'] == '2020-01-02T00:00:00.000Z'
+
+    enterprise, mobile = collections_client.collections
+    updated = mitre_object('tool', 1, 'S0002', '2020-01-03T00:00:00.000Z')
+    updated['name'] = 'updated'
+    enterprise.objects.append(updated)
+    for collection in collections_client.collections:
+        collection.requests = []
+    indicators = collections_client.build_iterator(collections_cache=collections_cache)
+
+    assert enterprise.requests == [('manifest', '2020-01-02T00:00:00.000Z'), ('objects', '2020-01-02T00:00:00.000Z')]
+    assert mobile.requests == [('manifest', '2020-01-01T00:00:00.000Z')]
+    assert [(x['value'], x['fields']['mitrename']) for x in indicators] == [
+        ('T1003', 'T1003'), ('S0002', 'updated'), ('T1404', 'T1404')]
+    assert [x['id'] for x in collections_cache['enterprise']['objects']] == [
+        'tool--1', 'attack-pattern--3']
+    assert collections_cache['enterprise']['added'] == '2020-01-03T00:00:00.000Z'
+
+
+def test_fetch_indicators_cache(mocker, collections_client):
+    """
+    Given
+        - An integration context with a search index
+    When
+        - Fetching indicators twice, the collections did not change between the fetches
+    Then
+        - The collections are cached in the last run and not in the integration context, and the search index is
+          reset only by the first fetch
+    """
+    import FeedMitreAttack
+    last_run: dict = {}
+    integration_context = {FeedMitreAttack.SEARCH_INDEX_KEY: {'created': 0}}
+    mocker.patch.object(demisto, 'command', return_value='fetch-indicators')
+    mocker.patch.object(demisto, 'params', return_value={})
+    mocker.patch.object(FeedMitreAttack, 'handle_proxy', return_value={})
+    mocker.patch.object(FeedMitreAttack.Client, 'initialise',
+                        lambda self: setattr(self, 'collections', collections_client.collections))
+    mocker.patch.object(demisto, 'getLastRun', side_effect=lambda: last_run)
+    mocker.patch.object(demisto, 'setLastRun', side_effect=last_run.update)
+    mocker.patch.object(demisto, 'getIntegrationContext', side_effect=lambda: integration_context)
+    set_integration_context = mocker.patch.object(demisto, 'setIntegrationContext')
+    create_indicators = mocker.patch.object(demisto, 'createIndicators')
+
+    FeedMitreAttack.main()
+    assert set(last_run[FeedMitreAttack.COLLECTIONS_CACHE_KEY]) == {'enterprise', 'mobile'}
+    assert set_integration_context.call_args[0][0] == {}
+
+    integration_context[FeedMitreAttack.SEARCH_INDEX_KEY] = {'created': 0}
+    FeedMitreAttack.main()
+    assert set_integration_context.call_count == 1
+    assert [[x['value'] for x in call[0][0]] for call in create_indicators.call_args_list] == [
+        ['T1003', 'S0002', 'T1404']] * 2
@@ -1,5 +1,5 @@
 import tempfile
-from typing import Dict
+from typing import Dict, Optional
 
 import demistomock as demisto
 from CommonServerPython import *
@@ -8,6 +8,8 @@ from CommonServerUserPython import *
 ''' IMPORTS '''
 import urllib3
 import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import cabby
 import requests
@@ -28,6 +30,10 @@ urllib3.disable_warnings()
 
 EPOCH = datetime.utcfromtimestamp(0).replace(tzinfo=pytz.UTC)
 INTEGRATION_NAME = 'TAXII1'
+XSI_TYPE = '{http://www.w3.org/2001/XMLSchema-instance}type'
+POLL_WINDOW_SIZE = timedelta(days=10)
+# the indicators of a window polled ahead are spooled in memory up to this size (in bytes), and then to disk
+POLL_WINDOW_SPOOL_SIZE = 1024 * 1024
 
 
 class AddressObject(object):
@@ -38,10 +44,10 @@ class AddressObject(object):
 
     @staticmethod
     def decode(props, **kwargs):
-        indicator = props.find('Address_Value')
-        if indicator is None:
+        indicator = props.find('.//{*}Address_Value')
+        if indicator is None or indicator.text is None:
             return []
-        indicator = indicator.string.encode('ascii', 'replace').decode()
+        indicator = indicator.text.encode('ascii', 'replace').decode()
 
         acategory = props.get('category', None)
         if acategory is None:
@@ -86,12 +92,12 @@ class DomainNameObject(object):
         if dtype != 'FQDN':
             return []
 
-        domain = props.find('Value')
-        if domain is None:
+        domain = props.find('.//{*}Value')
+        if domain is None or domain.text is None:
             return []
 
         return [{
-            'indicator': domain.string.encode('ascii', 'replace').decode(),
+            'indicator': domain.text.encode('ascii', 'replace').decode(),
             'type': 'Domain'
         }]
 
@@ -106,17 +112,17 @@ class FileObject(object):
     def _decode_basic_props(props):
         result = {}
 
-        name = next((c for c in props if c.name == 'File_Name'), None)
+        name = props.find('{*}File_Name')
         if name is not None:
-            result['stix_file_name'] = name.text
+            result['stix_file_name'] = get_element_text(name)
 
-        size = next((c for c in props if c.name == 'File_Size'), None)
+        size = props.find('{*}File_Size')
         if size is not None:
-            result['stix_file_size'] = size.text
+            result['stix_file_size'] = get_element_text(size)
 
-        format = next((c for c in props if c.name == 'File_Format'), None)
+        format = props.find('{*}File_Format')
         if format is not None:
-            result['stix_file_format'] = format.text
+            result['stix_file_format'] = get_element_text(format)
 
         return result
 
@@ -126,19 +132,19 @@ class FileObject(object):
 
         bprops = FileObject._decode_basic_props(props)
 
-        hashes = props.find_all('Hash')
+        hashes = props.iterfind('.//{*}Hash')
         for h in hashes:
-            htype = h.find('Type')
-            if htype is None:
+            htype = h.find('.//{*}Type')
+            if htype is None or htype.text is None:
                 continue
-            htype = htype.string.lower()
+            htype = htype.text.lower()
             if htype not in ['md5', 'sha1', 'sha256', 'ssdeep']:
                 continue
 
-            value = h.find('Simple_Hash_Value')
-            if value is None:
+            value = h.find('.//{*}Simple_Hash_Value')
+            if value is None or value.text is None:
                 continue
-            value = value.string.lower()
+            value = value.text.lower()
 
             result.append({
                 'indicator': value,
@@ -174,12 +180,12 @@ class URIObject(object):
         else:
             return []
 
-        url = props.find('Value')
-        if url is None:
+        url = props.find('.//{*}Value')
+        if url is None or url.text is None:
             return []
 
         return [{
-            'indicator': url.string.encode('utf8', 'replace').decode(),
+            'indicator': url.text.encode('utf8', 'replace').decode(),
             'type': type_
         }]
 
@@ -256,7 +262,8 @@ class HTTPSessionObject(object):
 
 class StixDecode(object):
     """
-    Decode STIX strings formatted as xml, and extract indicators from them
+    Decode STIX packages formatted as xml (strings, or lxml elements of a parsed document), and extract indicators
+    from them
     """
     DECODERS = {
         'DomainNameObjectType': DomainNameObject.decode,
@@ -271,7 +278,7 @@ class StixDecode(object):
 
     @staticmethod
     def object_extract_properties(props, kwargs):
-        type_ = props.get('xsi:type').rsplit(':')[-1]
+        type_ = (props.get(XSI_TYPE) or '').rsplit(':')[-1]
 
         if type_ not in StixDecode.DECODERS:
             LOG('Unhandled cybox Object type: {!r} - {!r}'.format(type_, props))
@@ -301,29 +308,30 @@ class StixDecode(object):
     def decode(content, **kwargs):
         result = []
 
-        package = BeautifulSoup(content, 'xml')
+        if isinstance(content, string_types):
+            package = etree.fromstring(content.encode('utf-8'), parser=etree.XMLParser(recover=True, huge_tree=True))
+        else:
+            package = content
 
-        if package.contents[0].name != 'STIX_Package':
+        if package is None or get_local_name(package) != 'STIX_Package':
             return None, []
 
-        package = package.contents[0]
-
         timestamp = package.get('timestamp', None)
         if timestamp is not None:
             timestamp = StixDecode._parse_stix_timestamp(timestamp)
 
         pprops = package_extract_properties(package)
 
-        observables = package.find_all('Observable')
+        observables = package.iterfind('.//{*}Observable')
         for o in observables:
             gprops = observable_extract_properties(o)
 
-            obj = next((ob for ob in o if ob.name == 'Object'), None)
+            obj = o.find('{*}Object')
             if obj is None:
                 continue
 
             # main properties
-            properties = next((c for c in obj if c.name == 'Properties'), None)
+            properties = obj.find('{*}Properties')
             if properties is not None:
                 for r in StixDecode.object_extract_properties(properties, kwargs):
                     r.update(gprops)
@@ -332,13 +340,10 @@ class StixDecode(object):
                     result.append(r)
 
             # then related objects
-            related = next((c for c in obj if c.name == 'Related_Objects'), None)
+            related = obj.find('{*}Related_Objects')
             if related is not None:
-                for robj in related:
-                    if robj.name != 'Related_Object':
-                        continue
-
-                    properties = next((c for c in robj if c.name == 'Properties'), None)
+                for robj in related.iterfind('{*}Related_Object'):
+                    properties = robj.find('{*}Properties')
                     if properties is None:
                         continue
 
@@ -468,14 +473,29 @@ class Taxii11(object):
             return None
 
 
+class PollWindow(object):
+    """
+    A time window of the collection polled by the incremental poll, with the last timestamps found in it
+    """
+
+    def __init__(self, begin, end):
+        self.begin = begin
+        self.end = end
+        self.last_stix_package_ts = None
+        self.last_taxii_content_ts = None
+        self.spool: Optional[tempfile.SpooledTemporaryFile] = None
+
+
 class TAXIIClient(object):
     def __init__(self, insecure: bool = True, polling_timeout: int = 20, initial_interval: str = '1 day',
                  discovery_service: str = '', poll_service: str = None, collection: str = None,
-                 credentials: dict = None, cert_text: str = None, key_text: str = None, **kwargs):
+                 credentials: dict = None, cert_text: str = None, key_text: str = None, polling_workers: int = 4,
+                 **kwargs):
         """
         TAXII Client
         :param insecure: Set to true to ignore https certificate
         :param polling_timeout: Time before send request timeout
+        :param polling_workers: The number of time windows to poll concurrently
         :param initial_interval: Interval between each read from TAXII server
         :param discovery_service: TAXII server discovery service
         :param poll_service: TAXII poll service
@@ -497,6 +517,10 @@ class TAXIIClient(object):
             self.polling_timeout = int(self.polling_timeout)
         except (ValueError, TypeError):
             raise TypeError('Please provide a valid integer for "Polling Timeout"')
+        try:
+            self.polling_workers = max(int(polling_workers), 1)
+        except (ValueError, TypeError):
+            raise TypeError('Please provide a valid integer for "Polling Workers"')
         self.initial_interval = initial_interval
         self.initial_interval = interval_in_sec(self.initial_interval)
         if self.initial_interval is None:
@@ -716,7 +740,13 @@ class TAXIIClient(object):
 
         return poll_service
 
-    def _poll_collection(self, poll_service, begin, end):
+    def _poll_collection(self, poll_service, begin, end, window=None):
+        """
+        Polls the collection for the content blocks in the time range, and yields their indicators.
+        The last timestamps of the content are kept in the window (the client by default).
+        """
+        if window is None:
+            window = self
         req = Taxii11.poll_request(
             collection_name=self.collection,
             exclusive_begin_timestamp=begin,
@@ -767,23 +797,26 @@ class TAXIIClient(object):
                                 if len(c) == 0:
                                     continue
 
-                                content = etree.tostring(c[0], encoding='unicode')
-                                timestamp, indicators = StixDecode.decode(content)
+                                # the package is decoded in place, without serializing and parsing it again
+                                timestamp, indicators = StixDecode.decode(c[0])
 
                                 for indicator in indicators:
                                     yield indicator
                                 if timestamp:
-                                    if self.last_stix_package_ts is None or timestamp > self.last_stix_package_ts:
-                                        self.last_stix_package_ts = timestamp
+                                    if window.last_stix_package_ts is None or timestamp > window.last_stix_package_ts:
+                                        window.last_stix_package_ts = timestamp
 
                             elif c.tag.endswith('Timestamp_Label'):
                                 timestamp = Taxii11.parse_timestamp_label(c.text)
 
                                 if timestamp:
-                                    if self.last_taxii_content_ts is None or timestamp > self.last_taxii_content_ts:
-                                        self.last_taxii_content_ts = timestamp
+                                    if window.last_taxii_content_ts is None or timestamp > window.last_taxii_content_ts:
+                                        window.last_taxii_content_ts = timestamp
 
                         element.clear()
+                        # the decoded blocks are removed from the tree, so a large response is not kept in memory
+                        while element.getprevious() is not None:
+                            del element.getparent()[0]
 
             finally:
                 result.close()
@@ -806,30 +839,90 @@ class TAXIIClient(object):
                 stream=True
             )
 
+    def _poll_window(self, poll_service, window, stopped):
+        """
+        Polls a time window into its spool of indicators (one JSON per line), reading the poll response fully without
+        waiting for the windows before it to be consumed, so its connection is never left idle.
+        The poll stops if the incremental poll is stopped.
+        """
+        spool = tempfile.SpooledTemporaryFile(max_size=POLL_WINDOW_SPOOL_SIZE, mode='w+')
+        try:
+            for indicator in self._poll_collection(
+                poll_service=poll_service,
+                begin=window.begin,
+                end=window.end,
+                window=window
+            ):
+                if stopped.is_set():
+                    spool.close()
+                    return
+                spool.write(json.dumps(indicator) + '\n')
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        window.spool = spool
+
     def _incremental_poll_collection(self, poll_service, begin, end):
-        """Polls collection in increments of 10 days"""
+        """
+        Polls collection in increments of 10 days, up to polling_workers windows concurrently.
+        The indicators are yielded in the order of the windows, and last_taxii_run is advanced only by windows which
+        all the windows before them were polled, so a failed window is polled again by the next fetch.
+        The windows polled ahead are spooled (to disk past POLL_WINDOW_SPOOL_SIZE) until the windows before them are
+        consumed.
+        """
+        windows = []
         cbegin = begin
-        dt = timedelta(days=10)
+        while cbegin < end:
+            cend = min(end, cbegin + POLL_WINDOW_SIZE)
+            windows.append(PollWindow(cbegin, cend))
+            cbegin = cend
 
         self.last_stix_package_ts = None
         self.last_taxii_content_ts = None
 
-        while cbegin < end:
-            cend = min(end, cbegin + dt)
-
-            result = self._poll_collection(
-                poll_service=poll_service,
-                begin=cbegin,
-                end=cend
-            )
-
-            for i in result:
-                yield i
-
-            if self.last_taxii_content_ts is not None:
-                self.last_taxii_run = self.last_taxii_content_ts
-
-            cbegin = cend
+        windows_iter = iter(windows)
+        pending = collections.deque()  # type: ignore
+        stopped = threading.Event()
+        try:
+            with ThreadPoolExecutor(max_workers=self.polling_workers) as executor:
+                try:
+                    # windows are submitted as earlier ones complete, so a failure does not leave later windows to poll
+                    for window in windows_iter:
+                        pending.append((window, executor.submit(self._poll_window, poll_service, window, stopped)))
+                        if len(pending) == self.polling_workers:
+                            break
+
+                    while pending:
+                        window, future = pending.popleft()
+                        future.result()
+
+                        next_window = next(windows_iter, None)
+                        if next_window is not None:
+                            pending.append((next_window, executor.submit(self._poll_window, poll_service, next_window,
+                                                                         stopped)))
+
+                        with window.spool:
+                            for line in window.spool:
+                                yield json.loads(line)
+
+                        if window.last_stix_package_ts is not None and (
+                                self.last_stix_package_ts is None or window.last_stix_package_ts > self.last_stix_package_ts):
+                            self.last_stix_package_ts = window.last_stix_package_ts
+                        if window.last_taxii_content_ts is not None and (
+                                self.last_taxii_content_ts is None or window.last_taxii_content_ts > self.last_taxii_content_ts):
+                            self.last_taxii_content_ts = window.last_taxii_content_ts
+
+                        if self.last_taxii_content_ts is not None:
+                            self.last_taxii_run = self.last_taxii_content_ts
+                finally:
+                    # the windows still polling stop
+                    stopped.set()
+        finally:
+            # the spools of the windows polled ahead and not consumed are removed
+            for window in windows:
+                if window.spool is not None:
+                    window.spool.close()
 
     def build_iterator(self, now):
         """Creates an indicator iterator from the TAXII feed"""
@@ -867,14 +960,14 @@ def package_extract_properties(package):
     """Extracts properties from the STIX package"""
     result: Dict[str, str] = {}
 
-    header = package.find_all('STIX_Header')
+    header = package.findall('.//{*}STIX_Header')
     if len(header) == 0:
         return result
 
     # share level
-    mstructures = header[0].find_all('Marking_Structure')
+    mstructures = header[0].iterfind('.//{*}Marking_Structure')
     for ms in mstructures:
-        type_ = ms.get('xsi:type')
+        type_ = ms.get(XSI_TYPE)
         if type_ is result:
             continue
 
@@ -890,28 +983,28 @@ def package_extract_properties(package):
         break
 
     # decode title
-    title = next((c for c in header[0] if c.name == 'Title'), None)
+    title = header[0].find('{*}Title')
     if title is not None:
-        result['stix_package_title'] = title.text
+        result['stix_package_title'] = get_element_text(title)
 
     # decode description
-    description = next((c for c in header[0] if c.name == 'Description'), None)
+    description = header[0].find('{*}Description')
     if description is not None:
-        result['stix_package_description'] = description.text
+        result['stix_package_description'] = get_element_text(description)
 
     # decode description
-    sdescription = next((c for c in header[0] if c.name == 'Short_Description'), None)
+    sdescription = header[0].find('{*}Short_Description')
     if sdescription is not None:
-        result['stix_package_short_description'] = sdescription.text
+        result['stix_package_short_description'] = get_element_text(sdescription)
 
     # decode identity name from information_source
-    information_source = next((c for c in header[0] if c.name == 'Information_Source'), None)
+    information_source = header[0].find('{*}Information_Source')
     if information_source is not None:
-        identity = next((c for c in information_source if c.name == 'Identity'), None)
+        identity = information_source.find('{*}Identity')
         if identity is not None:
-            name = next((c for c in identity if c.name == 'Name'))
+            name = identity.find('{*}Name')
             if name is not None:
-                result['stix_package_information_source'] = name.text
+                result['stix_package_information_source'] = get_element_text(name)
 
     return result
 
@@ -920,19 +1013,33 @@ def observable_extract_properties(observable):
     """Extracts properties from observable"""
     result = {}
 
-    title = next((c for c in observable if c.name == 'Title'), None)
+    title = observable.find('{*}Title')
     if title is not None:
-        title = title.text
+        title = get_element_text(title)
         result['stix_title'] = title
 
-    description = next((c for c in observable if c.name == 'Description'), None)
+    description = observable.find('{*}Description')
     if description is not None:
-        description = description.text
+        description = get_element_text(description)
         result['stix_description'] = description
 
     return result
 
 
+def get_local_name(element):
+    """Gets the tag name of an lxml element without its namespace"""
+    tag = element.tag
+    if not isinstance(tag, string_types):
+        # comments and processing instructions
+        return None
+    return tag.rsplit('}', 1)[-1]
+
+
+def get_element_text(element):
+    """Gets the text of an lxml element and its descendants"""
+    return ''.join(element.itertext())
+
+
 def interval_in_sec(val):
     """Translates interval string to seconds int"""
     if val is None:
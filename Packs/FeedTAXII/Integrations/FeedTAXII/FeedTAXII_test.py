@@ -1,5 +1,6 @@
 import json
 import pytest
+from datetime import datetime, timedelta, timezone
 
 """ helper functions """
 
@@ -95,3 +96,143 @@ class TestCommands:
             with open('FeedTAXII_test/TestCommands/indicators_results.json', 'r') as exp_f:
                 expected = json.load(exp_f)
                 assert res == expected
+
+
+class MockPollResponse:
+    def __init__(self, path):
+        self.raw = open(path, 'rb')
+
+    def close(self):
+        self.raw.close()
+
+
+class TestPollCollection:
+    FILE_PATH = 'FeedTAXII_test/TestPollCollection'
+
+    def test_poll_collection(self, mocker):
+        """
+        Given
+            - A poll response with content blocks of STIX packages
+        When
+            - Polling the collection
+        Then
+            - The indicators of all the packages are decoded from the streamed response
+        """
+        from FeedTAXII import TAXIIClient, Taxii11
+        client = TAXIIClient(collection='a collection')
+        mocker.patch.object(client, '_send_request',
+                            return_value=MockPollResponse(f'{self.FILE_PATH}/poll_response.xml'))
+        begin = datetime(2020, 5, 1, tzinfo=timezone.utc)
+        end = datetime(2020, 5, 4, tzinfo=timezone.utc)
+
+        indicators = list(client._poll_collection('https://taxii', begin, end))
+
+        expected = []
+        for file_name in ['domain', 'file', 'ip']:
+            with open(f'FeedTAXII_test/StixDecodeTest/{file_name}-stix-ioc-result.json', 'r') as res_f:
+                expected.extend(json.load(res_f))
+        assert indicators == expected
+        assert client.last_taxii_content_ts == Taxii11.parse_timestamp_label('2020-05-03T10:00:00.000000+00:00')
+
+
+class TestIncrementalPollCollection:
+    BEGIN = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    END = datetime(2020, 2, 10, tzinfo=timezone.utc)
+
+    def poll_collection(self, failed_window_begin=None):
+        import time
+
+        def poll(poll_service, begin, end, window):
+            # the later windows complete first
+            time.sleep((self.END - end).days / 500)
+            if begin == failed_window_begin:
+                raise RuntimeError('poll failed')
+            window.last_taxii_content_ts = int(end.timestamp() * 1000)
+            yield {'indicator': begin.isoformat(), 'type': 'Domain'}
+        return poll
+
+    def test_windows_merged_in_order(self, mocker):
+        """
+        Given
+            - A fetch of 40 days, polled in 4 windows by 3 workers
+        When
+            - Later windows complete before earlier windows
+        Then
+            - The indicators are yielded in the order of the windows, and last_taxii_run is the end of the last window
+        """
+        from FeedTAXII import TAXIIClient
+        client = TAXIIClient(collection='a collection', polling_workers=3)
+        mocker.patch.object(client, '_poll_collection', side_effect=self.poll_collection())
+
+        indicators = list(client._incremental_poll_collection('https://taxii', self.BEGIN, self.END))
+
+        assert [indicator['indicator'] for indicator in indicators] == [
+            '2020-01-01T00:00:00+00:00', '2020-01-11T00:00:00+00:00', '2020-01-21T00:00:00+00:00',
+            '2020-01-31T00:00:00+00:00']
+        assert client.last_taxii_run == int(self.END.timestamp() * 1000)
+
+    def test_failed_window(self, mocker):
+        """
+        Given
+            - A fetch of 40 days, polled in 4 windows by 3 workers
+        When
+            - The poll of the second window fails, after the third window completed
+        Then
+            - last_taxii_run is advanced only to the first window
+        """
+        from FeedTAXII import TAXIIClient
+        client = TAXIIClient(collection='a collection', polling_workers=3)
+        mocker.patch.object(client, '_poll_collection',
+                            side_effect=self.poll_collection(datetime(2020, 1, 11, tzinfo=timezone.utc)))
+
+        with pytest.raises(RuntimeError):
+            list(client._incremental_poll_collection('https://taxii', self.BEGIN, self.END))
+        assert client.last_taxii_run == int(datetime(2020, 1, 11, tzinfo=timezone.utc).timestamp() * 1000)
+
+    def test_windows_spooled(self, mocker):
+        """
+        Given
+            - A fetch of 40 days, polled in 4 windows of 5 indicators by 3 workers, which spool to disk past 10 bytes
+        When
+            - Consuming the first indicator, and then stopping in the middle of the second window
+        Then
+            - The windows polled ahead read all their indicators without waiting for the consumer, the indicators are
+              yielded in order, and the spools of the windows which were not consumed are removed
+        """
+        import tempfile
+        import time
+        import FeedTAXII
+        mocker.patch.object(FeedTAXII, 'POLL_WINDOW_SPOOL_SIZE', 10)
+        spooled_temporary_file = tempfile.SpooledTemporaryFile
+        spools: list = []
+
+        def create_spool(*args, **kwargs):
+            spools.append(spooled_temporary_file(*args, **kwargs))
+            return spools[-1]
+        mocker.patch.object(tempfile, 'SpooledTemporaryFile', side_effect=create_spool)
+        client = FeedTAXII.TAXIIClient(collection='a collection', polling_workers=3)
+        polled: list = []
+
+        def poll(poll_service, begin, end, window):
+            for i in range(5):
+                polled.append((begin.isoformat(), i))
+                yield {'indicator': [begin.isoformat(), i]}
+        mocker.patch.object(client, '_poll_collection', side_effect=poll)
+
+        indicators = client._incremental_poll_collection('https://taxii', self.BEGIN, self.END)
+        consumed = [next(indicators)['indicator']]
+        for _ in range(50):
+            if len(polled) == 20:
+                break
+            time.sleep(0.1)
+        assert len(polled) == 20
+        for indicator in indicators:
+            consumed.append(indicator['indicator'])
+            if len(consumed) == 7:
+                break
+        indicators.close()
+
+        assert consumed == [[(self.BEGIN + timedelta(days=10 * (i // 5))).isoformat(), i % 5] for i in range(7)]
+        assert len(spools) == 4
+        assert all(spool.closed for spool in spools)
+        assert client.last_taxii_run is None
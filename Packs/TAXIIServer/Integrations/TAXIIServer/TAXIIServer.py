@@ -5,9 +5,10 @@ from gevent.pywsgi import WSGIServer
 from urllib.parse import urlparse, ParseResult
 from tempfile import NamedTemporaryFile
 from base64 import b64decode
-from typing import Callable, List, Generator
+from typing import Callable, List, Generator, Optional
 from ssl import SSLContext, SSLError, PROTOCOL_TLSv1_2
 from multiprocessing import Process
+from collections import OrderedDict
 
 from libtaxii.messages_11 import (
     TAXIIMessage,
@@ -55,6 +56,8 @@ import pytz
 ''' GLOBAL VARIABLES '''
 INTEGRATION_NAME: str = 'TAXII Server'
 PAGE_SIZE = 200
+# the maximal number of indicators to keep the STIX XML of
+STIX_FRAGMENTS_CACHE_SIZE = 10000
 APP: Flask = Flask('demisto-taxii')
 NAMESPACE_URI = 'https://www.paloaltonetworks.com/cortex'
 NAMESPACE = 'cortex'
@@ -93,6 +96,7 @@ class TAXIIServer:
             credentials: The user credentials.
         """
         self.host = host
+        self.stix_fragments_cache = STIXFragmentsCache()
         self.port = port
         self.collections = collections
         self.certificate = certificate
@@ -252,18 +256,13 @@ class TAXIIServer:
             yield response
 
             # yield the content blocks
-            indicator_query = self.collections[str(collection_name)]
+            indicator_query = get_time_frame_indicator_query(self.collections[str(collection_name)],
+                                                             exclusive_begin_time, inclusive_end_time)
 
-            for indicator in find_indicators_by_time_frame(indicator_query, exclusive_begin_time, inclusive_end_time):
+            # the indicators are searched page by page while the response is streamed
+            for indicator in IndicatorsSearcher(indicator_query, page_size=PAGE_SIZE):
                 try:
-                    stix_xml_indicator = get_stix_indicator(indicator).to_xml(ns_dict={NAMESPACE_URI: NAMESPACE})
-                    content_block = ContentBlock(
-                        content_binding=CB_STIX_XML_11,
-                        content=stix_xml_indicator
-                    )
-
-                    content_xml = content_block.to_xml().decode('utf-8')
-                    yield f'{content_xml}\n'
+                    yield self.stix_fragments_cache.get_content_block(indicator)
                 except Exception as e:
                     handle_long_running_error(f'Failed parsing indicator to STIX: {e}')
 
@@ -292,6 +291,59 @@ class TAXIIServer:
             return self.host
 
 
+class STIXFragmentsCache:
+    def __init__(self, max_size: int = STIX_FRAGMENTS_CACHE_SIZE):
+        """
+        LRU cache of the STIX content blocks of indicators, keyed by the indicator value, type and modified time,
+        so indicators which did not change since they were last polled are not converted to STIX again.
+        Args:
+            max_size: The maximal number of indicators to keep the content block of.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._content_blocks: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def get_key(indicator: dict) -> Optional[tuple]:
+        """
+        Args:
+            indicator: The Demisto indicator.
+
+        Returns:
+            The cache key of the indicator, None if the indicator has no modified time.
+        """
+        modified = indicator.get('modified')
+        if not modified:
+            return None
+        return indicator.get('value', ''), indicator.get('indicator_type', ''), modified
+
+    def get_content_block(self, indicator: dict) -> str:
+        """
+        Get the STIX content block of an indicator, from the cache if the indicator did not change.
+        Args:
+            indicator: The Demisto indicator.
+
+        Returns:
+            The content block XML string.
+        """
+        key = self.get_key(indicator)
+        if key is not None:
+            content_block = self._content_blocks.get(key)
+            if content_block is not None:
+                self._content_blocks.move_to_end(key)
+                self.hits += 1
+                return content_block
+
+        self.misses += 1
+        content_block = create_stix_content_block(indicator)
+        if key is not None:
+            self._content_blocks[key] = content_block
+            if len(self._content_blocks) > self.max_size:
+                self._content_blocks.popitem(last=False)
+        return content_block
+
+
 SERVER: TAXIIServer
 DEMISTO_LOGGER: Handler = Handler()
 
@@ -592,6 +644,24 @@ def get_stix_indicator(indicator: dict) -> stix.core.STIXPackage:
     return stix_package
 
 
+def create_stix_content_block(indicator: dict) -> str:
+    """
+    Convert a Demisto indicator to a TAXII content block of its STIX XML.
+    Args:
+        indicator: The Demisto indicator.
+
+    Returns:
+        The content block XML string.
+    """
+    stix_xml_indicator = get_stix_indicator(indicator).to_xml(ns_dict={NAMESPACE_URI: NAMESPACE})
+    content_block = ContentBlock(
+        content_binding=CB_STIX_XML_11,
+        content=stix_xml_indicator
+    )
+    content_xml = content_block.to_xml().decode('utf-8')
+    return f'{content_xml}\n'
+
+
 ''' HELPER FUNCTIONS '''
 
 
@@ -730,7 +800,20 @@ def find_indicators_by_time_frame(indicator_query: str, begin_time: datetime, en
     Returns:
         Indicator query results from Demisto.
     """
+    return find_indicators_loop(get_time_frame_indicator_query(indicator_query, begin_time, end_time))
 
+
+def get_time_frame_indicator_query(indicator_query: str, begin_time: datetime, end_time: datetime) -> str:
+    """
+    Add a time frame to an indicator query.
+    Args:
+        indicator_query: The indicator query.
+        begin_time: The exclusive begin time.
+        end_time: The inclusive end time.
+
+    Returns:
+        The indicator query of the time frame.
+    """
     if indicator_query:
         indicator_query += ' and '
     else:
@@ -746,7 +829,7 @@ def find_indicators_by_time_frame(indicator_query: str, begin_time: datetime, en
         indicator_query += f'sourcetimestamp:<="{tz_end_time}"'
     demisto.info(f'Querying indicators by: {indicator_query}')
 
-    return find_indicators_loop(indicator_query)
+    return indicator_query
 
 
 def find_indicators_loop(indicator_query: str):
@@ -758,17 +841,7 @@ def find_indicators_loop(indicator_query: str):
     Returns:
         Indicator query results from Demisto.
     """
-    iocs: List[dict] = []
-    total_fetched = 0
-    next_page = 0
-    last_found_len = PAGE_SIZE
-    while last_found_len == PAGE_SIZE:
-        fetched_iocs = demisto.searchIndicators(query=indicator_query, page=next_page, size=PAGE_SIZE).get('iocs')
-        iocs.extend(fetched_iocs)
-        last_found_len = len(fetched_iocs)
-        total_fetched += last_found_len
-        next_page += 1
-    return iocs
+    return list(IndicatorsSearcher(indicator_query, page_size=PAGE_SIZE))
 
 
 def taxii_make_response(taxii_message: TAXIIMessage):
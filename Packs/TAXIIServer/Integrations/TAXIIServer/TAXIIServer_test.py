@@ -435,3 +435,45 @@ def test_validate_indicators(indicator):
 
     # Assert
     assert sdv.validate_xml(tree)
+
+
+def test_stream_stix_data_feed_from_cache(mocker):
+    """
+    Given
+        - A collection of an IP indicator.
+    When
+        - Polling the collection twice.
+    Then
+        - Ensure the indicator is streamed in both polls, but converted to STIX only once.
+    """
+    import TAXIIServer as taxii_server
+    from TAXIIServer import TAXIIServer, APP
+    mocker.patch.object(demisto, 'searchIndicators', return_value=json.loads(IP_INDICATORS))
+    mocker.patch.object(demisto, 'info')
+    create_content_block = mocker.patch.object(taxii_server, 'create_stix_content_block',
+                                               wraps=taxii_server.create_stix_content_block)
+    server = TAXIIServer('example.com', 9000, {'ips': 'type:IP'}, '', '', True, {})
+
+    # Arrange
+    bodies = []
+    for _ in range(2):
+        with APP.test_request_context():
+            response = server.stream_stix_data_feed(['ips'], '1', 'ips', None, None)
+            bodies.append(response.get_data(as_text=True))
+
+    # Assert
+    assert create_content_block.call_count == 1
+    assert server.stix_fragments_cache.hits == 1
+    for body in bodies:
+        assert '52.218.100.20' in body
+        assert body.endswith('</taxii_11:Poll_Response>')
+    assert 'sourcetimestamp:<=' in demisto.searchIndicators.call_args[1]['query']
+
+
+def test_stix_fragments_cache_key():
+    from TAXIIServer import STIXFragmentsCache
+    indicator = json.loads(IP_INDICATORS)['iocs'][0]
+    key = STIXFragmentsCache.get_key(indicator)
+    assert key == (indicator['value'], indicator['indicator_type'], indicator['modified'])
+    assert STIXFragmentsCache.get_key(dict(indicator, modified='2021-01-01T00:00:00Z')) != key
+    assert STIXFragmentsCache.get_key({'value': '1.1.1.1', 'indicator_type': 'IP'}) is None
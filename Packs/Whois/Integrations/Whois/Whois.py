@@ -7,8 +7,14 @@ import sys
 from codecs import encode, decode
 import socks
 import errno
+import sqlite3
+import tempfile
+from contextlib import closing
 
 ENTRY_TYPE = entryTypes['error'] if demisto.params().get('with_error', False) else entryTypes['warning']
+WHOIS_CACHE_PATH = os.path.join(tempfile.gettempdir(), 'whois_cache.sqlite')
+WHOIS_CACHE_DATE_KEY = '__datetime__'
+WHOIS_CACHE_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
 # flake8: noqa
 
@@ -7125,6 +7131,36 @@ dble_ext_str = "chirurgiens-dentistes.fr,in-addr.arpa,uk.net,za.org,mod.uk,org.z
 dble_ext = dble_ext_str.split(",")
 
 
+def build_suffix_trie(suffixes):
+    """
+    Builds a trie of domain suffixes by their labels from the end, so the longest suffix of a domain is found by
+    walking its labels instead of matching it with every suffix.
+    """
+    trie = {}  # type: dict
+    for suffix in suffixes:
+        node = trie
+        for label in reversed(suffix.split(".")):
+            node = node.setdefault(label, {})
+        node[None] = suffix
+    return trie
+
+
+def find_longest_suffix(trie, domain):
+    longest_suffix = None
+    node = trie
+    for label in reversed(domain.split(".")):
+        node = node.get(label)
+        if node is None:
+            break
+        longest_suffix = node.get(None, longest_suffix)
+    return longest_suffix
+
+
+# built once at import
+tlds_trie = build_suffix_trie(tlds)
+dble_ext_trie = build_suffix_trie(dble_ext)
+
+
 def get_whois_raw(domain, server="", previous=None, rfc3490=True, never_cut=False, with_server_list=False,
                   server_list=None):
     previous = previous or []
@@ -7211,10 +7247,7 @@ def get_whois_raw(domain, server="", previous=None, rfc3490=True, never_cut=Fals
 
 
 def get_root_server(domain):
-    ext = domain.split(".")[-1]
-    for dble in dble_ext:
-        if domain.endswith(dble):
-            ext = dble
+    ext = find_longest_suffix(dble_ext_trie, domain) or domain.split(".")[-1]
 
     if ext in tlds.keys():
         entry = tlds[ext]
@@ -8252,11 +8285,72 @@ def get_whois(domain, normalized=None):
                            handle_server=server_list[-1])
 
 
+def encode_whois_result(value):
+    """
+    Converts the dates of a whois result to strings, so it can be kept in the cache as JSON
+    """
+    if isinstance(value, datetime):
+        return {WHOIS_CACHE_DATE_KEY: value.strftime(WHOIS_CACHE_DATE_FORMAT)}
+    if isinstance(value, dict):
+        return {key: encode_whois_result(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [encode_whois_result(val) for val in value]
+    return value
+
+
+def decode_whois_result(value):
+    if isinstance(value, dict):
+        if WHOIS_CACHE_DATE_KEY in value:
+            return datetime.strptime(value[WHOIS_CACHE_DATE_KEY], WHOIS_CACHE_DATE_FORMAT)
+        return {key: decode_whois_result(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [decode_whois_result(val) for val in value]
+    return value
+
+
+def get_current_time():
+    return time.time()
+
+
+def get_cached_whois(domain):
+    """
+    Gets the whois result of a domain from the cache in a local sqlite file, or queries it and adds it to the cache.
+    The cached result includes the raw data. When the cache is full, the oldest results are evicted.
+    """
+    params = demisto.params()
+    cache_ttl = float(params.get('cache_ttl') or 0) * 60 * 60
+    if cache_ttl <= 0:
+        return get_whois(domain)
+    cache_size = int(params.get('cache_size') or 1000)
+    key = domain.lower()
+    now = get_current_time()
+    with closing(sqlite3.connect(WHOIS_CACHE_PATH, timeout=30)) as connection:
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS whois_cache '
+                               '(domain TEXT PRIMARY KEY, time REAL NOT NULL, result TEXT NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS whois_cache_time ON whois_cache (time)')
+        entry = connection.execute('SELECT result FROM whois_cache WHERE domain = ? AND time > ?',
+                                   (key, now - cache_ttl)).fetchone()
+        if entry:
+            demisto.debug('Whois result of {} found in the cache'.format(domain))
+            return decode_whois_result(json.loads(entry[0]))
+
+        whois_result = get_whois(domain)
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO whois_cache VALUES (?, ?, ?)',
+                               (key, now, json.dumps(encode_whois_result(whois_result))))
+            connection.execute('DELETE FROM whois_cache WHERE time <= ?', (now - cache_ttl,))
+            connection.execute('DELETE FROM whois_cache WHERE domain NOT IN '
+                               '(SELECT domain FROM whois_cache ORDER BY time DESC LIMIT ?)', (cache_size,))
+    return whois_result
+
+
 # Drops the mic disable-secrets-detection-end
 
 def get_domain_from_query(query):
     # checks for largest matching suffix inside tlds dictionary
-    suffix_len = max([len(suffix) for suffix in tlds if query.endswith('.{}'.format(suffix))] or [0])
+    suffix = find_longest_suffix(tlds_trie, query.split('.', 1)[1]) if '.' in query else None
+    suffix_len = len(suffix) if suffix else 0
     # if suffix(TLD) was found increase the length by one in order to add the dot before it. --> .com instead of com
     if suffix_len != 0:
         suffix_len += 1
@@ -8357,7 +8451,7 @@ def create_outputs(whois_result, domain, query=None):
 
 def domain_command():
     domain = demisto.args().get('domain')
-    whois_result = get_whois(domain)
+    whois_result = get_cached_whois(domain)
     md, standard_ec, dbot_score = create_outputs(whois_result, domain)
     demisto.results({
         'Type': entryTypes['note'],
@@ -8375,7 +8469,7 @@ def domain_command():
 def whois_command():
     query = demisto.args().get('query')
     domain = get_domain_from_query(query)
-    whois_result = get_whois(domain)
+    whois_result = get_cached_whois(domain)
     md, standard_ec, dbot_score = create_outputs(whois_result, domain, query)
     demisto.results({
         'Type': entryTypes['note'],
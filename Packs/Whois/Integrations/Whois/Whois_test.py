@@ -33,6 +33,56 @@ def test_get_domain_from_query(query, expected):
     assert get_domain_from_query(query) == expected
 
 
+@pytest.mark.parametrize(
+    'domain,expected',
+    [("google.com", "whois.verisign-grs.com"),
+     ("google.co.za", "coza-whois.registry.net.za"),
+     ("paloaltonetworks.aeroport.fr", "whois.smallregistry.net")]
+)
+def test_get_root_server(domain, expected):
+    from Whois import get_root_server
+    assert get_root_server(domain) == expected
+
+
+def test_get_cached_whois(mocker, tmpdir):
+    """
+    Given
+        - The results cache is enabled with a size of 2
+    When
+        - Querying a domain twice, and then two other domains
+        - Querying the first domain after its result expired
+    Then
+        - The domain is queried once and its cached result has the same dates
+        - The oldest result is evicted from the cache
+        - The expired result is queried again
+    """
+    import sqlite3
+    from datetime import datetime
+    whois_result = {'creation_date': [datetime(2020, 1, 1, 12, 30)], 'raw': ['raw data'], 'contacts': {'admin': None}}
+    mocker.patch.object(demisto, 'params', return_value={'cache_ttl': '24', 'cache_size': '2'})
+    mocker.patch.object(Whois, 'WHOIS_CACHE_PATH', str(tmpdir.join('whois_cache.sqlite')))
+    get_whois = mocker.patch.object(Whois, 'get_whois', return_value=whois_result)
+    current_time = mocker.patch.object(Whois, 'get_current_time', return_value=1)
+
+    assert Whois.get_cached_whois('google.com') == whois_result
+    assert Whois.get_cached_whois('Google.com') == whois_result
+    assert get_whois.call_count == 1
+
+    current_time.return_value = 2
+    Whois.get_cached_whois('google.co.il')
+    current_time.return_value = 3
+    Whois.get_cached_whois('google.co.uk')
+    assert get_whois.call_count == 3
+    connection = sqlite3.connect(Whois.WHOIS_CACHE_PATH)
+    assert {row[0] for row in connection.execute('SELECT domain FROM whois_cache')} == {'google.co.il',
+                                                                                        'google.co.uk'}
+    connection.close()
+
+    current_time.return_value = 3 + 24 * 60 * 60
+    Whois.get_cached_whois('google.co.uk')
+    assert get_whois.call_count == 4
+
+
 def test_socks_proxy_fail(mocker):
     mocker.patch.object(demisto, 'params', return_value={'proxy_url': 'socks5://localhost:1180'})
     mocker.patch.object(demisto, 'command', return_value='test-module')
@@ -2,7 +2,11 @@ import os
 import threading
 import sys
 import json
+import time
+import hashlib
+import struct
 import traceback
+from collections import OrderedDict
 
 if sys.version_info[0] < 3:
     import Queue as queue
@@ -12,10 +16,26 @@ else:
 __read_thread = None
 __input_queue = None
 
+# the number of compiled scripts to keep, so a warm container does not compile the same script on every execution
+COMPILED_CODE_CACHE_SIZE = 10
+__compiled_code_cache = OrderedDict()
+
 win = sys.platform.startswith('win')
 if win:
     __input_queue = queue.Queue()
 
+# Optional length-prefixed framing of the messages, which the server enables by the DEMISTO_FRAMED_IPC environment
+# variable. Each frame is a header (payload size and flags) and a payload of up to MAX_FRAME_SIZE bytes, a message
+# spans frames until a frame without FRAME_FLAG_MORE, so large results are sent in chunks.
+FRAMED_IPC = not win and os.environ.get('DEMISTO_FRAMED_IPC', '').lower() == 'true'
+FRAME_HEADER = struct.Struct('>IB')
+FRAME_FLAG_MORE = 1
+MAX_FRAME_SIZE = 64 * 1024
+__stdin_bytes = getattr(sys.stdin, 'buffer', sys.stdin)
+__stdout_bytes = getattr(sys.stdout, 'buffer', sys.stdout)
+# the number of requests sent without waiting for their responses (framed mode only)
+__pending_responses = 0
+
 
 def read_input_loop():
     global __input_queue
@@ -26,7 +46,77 @@ def read_input_loop():
             break
 
 
+def __read_exactly(size):
+    data = b''
+    while len(data) < size:
+        chunk = __stdin_bytes.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def __read_message():
+    """Reads a framed message, returns an empty string if the input was closed"""
+    parts = []
+    while True:
+        header = __read_exactly(FRAME_HEADER.size)
+        if header is None:
+            return ''
+        size, flags = FRAME_HEADER.unpack(header)
+        payload = __read_exactly(size)
+        if payload is None:
+            return ''
+        parts.append(payload)
+        if not flags & FRAME_FLAG_MORE:
+            return b''.join(parts).decode('utf-8')
+
+
+def __write_message(chunks):
+    """Writes a message, given as encoded chunks, in frames"""
+    sys.stdout.flush()
+    buff = bytearray()
+    for chunk in chunks:
+        buff.extend(chunk)
+        while len(buff) > MAX_FRAME_SIZE:
+            __stdout_bytes.write(FRAME_HEADER.pack(MAX_FRAME_SIZE, FRAME_FLAG_MORE) + bytes(buff[:MAX_FRAME_SIZE]))
+            del buff[:MAX_FRAME_SIZE]
+    __stdout_bytes.write(FRAME_HEADER.pack(len(buff), 0) + bytes(buff))
+    __stdout_bytes.flush()
+
+
+def __send_message(message):
+    """Sends a message (a JSON serializable object) to the server"""
+    if FRAMED_IPC:
+        __write_message(chunk.encode('utf-8') for chunk in json.JSONEncoder().iterencode(message))
+    else:
+        json.dump(message, sys.stdout)
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+
+
+def __send_request(request, wait_for_response=True):
+    """Sends a request to the server and returns its response. In framed mode, a request that does not wait for
+    its response is pipelined - its response is skipped when the next response is read"""
+    global __pending_responses
+    __send_message(request)
+    if FRAMED_IPC and not wait_for_response:
+        __pending_responses += 1
+        return None
+    __skip_pending_responses()
+    return __readWhileAvailable()
+
+
+def __skip_pending_responses():
+    global __pending_responses
+    while __pending_responses:
+        __readWhileAvailable()
+        __pending_responses -= 1
+
+
 def __readWhileAvailable():
+    if FRAMED_IPC:
+        return __read_message()
     if win:
         # An ugly solution - just open a blocking thread to handle input
         global __input_queue
@@ -65,9 +155,7 @@ class Demisto:
             os.environ['DEMISTO_MACHINE_LEARNING_MAGIC_KEY'] = args['demisto_machine_learning_magic_key']
 
     def log(self, msg):
-        json.dump({'type': 'entryLog', 'args': {'message': msg}}, sys.stdout)
-        sys.stdout.write('\\n')
-        sys.stdout.flush()
+        globals()['__sendMessage']({'type': 'entryLog', 'args': {'message': msg}})
 
     def investigation(self):
         return self.callingContext[u'context'][u'Inv']
@@ -121,12 +209,12 @@ class Demisto:
     def info(self, *args):
         argsObj = {}
         argsObj["args"] = list(args)
-        self.__do({'type': 'log', 'command': 'info', 'args': argsObj})
+        self.__do({'type': 'log', 'command': 'info', 'args': argsObj}, wait_for_response=False)
 
     def error(self, *args):
         argsObj = {}
         argsObj["args"] = list(args)
-        self.__do({'type': 'log', 'command': 'error', 'args': argsObj})
+        self.__do({'type': 'log', 'command': 'error', 'args': argsObj}, wait_for_response=False)
 
     def exception(self, ex):
         return self.__do({'type': 'exception', 'command': 'exception', 'args': ex})
@@ -134,7 +222,7 @@ class Demisto:
     def debug(self, *args):
         argsObj = {}
         argsObj["args"] = list(args)
-        self.__do({'type': 'log', 'command': 'debug', 'args': argsObj})
+        self.__do({'type': 'log', 'command': 'debug', 'args': argsObj}, wait_for_response=False)
 
     def getAllSupportedCommands(self):
         return self.__do({'type': 'getAllModulesSupportedCmds'})
@@ -148,17 +236,12 @@ class Demisto:
     def dt(self, data, q):
         return self.__do({'type': 'dt', 'name': q, 'value': data})['result']
 
-    def __do(self, cmd):
+    def __do(self, cmd, wait_for_response=True):
         # Watch out there is another defintion like this
-        # prepare command to send to server
-        json.dump(cmd, sys.stdout)
-        sys.stdout.write('\\n')
-
-        # send command to Demisto server
-        sys.stdout.flush()
-
-        # wait to receive response from Demisto server
-        data = globals()['__readWhileAvailable']()
+        # send command to Demisto server and wait to receive its response
+        data = globals()['__sendRequest'](cmd, wait_for_response)
+        if data is None:
+            return None
         if data.find('$$##') > -1:
             raise ValueError(data[4:])
         return json.loads(data)
@@ -189,9 +272,7 @@ class Demisto:
         else:
             res.append(converted)
 
-        json.dump({'type': 'result', 'results': res}, sys.stdout)
-        sys.stdout.write('\\n')
-        sys.stdout.flush()
+        globals()['__sendMessage']({'type': 'result', 'results': res})
 
 demisto = Demisto(context)
 
@@ -234,9 +315,7 @@ class Demisto:
             os.environ['DEMISTO_MACHINE_LEARNING_MAGIC_KEY'] = args['demisto_machine_learning_magic_key']
 
     def log(self, msg):
-        json.dump({'type': 'entryLog', 'args': {'message': 'Integration log: ' + msg}}, sys.stdout)
-        sys.stdout.write('\\n')
-        sys.stdout.flush()
+        globals()['__sendMessage']({'type': 'entryLog', 'args': {'message': 'Integration log: ' + msg}})
 
     def investigation(self):
         return self.callingContext[u'context'][u'Inv']
@@ -299,17 +378,17 @@ class Demisto:
     def info(self, *args):
         argsObj = {}
         argsObj["args"] = list(args)
-        self.__do({'type': 'log', 'command': 'info', 'args': argsObj})
+        self.__do({'type': 'log', 'command': 'info', 'args': argsObj}, wait_for_response=False)
 
     def error(self, *args):
         argsObj = {}
         argsObj["args"] = list(args)
-        self.__do({'type': 'log', 'command': 'error', 'args': argsObj})
+        self.__do({'type': 'log', 'command': 'error', 'args': argsObj}, wait_for_response=False)
 
     def debug(self, *args):
         argsObj = {}
         argsObj["args"] = list(args)
-        self.__do({'type': 'log', 'command': 'debug', 'args': argsObj})
+        self.__do({'type': 'log', 'command': 'debug', 'args': argsObj}, wait_for_response=False)
 
     def gets(self, obj, field):
         return str(self.get(obj, field))
@@ -323,12 +402,11 @@ class Demisto:
     def dt(self, data, q):
         return self.__do({'type': 'dt', 'name': q, 'value': data})['result']
 
-    def __do(self, cmd):
+    def __do(self, cmd, wait_for_response=True):
         # Watch out there is another defintion like this
-        json.dump(cmd, sys.stdout)
-        sys.stdout.write('\\n')
-        sys.stdout.flush()
-        data = globals()['__readWhileAvailable']()
+        data = globals()['__sendRequest'](cmd, wait_for_response)
+        if data is None:
+            return None
         if data.find('$$##') > -1:
             raise ValueError(data[4:])
         return json.loads(data)
@@ -356,9 +434,7 @@ class Demisto:
             res = converted
         else:
             res.append(converted)
-        json.dump({'type': 'result', 'results': res}, sys.stdout)
-        sys.stdout.write('\\n')
-        sys.stdout.flush()
+        globals()['__sendMessage']({'type': 'result', 'results': res})
 
     def incidents(self, incidents):
         self.results({'Type': 1, 'Contents': json.dumps(incidents), 'ContentsFormat': 'json'})
@@ -392,12 +468,40 @@ print = demisto_print
 # delete home dir and tmp dir
 
 
+def get_compiled_code(code_string, is_integ_script):
+    """Compiles the script with its template, or gets it from the cache if the same script was already compiled"""
+    code_key = (is_integ_script, hashlib.sha256(code_string.encode('utf-8')).hexdigest())
+    code = __compiled_code_cache.pop(code_key, None)
+    is_cached = code is not None
+    if not is_cached:
+        if is_integ_script:
+            complete_code = integ_template_code.replace('###CODE_HERE###', code_string)
+        else:
+            complete_code = template_code.replace('###CODE_HERE###', code_string)
+        code = compile(complete_code, '<string>', 'exec')
+        if len(__compiled_code_cache) >= COMPILED_CODE_CACHE_SIZE:
+            # evict the least recently used script
+            __compiled_code_cache.popitem(last=False)
+    __compiled_code_cache[code_key] = code
+    return code, is_cached
+
+
+def send_loop_message(message):
+    if FRAMED_IPC:
+        __send_message(message)
+    else:
+        json.dump(message, sys.stdout)
+        sys.stdout.write('\\n')
+        sys.stdout.flush()
+
+
 # notifies demisto server that the current executed script is completed
 # and the process is ready to execute the next script
-def send_script_completed():
-    json.dump({'type': 'completed'}, sys.stdout)
-    sys.stdout.write('\\n')
-    sys.stdout.flush()
+def send_script_completed(timing=None):
+    completed = {'type': 'completed'}
+    if timing:
+        completed['timing'] = timing
+    send_loop_message(completed)
 
 
 def send_script_exception(exc_type, exc_value, exc_traceback):
@@ -405,15 +509,11 @@ def send_script_exception(exc_type, exc_value, exc_traceback):
     if ex_string == 'None\n':
         ex_string = str(ex)
 
-    json.dump({'type': 'exception', 'args': {'exception': ex_string}}, sys.stdout)
-    sys.stdout.write('\\n')
-    sys.stdout.flush()
+    send_loop_message({'type': 'exception', 'args': {'exception': ex_string}})
 
 
 def send_pong():
-    json.dump({'type': 'pong'}, sys.stdout)
-    sys.stdout.write('\\n')
-    sys.stdout.flush()
+    send_loop_message({'type': 'pong'})
 
 
 # receives ping and sends back pong until we get something else
@@ -421,7 +521,7 @@ def send_pong():
 def do_ping_pong():
     while True:
         ping = __readWhileAvailable()
-        if ping == 'ping\n':
+        if ping == 'ping\n' or (FRAMED_IPC and ping == 'ping'):
             send_pong()  # return pong to server to indicate that everything is fine
         else:
             return ping
@@ -450,22 +550,25 @@ while True:
     contextJSON.pop('script', None)
 
     is_integ_script = contextJSON['integration']
-    complete_code = ''
-    if is_integ_script:
-        complete_code = integ_template_code.replace('###CODE_HERE###', code_string)
-    else:
-        complete_code = template_code.replace('###CODE_HERE###', code_string)
+    # timing of the execution in milliseconds, reported back to the server
+    timing = {}
+    start_time = time.time()
 
     try:
-        code = compile(complete_code, '<string>', 'exec')
+        code, timing['compiledCodeCached'] = get_compiled_code(code_string, is_integ_script)
+        compiled_time = time.time()
+        timing['compileTime'] = int((compiled_time - start_time) * 1000)
 
         sub_globals = {
             '__readWhileAvailable': __readWhileAvailable,
+            '__sendMessage': __send_message,
+            '__sendRequest': __send_request,
             'context': contextJSON,
             'win': win
         }
 
         exec(code, sub_globals, sub_globals)  # guardrails-disable-line
+        timing['executionTime'] = int((time.time() - compiled_time) * 1000)
 
     except Exception as ex:
         exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -476,8 +579,11 @@ while True:
 
     rollback_system()
 
+    # the responses of pipelined requests must be read before the next script
+    __skip_pending_responses()
+    timing['totalTime'] = int((time.time() - start_time) * 1000)
     # ping back to Demisto server that script is completed
-    send_script_completed()
+    send_script_completed(timing)
 
     # if the script running on native python then terminate the process after finished the script
     is_python_native = contextJSON['native']